@@ -0,0 +1,8 @@
+"""
+Micro-benchmarks for pyrallel's queues.
+
+Each module can be run directly, for example::
+
+    python -m pyrallel.benchmarks.header_codec
+    python -m pyrallel.benchmarks.queues --output queues.json
+"""
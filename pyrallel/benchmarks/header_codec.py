@@ -0,0 +1,98 @@
+"""
+Benchmark the ShmQueue block header codec.
+
+It compares, for the header fields touched by one single-chunk message (written by `put`,
+read back by `get`), the per-field access that `ShmQueue` used to do (a `META_STRUCT` lookup,
+a slice and a `struct.pack` / `struct.unpack` call per field) with the precompiled whole-header
+codec (`ShmQueue.set_header` / `ShmQueue.get_header`).  It also reports the end-to-end cost of
+an in-process `put` + `get` of a small message, so the header overhead can be put in proportion::
+
+    python -m pyrallel.benchmarks.header_codec --messages 100000
+"""
+
+import argparse
+import struct
+import sys
+import time
+import typing
+
+from pyrallel.queue import ShmQueue
+
+
+PUT_FIELDS = ['msg_id', 'src_pid', 'msg_size', 'chunk_id', 'total_chunks', 'msg_flags',
+              'next_chunk_block_id', 'msg_id', 'src_pid']
+"""The fields `put` used to write one at a time for a single-chunk message
+(msg_id and src_pid were written twice: on reservation and with the chunk)."""
+
+GET_FIELDS = ['src_pid', 'msg_id', 'total_chunks', 'next_chunk_block_id', 'msg_size', 'msg_flags']
+"""The fields `get` used to read one at a time for a single-chunk message."""
+
+
+def legacy_get_meta(block: memoryview, type_: str) -> typing.Union[bytes, int]:
+    addr_s, addr_e, ctype = ShmQueue.META_STRUCT.get(type_, (None, None, None))
+    if addr_s is None or addr_e is None or ctype is None:
+        raise ValueError("get_meta: unrecognized %s" % repr(type_))
+    return struct.unpack(ctype, block[addr_s: addr_e])[0]
+
+
+def legacy_set_meta(block: memoryview, data, type_: str):
+    addr_s, addr_e, ctype = ShmQueue.META_STRUCT.get(type_, (None, None, None))
+    if addr_s is None or addr_e is None or ctype is None:
+        raise ValueError("set_meta: unrecognized %s" % repr(type_))
+    block[addr_s: addr_e] = struct.pack(ctype, data)
+
+
+def bench_legacy(block: memoryview, n: int) -> float:
+    values = {'msg_id': b'000000000001', 'src_pid': 1234, 'msg_size': 40, 'chunk_id': 1, 'total_chunks': 1,
+              'msg_flags': 0, 'next_chunk_block_id': ShmQueue.RESERVED_BLOCK_ID}
+    time_start = time.perf_counter()
+    for _ in range(n):
+        for field in PUT_FIELDS:
+            legacy_set_meta(block, values[field], field)
+        for field in GET_FIELDS:
+            legacy_get_meta(block, field)
+    return time.perf_counter() - time_start
+
+
+def bench_codec(q: ShmQueue, block: memoryview, n: int) -> float:
+    reserved = ShmQueue.RESERVED_BLOCK_ID
+    time_start = time.perf_counter()
+    for _ in range(n):
+        q.set_header(block, b'000000000001', 40, 1, 1, 0, 0, 1234, reserved, reserved, 0)
+        q.get_header(block)
+    return time.perf_counter() - time_start
+
+
+def bench_put_get(q: ShmQueue, n: int) -> float:
+    msg = (0, (('task', 1), {}))
+    time_start = time.perf_counter()
+    for _ in range(n):
+        q.put(msg)
+        q.get()
+    return time.perf_counter() - time_start
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000, help='number of messages to time')
+    args = parser.parse_args(argv)
+
+    q = ShmQueue(chunk_size=256, maxsize=4)
+    try:
+        # A scratch header: the queue's own blocks are linked on its free list.
+        block = memoryview(bytearray(ShmQueue.META_BLOCK_SIZE))
+        legacy = bench_legacy(block, args.messages)
+        codec = bench_codec(q, block, args.messages)
+        put_get = bench_put_get(q, args.messages)
+    finally:
+        q.close()
+
+    per_msg = lambda seconds: seconds / args.messages * 1e6
+    print('header access, per-field (legacy): %8.3f us/message' % per_msg(legacy))
+    print('header access, precompiled codec:  %8.3f us/message' % per_msg(codec))
+    print('header overhead reduction:         %8.3f us/message (%.1fx)' % (per_msg(legacy - codec), legacy / codec))
+    print('in-process put + get, small msg:   %8.3f us/message' % per_msg(put_get))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
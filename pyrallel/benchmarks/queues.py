@@ -0,0 +1,219 @@
+"""
+Benchmark the throughput and latency of the queues that pyrallel can use between processes:
+`ShmQueue`, `multiprocess.Queue` and `map_reduce.ChunkedQueue`.
+
+Every combination of the swept parameters is one case.  In each case, producer processes put
+timestamped messages of a fixed size as fast as they can while consumer processes get them and
+record the latency of each message.  A case reports its throughput in messages and megabytes per
+second, and its p50 and p99 latency.  `--chunk-sizes` and `--use-semaphores` only apply to
+`ShmQueue`.  A case that cannot run, such as a message that needs more `ShmQueue` chunks than
+`--depths` allows, is recorded as skipped.
+
+The results go to a JSON file that also records the Python version, the platform and the pyrallel
+version, so runs from different releases can be compared::
+
+    python -m pyrallel.benchmarks.queues --sizes 16,1K,64K,1M --producers 1,4 --start-methods fork,spawn \\
+        --output queues.json
+"""
+
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import typing
+
+import multiprocess  # type: ignore
+
+from pyrallel.__version__ import __version__
+from pyrallel.map_reduce import ChunkedQueue
+from pyrallel.queue import ShmQueue
+
+
+QUEUES = ['shm', 'mp', 'chunked']
+"""The queue kinds: `ShmQueue`, `multiprocess.Queue` and `map_reduce.ChunkedQueue`."""
+
+DEFAULT_SIZES = '16,1K,64K,1M,16M,256M'
+"""The default message sizes."""
+
+PICKLE_OVERHEAD = 64
+"""An upper bound on the bytes that pickling a timestamped message adds to its payload."""
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+
+def parse_size(text: str) -> int:
+    """int: Parse a size such as `64K` or `256M`."""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(text[:-1]) * SIZE_SUFFIXES[text[-1]]
+    return int(text)
+
+
+def parse_list(text: str, parse: typing.Callable[[str], typing.Any] = int) -> typing.List[typing.Any]:
+    """Parse a comma-separated list."""
+    return [parse(item) for item in text.split(',') if item.strip()]
+
+
+def percentile(sorted_values: typing.List[float], fraction: float) -> typing.Optional[float]:
+    """The nearest-rank percentile of sorted values, or None if there are none."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def producer(q, start, count: int, msg_size: int):
+    payload = b'\0' * msg_size
+    start.wait()
+    for _ in range(count):
+        q.put((time.monotonic(), payload))
+
+
+def consumer(q, start, results):
+    latencies = []
+    end = None
+    start.wait()
+    while True:
+        msg = q.get()
+        if msg is None:
+            break
+        end = time.monotonic()
+        latencies.append(end - msg[0])
+    results.put((end, latencies))
+
+
+def make_queue(queue: str, ctx, depth: int, chunk_size: int, use_semaphores: bool):
+    """Create the queue of a case."""
+    if queue == 'shm':
+        return ShmQueue(chunk_size=chunk_size, maxsize=depth, use_semaphores=use_semaphores)
+    if queue == 'mp':
+        return ctx.Queue(maxsize=depth)
+    return ChunkedQueue(maxsize=depth)
+
+
+def run_case(queue: str, start_method: str, msg_size: int, chunk_size: int, depth: int, use_semaphores: bool,
+             producers: int, consumers: int, messages: int) -> typing.Dict[str, typing.Any]:
+    """Run one case and return its result record."""
+    result: typing.Dict[str, typing.Any] = {
+        'queue': queue, 'start_method': start_method, 'msg_size': msg_size, 'depth': depth,
+        'producers': producers, 'consumers': consumers, 'messages': messages,
+        'chunk_size': chunk_size if queue == 'shm' else None,
+        'use_semaphores': use_semaphores if queue == 'shm' else None,
+    }
+    if queue == 'shm' and math.ceil((msg_size + PICKLE_OVERHEAD) / chunk_size) > depth:
+        result['skipped'] = 'a message needs more chunks than the queue has blocks'
+        return result
+
+    # ShmQueue is built on the standard library's multiprocessing, the other queues on multiprocess.
+    # The queues take their locks from the default context, so the start method is switched globally.
+    library = multiprocessing if queue == 'shm' else multiprocess
+    library.set_start_method(start_method, force=True)
+    ctx = library.get_context()
+    q = make_queue(queue, ctx, depth, chunk_size, use_semaphores)
+    # Every process waits here, so the clock starts once they are all up (spawn is slow to start).
+    start = ctx.Barrier(producers + consumers + 1)
+    results = ctx.Queue()
+    per_producer = [messages // producers + (1 if i < messages % producers else 0) for i in range(producers)]
+    producer_processes = [ctx.Process(target=producer, args=(q, start, count, msg_size)) for count in per_producer]
+    consumer_processes = [ctx.Process(target=consumer, args=(q, start, results)) for _ in range(consumers)]
+    try:
+        for p in producer_processes + consumer_processes:
+            p.start()
+        start.wait()
+        time_start = time.monotonic()
+        for p in producer_processes:
+            p.join()
+        for _ in consumer_processes:
+            q.put(None)
+        ends = []
+        latencies: typing.List[float] = []
+        for _ in consumer_processes:
+            end, consumer_latencies = results.get()
+            if end is not None:
+                ends.append(end)
+            latencies.extend(consumer_latencies)
+        for p in consumer_processes:
+            p.join()
+    finally:
+        if queue == 'shm':
+            q.close()
+
+    seconds = max(ends) - time_start if ends else 0.0
+    latencies.sort()
+    result.update({
+        'seconds': seconds,
+        'msgs_per_sec': messages / seconds if seconds > 0 else None,
+        'mb_per_sec': messages * msg_size / seconds / 1e6 if seconds > 0 else None,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p99': percentile(latencies, 0.99),
+    })
+    return result
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queues', default=','.join(QUEUES), help='queues to compare, from %s' % ','.join(QUEUES))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='message sizes in bytes (K and M suffixes are allowed)')
+    parser.add_argument('--chunk-sizes', default='1M', help='ShmQueue chunk sizes')
+    parser.add_argument('--depths', default='16', help='queue depths (maxsize)')
+    parser.add_argument('--use-semaphores', default='1', help='ShmQueue use_semaphores settings (1 or 0)')
+    parser.add_argument('--producers', default='1', help='numbers of producer processes')
+    parser.add_argument('--consumers', default='1', help='numbers of consumer processes')
+    parser.add_argument('--start-methods', default='fork', help='multiprocessing start methods')
+    parser.add_argument('--messages', type=int, default=10000, help='maximum number of messages per case')
+    parser.add_argument('--bytes-per-case', default='1G',
+                        help='the number of messages of a case is capped to this many bytes (at least 4 messages)')
+    parser.add_argument('--output', default='queue_benchmark.json', help='the JSON results file')
+    args = parser.parse_args(argv)
+
+    queues = parse_list(args.queues, str)
+    unknown = set(queues) - set(QUEUES)
+    if unknown:
+        parser.error('unknown queues: %s' % ','.join(sorted(unknown)))
+    bytes_per_case = parse_size(args.bytes_per_case)
+
+    results = []
+    for start_method in parse_list(args.start_methods, str):
+        for queue in queues:
+            for msg_size in parse_list(args.sizes, parse_size):
+                messages = max(4, min(args.messages, bytes_per_case // max(1, msg_size)))
+                for chunk_size in parse_list(args.chunk_sizes, parse_size) if queue == 'shm' else [0]:
+                    for use_semaphores in [bool(v) for v in parse_list(args.use_semaphores)] if queue == 'shm' else [True]:
+                        for depth in parse_list(args.depths):
+                            for producers in parse_list(args.producers):
+                                for consumers in parse_list(args.consumers):
+                                    result = run_case(queue, start_method, msg_size, chunk_size, depth, use_semaphores,
+                                                      producers, consumers, messages)
+                                    results.append(result)
+                                    print(format_result(result), flush=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'pyrallel_version': __version__,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'date': datetime.datetime.now().isoformat(),
+            'argv': sys.argv[1:] if argv is None else argv,
+            'results': results,
+        }, f, indent=2)
+    print('results written to %s' % args.output)
+
+
+def format_result(result: typing.Dict[str, typing.Any]) -> str:
+    """str: One line summary of a result record."""
+    case = '%-7s %-5s size=%-10d chunk=%-10s depth=%-4d sem=%-5s p=%d c=%d' % (
+        result['queue'], result['start_method'], result['msg_size'], result['chunk_size'], result['depth'],
+        result['use_semaphores'], result['producers'], result['consumers'])
+    if 'skipped' in result:
+        return '%s  skipped: %s' % (case, result['skipped'])
+    return '%s  %10.1f msg/s %9.1f MB/s  p50=%.6fs p99=%.6fs' % (
+        case, result['msgs_per_sec'] or 0, result['mb_per_sec'] or 0, result['latency_p50'] or 0, result['latency_p99'] or 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Compression codecs for the queues.
+
+A codec compresses a serialized message before it is put on a queue and decompresses it after
+it is taken off.  Each codec has a small integer id that the queues store with the message
+(in the block metadata for `ShmQueue`, in the chunk dict for `ChunkedQueue`), so a message is
+always decompressed with the codec it was compressed with and uncompressed messages carry id 0.
+
+Messages shorter than the threshold are never compressed, and a message is sent uncompressed
+if compressing it does not make it smaller, so small messages do not pay the compression cost.
+
+The stdlib codecs `zlib`, `bz2` and `lzma` are registered by default.  Other codecs can be added
+with `register_codec`.
+
+Example::
+
+    q = ShmQueue(chunk_size=1024 * 1024, maxsize=8, compression='zlib', compression_threshold=64 * 1024)
+"""
+__all__ = ['Codec', 'register_codec', 'get_codec', 'compress', 'decompress', 'DEFAULT_COMPRESSION_THRESHOLD']
+
+import bz2
+import lzma
+import typing
+import zlib
+
+
+DEFAULT_COMPRESSION_THRESHOLD: int = 64 * 1024
+"""int: Serialized messages shorter than this many bytes are not compressed."""
+
+
+class Codec(object):
+    """
+    A compression codec.
+
+    Args:
+        codec_id (int): The id stored with compressed messages, between 1 and `Codec.MAX_CODEC_ID`.
+                        It must be the same in every process that uses the queue.
+        name (str): The name used to select the codec.
+        compress (Callable): `compress(data) -> bytes`, where `data` is a bytes-like object.
+        decompress (Callable): `decompress(data) -> bytes`, where `data` is a bytes-like object.
+    """
+
+    MAX_CODEC_ID: int = 0xff
+    """int: Codec ids must fit in a byte."""
+
+    def __init__(self, codec_id: int, name: str,
+                 compress: typing.Callable[[typing.Any], bytes],
+                 decompress: typing.Callable[[typing.Any], bytes]):
+        if not 0 < codec_id <= self.__class__.MAX_CODEC_ID:
+            raise ValueError("codec_id must be between 1 and %d." % self.__class__.MAX_CODEC_ID)
+        self.codec_id = codec_id
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return '<Codec %d %s>' % (self.codec_id, self.name)
+
+
+_codecs_by_id: typing.Dict[int, Codec] = {}
+_codecs_by_name: typing.Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """
+    Register a codec so that it can be selected by name and decoded by id.
+
+    Args:
+        codec (Codec): The codec.
+
+    Raises:
+        ValueError: Another codec is registered with the same id or name.
+    """
+    for registered in (_codecs_by_id.get(codec.codec_id), _codecs_by_name.get(codec.name)):
+        if registered is not None and registered is not codec:
+            raise ValueError("Codec %r conflicts with registered codec %r." % (codec, registered))
+    _codecs_by_id[codec.codec_id] = codec
+    _codecs_by_name[codec.name] = codec
+
+
+def get_codec(codec: typing.Union[None, str, Codec]) -> typing.Optional[Codec]:
+    """
+    Look up a codec.
+
+    Args:
+        codec (None, str or Codec): A codec name, a codec, or None for no compression.
+
+    Returns:
+        Codec: The codec, or None.
+
+    Raises:
+        ValueError: There is no codec with that name.
+    """
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    if codec not in _codecs_by_name:
+        raise ValueError("Unknown codec %r, expected one of %s." % (codec, ', '.join(sorted(_codecs_by_name))))
+    return _codecs_by_name[codec]
+
+
+def compress(codec: typing.Optional[Codec], data, threshold: int = DEFAULT_COMPRESSION_THRESHOLD) \
+        -> typing.Tuple[int, typing.Any]:
+    """
+    Compress a serialized message if it is worth it.
+
+    Args:
+        codec (Codec): The codec, or None for no compression.
+        data (bytes-like): The serialized message.
+        threshold (int, optional): Messages shorter than this are not compressed.
+
+    Returns:
+        tuple: The codec id (0 if the message was not compressed) and the data to send.
+    """
+    size = memoryview(data).nbytes
+    if codec is None or size < threshold:
+        return 0, data
+    compressed = codec.compress(data)
+    if len(compressed) >= size:
+        return 0, data
+    return codec.codec_id, compressed
+
+
+def decompress(codec_id: int, data):
+    """
+    Undo `compress`.
+
+    Args:
+        codec_id (int): The codec id returned by `compress`.
+        data (bytes-like): The data that was sent.
+
+    Returns:
+        bytes-like: The serialized message.
+
+    Raises:
+        ValueError: The codec id is not registered in this process.
+    """
+    if codec_id == 0:
+        return data
+    if codec_id not in _codecs_by_id:
+        raise ValueError("Unknown codec id %d." % codec_id)
+    return _codecs_by_id[codec_id].decompress(data)
+
+
+register_codec(Codec(1, 'zlib', zlib.compress, zlib.decompress))
+register_codec(Codec(2, 'bz2', bz2.compress, bz2.decompress))
+register_codec(Codec(3, 'lzma', lzma.compress, lzma.decompress))
@@ -48,6 +48,7 @@ import pickle
 import math
 
 from pyrallel import Paralleller
+from pyrallel import codec
 
 
 logger = logging.getLogger('MapReduce')
@@ -58,12 +59,30 @@ logger.addHandler(stdout_handler)
 
 
 class ChunkedQueue(mpq.Queue):
+    """
+    A queue that pickles messages and sends them down the pipe in chunks of at most `CHUNK_SIZE` bytes.
+
+    Args:
+        compression (str or codec.Codec, optional): The codec used to compress pickled messages of at least
+                        `compression_threshold` bytes (see `pyrallel.codec`), None (default) for no compression.
+        compression_threshold (int, optional): Pickled messages shorter than this are never compressed.
+    """
     CHUNK_SIZE = 512 * 1024 * 1024
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, compression=None, compression_threshold=codec.DEFAULT_COMPRESSION_THRESHOLD, **kwargs):
         ctx = mp.get_context()
         super().__init__(*args, **kwargs, ctx=ctx)
         self.buff = {}
+        self.codec = codec.get_codec(compression)
+        self.compression_threshold = compression_threshold
+
+    def __getstate__(self):
+        return super().__getstate__() + (self.codec, self.compression_threshold)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-2])
+        self.codec, self.compression_threshold = state[-2:]
+        self.buff = {}
 
     def put(self, obj, block=True, timeout=None):
         if not block:
@@ -71,7 +90,7 @@ class ChunkedQueue(mpq.Queue):
 
         chunk_size = self.__class__.CHUNK_SIZE
         msg_id = uuid.uuid4()
-        msg_bytes = pickle.dumps(obj)
+        codec_id, msg_bytes = codec.compress(self.codec, pickle.dumps(obj), self.compression_threshold)
         num_of_chunks = math.ceil(len(msg_bytes) / chunk_size)
         logger.debug('putting data: #%s [%d], size: %d', msg_id, num_of_chunks, len(msg_bytes))
         for i in range(num_of_chunks):
@@ -79,7 +98,8 @@ class ChunkedQueue(mpq.Queue):
                 'b': msg_bytes[i * chunk_size : (i + 1) * chunk_size],  # body
                 'u': msg_id,  # msg id
                 'i': i + 1,  # chunk id
-                'n': num_of_chunks  # total number of chunks
+                'n': num_of_chunks,  # total number of chunks
+                'c': codec_id  # codec id, 0 if not compressed
             }
             super().put(obj=msg_obj, block=block, timeout=timeout)
 
@@ -92,14 +112,14 @@ class ChunkedQueue(mpq.Queue):
             logger.debug('getting data: #%s [%d/%d]', msg_obj['u'], msg_obj['i'], msg_obj['n'])
             # small message
             if msg_obj['u'] not in self.buff and msg_obj['i'] == msg_obj['n']:
-                return pickle.loads(msg_obj['b'])
+                return pickle.loads(codec.decompress(msg_obj['c'], msg_obj['b']))
 
             # chunked message
             if msg_obj['u'] not in self.buff:
                 self.buff[msg_obj['u']] = [None] * msg_obj['n']
             self.buff[msg_obj['u']][msg_obj['i']-1] = msg_obj['b']
             if msg_obj['i'] == msg_obj['n']:
-                msg = pickle.loads(b''.join(self.buff[msg_obj['u']]))
+                msg = pickle.loads(codec.decompress(msg_obj['c'], b''.join(self.buff[msg_obj['u']])))
                 del self.buff[msg_obj['u']]
                 return msg
 
@@ -113,6 +133,9 @@ class MapReduce(Paralleller):
                         `object` arguments are the returns from `mapper` s.
         mapper_queue_size (int, optional): Maximum size of mapper queue, 0 by default means unlimited.
         reducer_queue_size (int, optional): Maximum size of reduce queue, 0 by default means unlimited.
+        compression (str, optional): Codec to compress large outputs sent to the reducers and the result with \
+                        (e.g. 'zlib', see `pyrallel.codec`), None by default means no compression.
+        compression_threshold (int, optional): Outputs whose pickle is shorter than this are not compressed.
     """
 
     CMD_NO_NEW_DATA = 1  # no more new user data
@@ -124,10 +147,12 @@ class MapReduce(Paralleller):
     CMD_REDUCER_FINISH = 7  # reducer finished
 
     def __init__(self, num_of_process: int, mapper: Callable, reducer: Callable,
-                 mapper_queue_size: int = 0, reducer_queue_size: int = 0):
+                 mapper_queue_size: int = 0, reducer_queue_size: int = 0,
+                 compression: str = None, compression_threshold: int = codec.DEFAULT_COMPRESSION_THRESHOLD):
         self._mapper_queue = mp.Queue(maxsize=mapper_queue_size)
-        self._reducer_queue = ChunkedQueue(maxsize=reducer_queue_size)
-        self._result_queue = ChunkedQueue()
+        self._reducer_queue = ChunkedQueue(maxsize=reducer_queue_size, compression=compression,
+                                           compression_threshold=compression_threshold)
+        self._result_queue = ChunkedQueue(compression=compression, compression_threshold=compression_threshold)
         self._mapper_cmd_queue = [mp.Queue() for _ in range(num_of_process)]
         self._reducer_cmd_queue = [mp.Queue() for _ in range(num_of_process)]
         self._manager_cmd_queue = mp.Queue()
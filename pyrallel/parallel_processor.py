@@ -88,17 +88,19 @@ In some situations, you may need to use `collector` to collect data back from ch
 """
 
 import multiprocess as mp
+from multiprocess.connection import wait
 import threading
 import queue
+import time
 import inspect
 import sys
 import typing
 from typing import Callable, Iterable
 
-from pyrallel import Paralleller
+from pyrallel import Paralleller, SpillQueue
 
 if sys.version_info >= (3, 8):
-    from pyrallel import ShmQueue
+    from pyrallel import ShmQueue, ShmChannelGroup, PriorityShmQueue, ShmBroadcastQueue, ShmObjectStore, ShmObjectHandle
 
 class Mapper(object):
     """
@@ -139,6 +141,12 @@ class Mapper(object):
         """
         raise NotImplementedError
 
+    def receive_broadcast(self, obj):
+        """
+        Invoked with each object sent by `ParallelProcessor.broadcast`, before the tasks added after it are processed.
+        """
+        pass
+
 
 class CollectorThread(threading.Thread):
     """
@@ -190,6 +198,43 @@ class ProgressThread(threading.Thread):
             self.progress(self.progress_info)
 
 
+class RoundRobinQueues(object):
+    """
+    Put each task into the next of the per-process mapper queues that has room.
+    It is the queue of the SpillQueue that all of the processes share when `spill` is set.
+    """
+
+    # Longest time in seconds that `put` sleeps before it tries the queues again.
+    MAX_POLL_INTERVAL = 0.01
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.index = 0
+
+    def put_nowait(self, msg, **kwargs):
+        for _ in range(len(self.queues)):
+            q = self.queues[self.index]
+            self.index = (self.index + 1) % len(self.queues)
+            try:
+                q.put_nowait(msg, **kwargs)
+                return
+            except queue.Full:
+                continue
+        raise queue.Full
+
+    def put(self, msg, block=True, timeout=None, **kwargs):
+        wait_start = time.time()
+        interval = RoundRobinQueues.MAX_POLL_INTERVAL / 64
+        while True:
+            try:
+                return self.put_nowait(msg, **kwargs)
+            except queue.Full:
+                if not block or (timeout is not None and time.time() - wait_start >= timeout):
+                    raise
+            time.sleep(interval)
+            interval = min(interval * 2, RoundRobinQueues.MAX_POLL_INTERVAL)
+
+
 class ParallelProcessor(Paralleller):
     """
     Args:
@@ -210,7 +255,13 @@ class ParallelProcessor(Paralleller):
         batch_size (int, optional): Batch size, defaults to 1.
         progress (Callable, optional): Progress inspection. Defaults to None.
         use_shm (bool, optional): When True, and when riunning on Python version 3.8 or later,
-                                use ShmQueue for higher performance.  Defaults to False.
+                                use ShmQueue for higher performance.  The per-process mapper, collector and
+                                progress queues are the channels of one ShmChannelGroup each, so the blocks
+                                of all processes are pooled (`max_size_per_*_queue` times `num_of_processor`
+                                blocks per group); each per-process mapper queue still holds at most
+                                `max_size_per_mapper_queue` tasks.  A single mapper queue of at least
+                                `2 * ShmQueue.DEFAULT_MAGAZINE_SIZE` blocks per process uses per-process
+                                free-block magazines.  Defaults to False.
         enable_collector_queues (bool, optional): When True, create a collector queue for each
                                 processor.  When False, do not allocate collector queues, saving
                                 resources.  Defaults to True.
@@ -219,6 +270,27 @@ class ParallelProcessor(Paralleller):
                                 go to sleep when the mapper queue is full.  When False, each process
                                 gets its own mapper queue, and CPU-intensive polling may be needed to
                                 find a mapper queue which can accept a new request.
+        priorities (int, optional): Number of task priorities.  When it's more than 1, the mapper queues
+                                are PriorityShmQueues (`use_shm` is required) and `add_task` takes a `_priority`
+                                argument: a process always takes the queued task of the highest priority first.
+                                Defaults to 1.
+        max_size_broadcast_queue (int, optional): When it's more than 0, `broadcast` is enabled and its objects are
+                                serialized once into a ShmBroadcastQueue of this many blocks (`use_shm` is required).
+                                Defaults to 0.
+        max_objects (int, optional): When it's more than 0, `put_object` is enabled and stores up to this many
+                                objects at a time in a ShmObjectStore.  Python 3.8 or later is required.
+                                Defaults to 0.
+        spill (bool, optional): When True, `add_task` never blocks: the tasks that do not fit in the mapper
+                                queues are kept by a SpillQueue, up to `spill_memory_bytes` in memory and then
+                                in files on local disk, and fed to the queues in order (with `priorities`, the
+                                kept tasks of the highest priority first).  With a mapper queue per process,
+                                a task is only kept when every queue is full, and the processes share the kept
+                                tasks, each going to the first queue that has room.  Defaults to False.
+        spill_memory_bytes (int, optional): With `spill`, the number of pickled task bytes kept in memory
+                                before tasks are spilled to disk.
+                                Defaults to `SpillQueue.DEFAULT_MEMORY_BYTES`.
+        spill_dir (str, optional): With `spill`, where the spill files go.  Defaults to None, the system's
+                                temporary directory.
 
     Note:
         - Do NOT implement heavy compute-intensive operations in collector, they should be in mapper.
@@ -231,25 +303,55 @@ class ParallelProcessor(Paralleller):
     # (CMD_XXX, args...)
     CMD_DATA = 0
     CMD_STOP = 1
+    CMD_BROADCAST = 2
+
+    # Maximum number of messages taken from a collector queue at once when it supports `get_many`.
+    COLLECT_BATCH_SIZE = 64
+
+    # Longest time in seconds that `collect` waits for a collector queue to become readable before it looks
+    # again, and the shorter one when a queue cannot be waited for.
+    COLLECT_WAIT_TIMEOUT = 1.0
+    COLLECT_POLL_INTERVAL = 0.001
 
     def __init__(self, num_of_processor: int, mapper: Callable, max_size_per_mapper_queue: int = 0,
                  collector: Callable = None, max_size_per_collector_queue: int = 0,
                  enable_process_id: bool = False, batch_size: int = 1, progress=None, use_shm=False, enable_collector_queues=True,
-                 single_mapper_queue: bool = False):
+                 single_mapper_queue: bool = False, priorities: int = 1, max_size_broadcast_queue: int = 0,
+                 max_objects: int = 0, spill: bool = False, spill_memory_bytes: int = SpillQueue.DEFAULT_MEMORY_BYTES,
+                 spill_dir: str = None):
         self.num_of_processor = num_of_processor
         self.single_mapper_queue = single_mapper_queue
+        self.priorities = priorities
+        if priorities > 1 and not use_shm:
+            raise ValueError("priorities require use_shm.")
+        if max_size_broadcast_queue > 0 and not use_shm:
+            raise ValueError("max_size_broadcast_queue requires use_shm.")
         if sys.version_info >= (3, 8):
             self.collector_queues: typing.Optional[typing.Union[ShmQueue, mp.Queue]]
         else:
             self.collector_queues: typing.Optional[mp.Queue]
         if use_shm:
             if sys.version_info >= (3, 8):
-                if single_mapper_queue:
-                    self.mapper_queues = [ShmQueue(maxsize=max_size_per_mapper_queue * num_of_processor)]
+                if priorities > 1:
+                    if single_mapper_queue:
+                        self.mapper_queues = [PriorityShmQueue(priorities, maxsize=max_size_per_mapper_queue * num_of_processor)]
+                    else:
+                        self.mapper_queues = [PriorityShmQueue(priorities, maxsize=max_size_per_mapper_queue)
+                                              for _ in range(num_of_processor)]
+                elif single_mapper_queue:
+                    # The processes cache free blocks in magazines when there are enough blocks to go around.
+                    magazine_size = ShmQueue.DEFAULT_MAGAZINE_SIZE \
+                        if max_size_per_mapper_queue >= 2 * ShmQueue.DEFAULT_MAGAZINE_SIZE else 0
+                    self.mapper_queues = [ShmQueue(maxsize=max_size_per_mapper_queue * num_of_processor,
+                                                   magazine_size=magazine_size)]
                 else:
-                    self.mapper_queues = [ShmQueue(maxsize=max_size_per_mapper_queue) for _ in range(num_of_processor)]
+                    # Each process may only hold its share of the pool, so a slow one cannot starve the others.
+                    self.mapper_queues = self.shm_channels(num_of_processor, max_size_per_mapper_queue, limit_channels=True)
                 if enable_collector_queues:
-                    self.collector_queues = [ShmQueue(maxsize=max_size_per_collector_queue) for _ in range(num_of_processor)]
+                    # The group's notification pipe tells `collect` that some channel has a result.  No one
+                    # waits on freed blocks, so the group has no `free_notify` pipe.
+                    self.collector_queues = self.shm_channels(num_of_processor, max_size_per_collector_queue,
+                                                              notify='msg' if collector is not None else False)
                 else:
                     self.collector_queues = None
             else:
@@ -285,7 +387,7 @@ class ParallelProcessor(Paralleller):
                 self.progress_queues: typing.Optional[mp.Queue]
             if use_shm:
                 if sys.version_info >= (3, 8):
-                    self.progress_queues = [ShmQueue(maxsize=1) for _ in range(num_of_processor)]
+                    self.progress_queues = self.shm_channels(num_of_processor, 1)
                 else:
                     raise ValueError("shm not available in this version of Python.")
             else:
@@ -294,6 +396,30 @@ class ParallelProcessor(Paralleller):
             self.progress_queues = None
         self.progress = progress
 
+        # The main process puts tasks through task_queues, the processes get them from mapper_queues.
+        self.spill = spill
+        if spill:
+            # A single SpillQueue: with a queue per process, a kept task goes to whichever process has
+            # room first, so the tasks do not pile up behind a slow process.
+            spill_target = self.mapper_queues[0] if single_mapper_queue else RoundRobinQueues(self.mapper_queues)
+            self.task_queues = [SpillQueue(spill_target, spill_memory_bytes, spill_dir=spill_dir, priorities=priorities)]
+        else:
+            self.task_queues = self.mapper_queues
+
+        if max_size_broadcast_queue > 0:
+            # Process i reads subscriber i.
+            broadcast_queue = ShmBroadcastQueue(num_of_processor, maxsize=max_size_broadcast_queue)
+            self.broadcast_queues = [broadcast_queue.subscriber(i) for i in range(num_of_processor)]
+        else:
+            self.broadcast_queues = None
+
+        if max_objects > 0:
+            if sys.version_info < (3, 8):
+                raise ValueError("shm not available in this version of Python.")
+            self.object_store = ShmObjectStore(max_objects)
+        else:
+            self.object_store = None
+
         ctx = self
         if not inspect.isclass(mapper) or not issubclass(mapper, Mapper):
             class DefaultMapper(Mapper):
@@ -307,10 +433,10 @@ class ParallelProcessor(Paralleller):
 
         self.collector = collector
         self.mapper_queue_index = 0
-        self.collector_queue_index = 0
         self.enable_process_id = enable_process_id
         self.batch_size = batch_size
         self.batch_data = []
+        self.batch_priority = 0
 
         # collector can be handled in each process or in main process after merging (collector needs to be set)
         # if collector is set, it needs to be handled in main process;
@@ -332,6 +458,27 @@ class ParallelProcessor(Paralleller):
         for p in self.processes:
             p.start()
 
+    @staticmethod
+    def shm_channels(num_of_processor: int, max_size_per_queue: int, notify: typing.Union[bool, str] = False,
+                     limit_channels: bool = False) -> list:
+        """
+        Create one queue per process as the channels of a single ShmChannelGroup.
+
+        Args:
+            num_of_processor (int): Number of queues.
+            max_size_per_queue (int): Blocks per queue in the pool, 0 means `ShmQueue.DEFAULT_MAXSIZE`.
+            notify (typing.Union[bool, str], optional): The group's `notify` argument; its notification
+                                pipes are shared by the channels.
+            limit_channels (bool, optional): Also limit each queue to `max_size_per_queue` messages
+                                (`max_size_per_channel`), so that a full queue raises `queue.Full`.
+        """
+        max_size_per_queue = max_size_per_queue or ShmQueue.DEFAULT_MAXSIZE
+        group = ShmChannelGroup(num_of_processor,
+                                maxsize=max_size_per_queue * num_of_processor,
+                                max_size_per_channel=max_size_per_queue if limit_channels else 0,
+                                notify=notify)
+        return [group.channel(i) for i in range(num_of_processor)]
+
     def join(self):
         """
         Block until processes and threads return.
@@ -342,6 +489,9 @@ class ParallelProcessor(Paralleller):
             self.progress_thread.join()
         for p in self.processes:
             p.join()
+        if self.task_queues is not self.mapper_queues:
+            for q in self.task_queues:
+                q.close()
         for q in self.mapper_queues:
             q.close()
         if self.collector_queues is not None:
@@ -350,6 +500,11 @@ class ParallelProcessor(Paralleller):
         if self.progress_queues is not None:
             for q in self.progress_queues:
                 q.close()
+        if self.broadcast_queues is not None:
+            for q in self.broadcast_queues:
+                q.close()
+        if self.object_store is not None:
+            self.object_store.close()
 
     def task_done(self):
         """
@@ -357,16 +512,27 @@ class ParallelProcessor(Paralleller):
         (main process, blocked)
         """
         if len(self.batch_data) > 0:
-            self._add_task(self.batch_data)
+            self._add_task(self.batch_data, self.batch_priority)
             self.batch_data = []
 
+        # The stop commands have the lowest priority, so they are taken after every task.
+        put_kwargs = {'priority': 0} if self.priorities > 1 else {}
+        stop_queues = self.task_queues
+        if self.spill and not self.single_mapper_queue:
+            # Any process may still get a kept task, so each one is told to stop once they are all fed.
+            self.task_queues[0].close()
+            stop_queues = self.mapper_queues
+        if self.single_mapper_queue and hasattr(stop_queues[0], 'put_many'):
+            stop_queues[0].put_many([(ParallelProcessor.CMD_STOP,)] * self.num_of_processor, **put_kwargs)
+            return
+
         for i in range(self.num_of_processor):
             if self.single_mapper_queue:
-                self.mapper_queues[0].put((ParallelProcessor.CMD_STOP,))
+                stop_queues[0].put((ParallelProcessor.CMD_STOP,), **put_kwargs)
             else:
-                self.mapper_queues[i].put((ParallelProcessor.CMD_STOP,))
+                stop_queues[i].put((ParallelProcessor.CMD_STOP,), **put_kwargs)
 
-    def add_task(self, *args, **kwargs):
+    def add_task(self, *args, _priority: int = 0, **kwargs):
         """
         Add data to one a mapper queue.
 
@@ -374,24 +540,118 @@ class ParallelProcessor(Paralleller):
         queue is full.  When multiple mapper queues are in use (one per process),
         use CPU-intensive polling (round-robin processing) to find the next available
         queue. (main process, blocked or unblocked depending upon single_mapper_queue)
+        With `spill`, the task is kept in memory or on disk when the queues are full, so this never blocks.
+
+        `_priority` (between 0, the default, and `priorities` - 1) is the priority of the task when
+        `priorities` is set; it is not passed to the mapper.  A batch only holds tasks of one priority.
+
+        Arguments that are handles returned by `put_object` are sent as handles and passed to the
+        mapper as the stored objects.  Each task holds a reference to them until it has been processed.
         """
+        if _priority != self.batch_priority:
+            if not 0 <= _priority < self.priorities:
+                raise ValueError("_priority must be between 0 and %d." % (self.priorities - 1))
+            if len(self.batch_data) > 0:
+                self._add_task(self.batch_data, self.batch_priority)
+                self.batch_data = []
+            self.batch_priority = _priority
+
+        if self.object_store is not None:
+            for arg in self._object_handles(args, kwargs):
+                self.object_store.incref(arg)
+
         self.batch_data.append((args, kwargs))
         if self.progress:
             self.progress_thread.progress_info[ProgressThread.P_ADDED] += 1
 
         if len(self.batch_data) == self.batch_size:
-            self._add_task(self.batch_data)
+            self._add_task(self.batch_data, self.batch_priority)
             self.batch_data = []  # reset buffer
 
-    def _add_task(self, batched_args):
-        if self.single_mapper_queue:
-            self.mapper_queues[0].put((ParallelProcessor.CMD_DATA, batched_args))
+    def broadcast(self, obj):
+        """
+        Send an object to every process, serializing it once.  Each process passes it to
+        `Mapper.receive_broadcast` before it processes any task added after this call (tasks added
+        before it may see it too).  Requires `max_size_broadcast_queue`.
+        (main process, blocked if the broadcast queue is full)
+        """
+        if self.broadcast_queues is None:
+            raise ValueError("broadcast requires max_size_broadcast_queue.")
+        self.broadcast_queues[0].put(obj)
+
+        # Wake up the idle processes; the others receive it with their next command.
+        put_kwargs = {'priority': self.priorities - 1} if self.priorities > 1 else {}
+        for i in range(self.num_of_processor):
+            if self.spill and not self.single_mapper_queue:
+                # A process whose queue is full has a command to wake up for.
+                try:
+                    self.mapper_queues[i].put_nowait((ParallelProcessor.CMD_BROADCAST,), **put_kwargs)
+                except queue.Full:
+                    pass
+                continue
+            q = self.task_queues[0 if self.single_mapper_queue else i]
+            q.put((ParallelProcessor.CMD_BROADCAST,), **put_kwargs)
+
+    def put_object(self, obj):
+        """
+        Store an object in shared memory once and return a handle to pass to `add_task` in its place,
+        so that any number of tasks share one copy.  Requires `max_objects`.
+        Call `release_object` with the handle once all of the tasks have been added.
+        (main process)
+        """
+        if self.object_store is None:
+            raise ValueError("put_object requires max_objects.")
+        return self.object_store.put_object(obj)
+
+    def release_object(self, handle):
+        """
+        Drop the reference returned by `put_object`.  The object is freed once the tasks that refer
+        to it have been processed.
+        (main process)
+        """
+        self.object_store.release_object(handle)
+
+    @staticmethod
+    def _object_handles(args, kwargs):
+        return [arg for arg in list(args) + list(kwargs.values()) if isinstance(arg, ShmObjectHandle)]
+
+    def _process_task(self, mapper, args, kwargs):
+        if self.object_store is None:
+            return mapper.process(*args, **kwargs)
+        handles = self._object_handles(args, kwargs)
+        if len(handles) == 0:
+            return mapper.process(*args, **kwargs)
+        get_object = self.object_store.get_object
+        args = [get_object(arg) if isinstance(arg, ShmObjectHandle) else arg for arg in args]
+        kwargs = {k: get_object(v) if isinstance(v, ShmObjectHandle) else v for k, v in kwargs.items()}
+        try:
+            return mapper.process(*args, **kwargs)
+        finally:
+            del args, kwargs
+            for handle in handles:
+                self.object_store.release_object(handle)
+
+    def _receive_broadcasts(self, mapper):
+        broadcast_queue = self.broadcast_queues[mapper._idx]
+        while True:
+            try:
+                obj = broadcast_queue.get_nowait()
+            except queue.Empty:
+                return
+            mapper.receive_broadcast(obj)
+
+    def _add_task(self, batched_args, priority=0):
+        # Only priority queues take the priority argument.
+        put_kwargs = {'priority': priority} if self.priorities > 1 else {}
+        if self.single_mapper_queue or self.spill:
+            # With `spill`, the SpillQueue looks for a queue with room itself.
+            self.task_queues[0].put((ParallelProcessor.CMD_DATA, batched_args), **put_kwargs)
         else:
             while True:
-                q = self.mapper_queues[self.mapper_queue_index]
+                q = self.task_queues[self.mapper_queue_index]
                 self.mapper_queue_index = (self.mapper_queue_index + 1) % self.num_of_processor
                 try:
-                    q.put_nowait((ParallelProcessor.CMD_DATA, batched_args))
+                    q.put_nowait((ParallelProcessor.CMD_DATA, batched_args), **put_kwargs)
                     return  # put in
                 except queue.Full:
                     continue  # find next available
@@ -404,7 +664,11 @@ class ParallelProcessor(Paralleller):
         with self.mapper(idx) as mapper:
             while True:
                 data = mapper_queue.get()
-                if data[0] == ParallelProcessor.CMD_STOP:
+                if self.broadcast_queues is not None:
+                    self._receive_broadcasts(mapper)
+                if data[0] == ParallelProcessor.CMD_BROADCAST:
+                    continue
+                elif data[0] == ParallelProcessor.CMD_STOP:
                     # print(idx, 'stop')
                     self._update_progress(mapper, finish=True)
                     if self.collector and collector_queue is not None:
@@ -416,7 +680,7 @@ class ParallelProcessor(Paralleller):
                         args, kwargs = d[0], d[1]
                         # print(idx, 'data')
                         self._update_progress(mapper, type_=ProgressThread.P_LOADED)
-                        result = mapper.process(*args, **kwargs)
+                        result = self._process_task(mapper, args, kwargs)
                         self._update_progress(mapper, type_=ProgressThread.P_PROCESSED)
                         if collector_queue is not None:
                             if self.collector:
@@ -443,26 +707,81 @@ class ParallelProcessor(Paralleller):
 
     def collect(self):
         """
-        Get data from collector queue sequentially.
-        (main process, unblocked, using round robin to find next available queue)
+        Get data from collector queues as it arrives.
+        (main process, blocked while no collector queue has data)
+
+        Each pass takes what is ready from every collector queue, round robin.  When nothing was ready,
+        it sleeps until one of the queues becomes readable: a ShmQueue created with `notify` through this
+        process's notification pipe (shared by the channels of a group), which it watches while collecting,
+        a multiprocessing queue through its pipe.
+        Queues that support `get_many` (ShmQueue) are drained up to `COLLECT_BATCH_SIZE`
+        messages at a time.
         """
         if not self.collector:
             return
+        # work on a copy, `join` still needs to close all the queues
+        collector_queues = list(self.collector_queues)
+        watched = [q for q in collector_queues if getattr(q, 'msg_notify', None) is not None]
+        for q in watched:
+            q.watch(ShmQueue.NOTIFY_MSG)
+        try:
+            yield from self._collect(collector_queues)
+        finally:
+            for q in watched:
+                q.watch(ShmQueue.NOTIFY_MSG, False)
+
+    def _collect(self, collector_queues):
+        """
+        The loop of `collect`, once the notification pipes are watched.
+        """
         while True:
-            # print(self.collector_queues)
-            q = self.collector_queues[self.collector_queue_index]
-            try:
-                data = q.get_nowait()  # get out
-                if data[0] == ParallelProcessor.CMD_STOP:
-                    del self.collector_queues[self.collector_queue_index]  # remove queue if it's finished
-                elif data[0] == ParallelProcessor.CMD_DATA:
-                    yield data[1]
-            except queue.Empty:
-                continue  # find next available
-            finally:
-                if len(self.collector_queues) == 0:  # all finished
-                    return
-                self.collector_queue_index = (self.collector_queue_index + 1) % len(self.collector_queues)
+            # Drain the wakeups first, so that a result published from now on wakes up the wait below.
+            notify_readers, readers, can_wait = self._collector_readers(collector_queues)
+            for reader in notify_readers:
+                ShmQueue.drain_notify(reader)
+
+            got_data = False
+            for q in list(collector_queues):
+                try:
+                    if hasattr(q, 'get_many'):
+                        batch = q.get_many(ParallelProcessor.COLLECT_BATCH_SIZE, block=False)  # get out
+                    else:
+                        batch = [q.get_nowait()]  # get out
+                except queue.Empty:
+                    continue  # try next queue
+                got_data = True
+                for data in batch:
+                    if data[0] == ParallelProcessor.CMD_STOP:
+                        collector_queues.remove(q)  # remove queue if it's finished
+                    elif data[0] == ParallelProcessor.CMD_DATA:
+                        yield data[1]
+            if len(collector_queues) == 0:  # all finished
+                return
+            if not got_data:
+                wait(readers, ParallelProcessor.COLLECT_WAIT_TIMEOUT if can_wait else ParallelProcessor.COLLECT_POLL_INTERVAL)
+
+    @staticmethod
+    def _collector_readers(collector_queues):
+        """
+        Get the notification pipes to drain, the connections to wait on, and whether every queue has one.
+        """
+        notify_readers = []
+        readers = []
+        can_wait = True
+        for q in collector_queues:
+            if hasattr(q, 'msg_notify'):  # a ShmQueue, only readable through its notification pipe
+                if q.msg_notify is None:
+                    can_wait = False
+                    continue
+                reader = q.notify_reader(ShmQueue.NOTIFY_MSG)
+                if reader not in readers:
+                    notify_readers.append(reader)
+                    readers.append(reader)
+            elif hasattr(q, '_reader'):
+                readers.append(q._reader)
+            else:
+                can_wait = False
+        return notify_readers, readers, can_wait
 
     def get_progress(self):
         """
@@ -1,26 +1,71 @@
+import array
+import asyncio
+import bisect
+import collections
+import contextlib
 import copy
+import io
+import mmap
 import multiprocessing as mp
 import multiprocessing.queues as mpq
+import multiprocessing.synchronize
 from queue import Full, Empty
 import pickle
 import math
 # import uuid
 import os
+import shutil
 import struct
 import sys
+import tempfile
+import threading
 import time
 import typing
 import dill  # type: ignore
 import zlib
 
+from pyrallel import codec
+
 
 if sys.version_info >= (3, 8):
     from multiprocessing.shared_memory import SharedMemory
-    __all__ = ['ShmQueue']
+    from multiprocessing import resource_tracker
+    __all__ = ['ShmQueue', 'ShmChannelGroup', 'PriorityShmQueue', 'ShmBroadcastQueue', 'ShmArrayQueue', 'AsyncShmQueue',
+               'ShmObjectHandle', 'ShmObjectStore', 'SpscShmQueue', 'SpillQueue']
 else:
     from typing import TypeVar
     SharedMemory = TypeVar('SharedMemory')
-    __all__ = []
+    __all__ = ['SpillQueue']
+
+
+class ShmBlockViews(dict):
+    """ShmBlockViews maps block ids to the memoryviews of their blocks, building each view
+    (and opening its segment) the first time the block is looked up.
+
+    A queue that was pickled into another process starts with an empty map, so its
+    startup cost does not depend on the number of blocks.
+
+    Args:
+        map_block (typing.Callable[[int], memoryview]): Build the view of a block.
+    """
+    def __init__(self, map_block: typing.Callable[[int], memoryview]):
+        super().__init__()
+        self.map_block: typing.Callable[[int], memoryview] = map_block
+
+    def __missing__(self, block_id: int)->memoryview:
+        view: memoryview = self.map_block(block_id)
+        self[block_id] = view
+        return view
+
+    def release(self, first_block_id: int=0):
+        """Release and drop the views of the blocks from `first_block_id` on.
+
+        Args:
+            first_block_id (int): The first block id to release.
+        """
+        block_id: int
+        for block_id in [block_id for block_id in self if block_id >= first_block_id]:
+            self.pop(block_id).release()
 
 
 class ShmQueue(mpq.Queue):
@@ -43,6 +88,14 @@ class ShmQueue(mpq.Queue):
     message using the next_block_id field in the shared buffer's metadata
     area.
 
+    The list heads are protected by one lock per list type (free_list_lock and
+    msg_list_lock), which also covers the next_block_id links of the blocks on the
+    lists.  A block that is not on any list belongs to exactly one process: the
+    producer that reserved it, until the message is published, or the consumer
+    that took the message, until the block is freed.  Moving a block through the
+    lists under their locks is the only synchronization its header and data need,
+    so there are no per-block locks.
+
     Messages are serialized for transfer from the sender to the receiver.
     The serialized size of a message may not exceed the chunk size times
     the maximum queue size.  If the deadlock_immanent_check is enabled
@@ -73,20 +126,126 @@ class ShmQueue(mpq.Queue):
         use_semaphores (bool, optional): When true, use semaphores to control access to the free list and the 
                                 message list. The system will sleep when accessing these shared resources,
                                 instead of entering a polling loop.
+        use_arena (bool, optional): When True (default), all data blocks are carved out of a single
+                                shared memory segment (the arena) and addressed by offsets into it.
+                                When False, each data block gets its own shared memory segment.
+        out_of_band (bool, optional): When True, messages are pickled with protocol 5 and large buffers
+                                (`pickle.PickleBuffer`, e.g. NumPy arrays and bytearrays) are written straight
+                                into the shared blocks instead of being copied into the pickle stream first.
+                                On get, each buffer is rebuilt with a single copy out of shared memory.
+                                Requires the default (pickle) serializer. (default is False)
+        size_classes (typing.Sequence[int], optional): Chunk sizes for size-class (slab) allocation.
+                                When given, the queue keeps one pool of blocks per chunk size, and each
+                                message is stored in the pool with the smallest chunk size that holds the
+                                whole serialized message (or in chunks of the largest size if none does).
+                                `chunk_size` is then ignored and `maxsize` is only used to derive the
+                                default `capacity`.  If it is None (default), there is a single pool of
+                                `maxsize` blocks of `chunk_size` bytes.
+        capacity (int, optional): With `size_classes`, the total number of data bytes in the queue, split
+                                evenly between the size classes (each class gets at least one block).
+                                If it is 0 (default), it is the largest size class times `maxsize`, i.e.
+                                the footprint that holds `maxsize` large messages.
+        compression (str or codec.Codec, optional): The codec (e.g. 'zlib', 'bz2' or 'lzma', see `pyrallel.codec`)
+                                used to compress serialized messages of at least `compression_threshold` bytes.
+                                The codec is recorded in each message's msg_flags, so receivers need no setting.
+                                If it is None (default), messages are not compressed.
+        compression_threshold (int, optional): Serialized messages shorter than this are never compressed.
+                                (Default is `codec.DEFAULT_COMPRESSION_THRESHOLD`, 64KB.)
+        fast_types (bool, optional): When True (default) and the serializer is the default pickle, messages
+                                that are exactly bytes, bytearray, memoryview, str or a contiguous NumPy
+                                array of a plain dtype are written raw (a str as UTF-8, an array after a small
+                                dtype and shape header) with a type tag in msg_flags, instead of being pickled.
+                                They are rebuilt as the same type (a memoryview as bytes).  Any other message,
+                                including subclasses of those types, is pickled.
+        max_bytes (int, optional): When positive, the block pool is elastic: when a producer finds the free
+                                list empty, the queue adds `grow_blocks` blocks at a time, each batch in a new
+                                shared memory segment (an extent), until the data blocks total `max_bytes`.
+                                If it is 0 (default), the pool is fixed.  Not supported with `size_classes`.
+        min_blocks (int, optional): With `max_bytes`, the number of blocks that are always kept.
+                                If it is 0 (default), it is `maxsize`.
+        grow_blocks (int, optional): With `max_bytes`, the number of blocks in each extent.
+                                If it is 0 (default), it is `min_blocks`.
+        channels (int, optional): The number of message lists that share the block pool.  The queue
+                                uses channel 0; see `ShmChannelGroup` for addressing the others.  (Default is 1.)
+        stats (bool, optional): When True, the queue keeps counters for `stats` in one more shared memory
+                                area.  (Default is False.)
+        stats_slots (int, optional): With `stats`, the number of processes that get their own slot of counters.
+                                (Default is `ShmQueue.DEFAULT_STATS_SLOTS`.)
+        idle_timeout (float, optional): With `max_bytes`, extents are released, newest first, once all of
+                                their blocks are free and no producer has run short of blocks for
+                                `idle_timeout` seconds.  The processes that free blocks or wait on the
+                                queue check for idle extents at most twice per `idle_timeout`.
+                                (Default is `ShmQueue.DEFAULT_IDLE_TIMEOUT`.)
+        notify (typing.Union[bool, str], optional): When True, the queue has nonblocking notification pipes, so
+                                that an event loop can wait for the queue: a process that registers with
+                                `watch` gets a byte on a pipe of its own each time a message is published
+                                (`msg_notify`) or blocks are freed (`free_notify`).  See `AsyncShmQueue`.
+                                With 'msg', only the `msg_notify` pipes are created, for consumers that wait
+                                for messages while no producer waits for blocks.  Magazines need 'msg' or
+                                False, as the blocks freed into a magazine wake no one.
+                                (Default is False.)
+        notify_slots (int, optional): With `notify`, the number of processes that can `watch` the queue,
+                                each with pipes of its own.  (Default is `ShmQueue.DEFAULT_NOTIFY_SLOTS`.)
+        spin_time (float, optional): Before a producer or consumer that has to wait goes to sleep, it keeps
+                                retrying for up to this many seconds, as long as its recent waits have been
+                                short (see `SPIN_WAIT_RATIO`).  Spinning trades CPU time for latency, so it
+                                only pays off when the processes have cores of their own.
+                                (Default is `ShmQueue.DEFAULT_SPIN_TIME`, 0: no spinning.)
+        spin_yield (bool, optional): When True (default), give up the CPU with `os.sched_yield` between
+                                two retries while spinning, where the platform supports it.
+        poll_max_sleep (float, optional): Without semaphores, a waiting producer or consumer that is done
+                                spinning polls the lists with sleeps that grow with the time it has waited,
+                                up to this many seconds.  (Default is `ShmQueue.DEFAULT_POLL_MAX_SLEEP`.)
+        magazine_size (int, optional): When positive, each process caches up to this many free blocks of each
+                                size class in a magazine of its own, and only takes the free list lock to move
+                                half a magazine at a time to or from the free list.  (Default is 0, no magazines.)
+        magazine_slots (int, optional): With `magazine_size`, the number of processes that get their own
+                                magazines.  (Default is `ShmQueue.DEFAULT_MAGAZINE_SLOTS`.)
+        ctx (optional): The multiprocessing context whose locks and semaphores the queue uses.
+                                If it is None (default), the current default context is used.
+                                `create` uses the spawn context, whose semaphores are named.
 
     Note:
         - `close` needs to be invoked once to release memory and avoid a memory leak.
         - `qsize`, `empty` and `full` are implemented but may block.
-        - Each shared queue consumes one shared memory area for the shared list heads
-          and one shared memory area for each shared buffer.  The underlying code in
+        - Each shared queue consumes one shared memory area for the shared list heads.
+          In arena mode (the default) all of the shared buffers live in one additional
+          shared memory area, so a queue costs two file descriptors per process no matter
+          how large `maxsize` is, and creating or closing it takes a constant number of syscalls.
+        - When `use_arena` is False, each shared buffer gets its own shared memory area.  The underlying code in
           multiprocessing.shared_memory.SharedMemory consumes one process file descriptor
           for each shared memory area.  There is a limit on the number of file descriptors
-          that a process may have open.
-        - Thus, there is a tradeoff between the chunk_size and maxsize:  smaller chunks
-          use memory more effectively with some overhead cost, but may run into the limit
+          that a process may have open.  In that mode there is a tradeoff between the chunk_size and maxsize:
+          smaller chunks use memory more effectively with some overhead cost, but may run into the limit
           on the number of open file descriptors to process large messages and avoid blocking.
-          Larger chunks waste unused space, but are less likely to run into the open file descriptor
-          limit or to block waiting for a free buffer.
+        - With a single pool, every message occupies at least one full chunk, so `maxsize` caps the
+          number of messages in flight regardless of their size.  Use `size_classes` and `capacity`
+          to let thousands of small messages share the footprint of a few large ones.
+        - In elastic mode, the extents are listed in one more shared memory area.  Every process
+          compares its own mapping with that list (a generation counter) whenever it takes a
+          block off a list, so blocks added or released by one process are picked up by the others
+          transparently.  Released extents are checked for when blocks are freed, or on demand
+          with `shrink_pool`.
+        - A queue created with `stats` keeps counters (messages and bytes put and got, chunks per message,
+          time spent blocked, nonblocking Full and Empty) in one more shared memory area, readable from
+          any attached process with `stats`.  Each process updates its own slot, under a lock that
+          only its threads share.  A slot records the pid of its owner, and a process that needs a
+          slot takes over one whose owner has exited, keeping its counts; a queue used by more than
+          `stats_slots` live processes raises ValueError in the process that finds no slot.
+        - A process that has to wait blocks on a semaphore (or, without semaphores, sleeps between polls).
+          With `spin_time`, it spins first, so quick hand-offs avoid the sleep and wakeup syscalls while
+          long waits do not burn a core: each process keeps a moving average of its own waits and stops
+          spinning while they are much longer than `spin_time`.
+        - The magazines live in one more shared memory area, one slot per process (once the slots run
+          out, later processes share the last one), each under a lock of its own that is only contended
+          when blocks are reclaimed.  A producer that finds both its magazine and the free list empty
+          raises a starving flag, which makes every process free its blocks to the free list rather
+          than to its magazine, and moves the blocks of all the magazines to the free list before it
+          waits.
+        - The notification pipes are only written to while some process watches them, and only the
+          pipes of the processes that watch are, so a queue that no event loop waits on costs one
+          shared memory read per put or free.  A process that watches must check the queue after
+          `watch` returns and before it waits on its pipe.
 
     Example::
 
@@ -129,14 +288,80 @@ class ShmQueue(mpq.Queue):
         'checksum': (28, 32, 'I'),
         'src_pid': (32, 36, 'I'),
         'next_chunk_block_id': (36, 40, 'I'),
-        'next_block_id': (40, 44, 'I')
+        'next_block_id': (40, 44, 'I'),
+        'msg_flags': (44, 48, 'I')
     }
     """The per-buffer metadata structure parameters for struct.pack(...) and
     struct.unpack(...)."""
+
+    META_CODEC: struct.Struct = struct.Struct('12sIIIIIIIII')
+    """The precompiled struct for the whole per-buffer metadata structure.  The fields
+    are in `META_STRUCT` order, so a whole block header is read or written with a single
+    `unpack_from(...)` or `pack_into(...)` call."""
+
+    META_FIELD_CODECS: typing.Mapping[str, typing.Tuple[int, struct.Struct]] = {
+        name: (addr_s, struct.Struct(ctype)) for name, (addr_s, addr_e, ctype) in META_STRUCT.items()
+    }
+    """The offset and precompiled struct of each per-buffer metadata field, for
+    single-field access with `get_meta(...)` and `set_meta(...)`."""
     
-    META_BLOCK_SIZE: int = 44
+    META_BLOCK_SIZE: int = 48
     """int: The length of the buffer metadata structure in bytes."""
 
+    MSG_FLAG_OUT_OF_BAND: int = 0x1
+    """int: Set in the msg_flags metadata field when the message body is an out-of-band
+    frame: a header with the part lengths, the protocol 5 pickle stream, then the raw
+    contents of each out-of-band buffer."""
+
+    MSG_FLAG_CODEC_SHIFT: int = 8
+    """int: The id of the codec a message body was compressed with (see `pyrallel.codec`) is
+    stored in bits 8 to 15 of the msg_flags metadata field, and is 0 for uncompressed messages."""
+
+    MSG_FLAG_CODEC_MASK: int = 0xff00
+    """int: The mask for the codec id in the msg_flags metadata field."""
+
+    MSG_FLAG_TYPE_SHIFT: int = 16
+    """int: The type tag of a message that bypassed the serializer (see `fast_types`) is stored in
+    bits 16 to 23 of the msg_flags metadata field, and is `MSG_TYPE_SERIALIZED` otherwise."""
+
+    MSG_FLAG_TYPE_MASK: int = 0xff0000
+    """int: The mask for the type tag in the msg_flags metadata field."""
+
+    MSG_TYPE_SERIALIZED: int = 0
+    """int: The message body was written by the serializer."""
+
+    MSG_TYPE_BYTES: int = 1
+    """int: The message body is the raw contents of a bytes object (or of a memoryview)."""
+
+    MSG_TYPE_BYTEARRAY: int = 2
+    """int: The message body is the raw contents of a bytearray."""
+
+    MSG_TYPE_STR: int = 3
+    """int: The message body is a str encoded as UTF-8."""
+
+    MSG_TYPE_NDARRAY: int = 4
+    """int: The message body is an `ARRAY_HEADER_STRUCT` header, the dtype string and the shape,
+    padded to `ARRAY_ALIGNMENT` bytes, followed by the raw contents of a C- or Fortran-contiguous
+    NumPy array."""
+
+    ARRAY_HEADER_STRUCT: struct.Struct = struct.Struct('III')
+    """The struct for the length of the dtype string, the number of dimensions and the flags of an array message."""
+
+    ARRAY_FORTRAN: int = 0x1
+    """int: Set in the flags of an array message when the data is in Fortran order."""
+
+    ARRAY_DIM_STRUCT: struct.Struct = struct.Struct('q')
+    """The struct for each dimension of an array message."""
+
+    ARRAY_ALIGNMENT: int = 16
+    """int: The array data of an array message starts at a multiple of this many bytes."""
+
+    OOB_FRAME_COUNT_STRUCT: struct.Struct = struct.Struct('I')
+    """The struct for the number of parts at the start of an out-of-band frame."""
+
+    OOB_FRAME_LENGTH_STRUCT: struct.Struct = struct.Struct('Q')
+    """The struct for each part length in an out-of-band frame header."""
+
     LIST_HEAD_STRUCT: typing.Mapping[str, typing.Tuple[int, int, str]] = {
         'first_block': (0, 4, 'I'),
         'last_block': (4, 8, 'I'),
@@ -146,16 +371,121 @@ class ShmQueue(mpq.Queue):
     struct.unpack(...). The list header structure maintains a block
     count in addition to first_block and last_block pointers."""
 
+    LIST_HEAD_CODEC: struct.Struct = struct.Struct('III')
+    """The precompiled struct for a whole list head (first_block, last_block, block_count)."""
+
+    LIST_HEAD_FIELD_CODECS: typing.Mapping[str, typing.Tuple[int, struct.Struct]] = {
+        name: (addr_s, struct.Struct(ctype)) for name, (addr_s, addr_e, ctype) in LIST_HEAD_STRUCT.items()
+    }
+    """The offset and precompiled struct of each list head field."""
+
     LIST_HEAD_SIZE: int = 12
     """int: The length of a list head structure in bytes."""
 
     FREE_LIST_HEAD: int = 0
     """int: The index of the free buffer list head in the SharedMemory segment for
-    sharing message queue list heads between processes."""
+    sharing message queue list heads between processes.  With size classes, the
+    free list heads of the size classes occupy indices 0 to (number of classes - 1)."""
     
     MSG_LIST_HEAD: int = 1
     """int: The index of the queued message list head in the SharedMemory segment for
-    sharing message queue list heads between processes."""
+    sharing message queue list heads between processes, when there is a single size class.
+    In general, the message list heads of the channels follow the free list heads
+    (`self.msg_list_heads`)."""
+
+    POOL_HEADER_STRUCT: struct.Struct = struct.Struct('IId')
+    """The header of the elastic pool's shared memory area: the number of extents, a
+    generation counter that changes whenever an extent is added or released, and the last
+    time a producer ran short of free blocks."""
+
+    POOL_NAME_STRUCT: struct.Struct = struct.Struct('32s')
+    """The shared memory name of an extent, one per extent after the elastic pool header."""
+
+    DEFAULT_IDLE_TIMEOUT: float = 10.0
+    """float: The default quiet period, in seconds, before an idle extent is released."""
+
+    SHRINK_CHECK_INTERVAL: float = 1.0
+    SHRINK_CHECK_MIN_INTERVAL: float = 0.01
+    """float: The longest and shortest times, in seconds, between two checks of a process for idle
+    extents.  Between the two, a process checks twice per `idle_timeout`."""
+
+    DEFAULT_SPIN_TIME: float = 0.0
+    """float: The default longest time, in seconds, that a waiting process retries before it sleeps.
+    Spinning is opt-in: a spinning process takes CPU time from the others on an oversubscribed host."""
+
+    SPIN_WAIT_RATIO: float = 4.0
+    """float: A process only spins while the moving average of its waits is at most this many times `spin_time`."""
+
+    WAIT_AVERAGE_WEIGHT: float = 0.125
+    """float: The weight of the latest wait in the moving average of the waits of a process."""
+
+    DEFAULT_POLL_MAX_SLEEP: float = 1e-3
+    """float: The default longest sleep, in seconds, between two polls of the lists without semaphores."""
+
+    POLL_MIN_SLEEP: float = 10e-6
+    """float: The shortest sleep, in seconds, between two polls of the lists without semaphores."""
+
+    DEFAULT_MAGAZINE_SIZE: int = 16
+    """int: A suggested `magazine_size` for queues that are shared by many processes."""
+
+    DEFAULT_MAGAZINE_SLOTS: int = 64
+    """int: The default number of per-process magazine slots."""
+
+    STARVING_STEAL_INTERVAL: float = 0.1
+    """float: With magazines, the longest time, in seconds, that a process waits on the free list
+    before it moves the blocks out of the other processes' magazines again."""
+
+    STATS_FIELDS: typing.Sequence[str] = ('puts', 'gets', 'bytes_in', 'bytes_out', 'full', 'empty',
+                                          'free_wait_ns', 'msg_wait_ns', 'max_queued', 'max_msg_chunks')
+    """The names of the per-process counters, in slot order.  They are followed by
+    `STATS_HISTOGRAM_BUCKETS` counters of messages by chunk count."""
+
+    STAT_PUTS: int = 0
+    STAT_GETS: int = 1
+    STAT_BYTES_IN: int = 2
+    STAT_BYTES_OUT: int = 3
+    STAT_FULL: int = 4
+    STAT_EMPTY: int = 5
+    STAT_FREE_WAIT_NS: int = 6
+    STAT_MSG_WAIT_NS: int = 7
+    STAT_MAX_QUEUED: int = 8
+    STAT_MAX_MSG_CHUNKS: int = 9
+    STAT_HISTOGRAM: int = 10
+    """int: The indices of the counters in a stats slot (see `STATS_FIELDS`).  Bucket `b` of the
+    chunks per message histogram, at `STAT_HISTOGRAM + b`, counts the messages of up to `2 ** b` chunks."""
+
+    STATS_HISTOGRAM_BUCKETS: int = 16
+    """int: The number of buckets in the chunks per message histogram.  The last bucket is open-ended."""
+
+    STATS_PID_STRUCT: struct.Struct = struct.Struct('Q')
+    """The stats shared memory area starts with a table of the pids that own the slots,
+    0 for a slot that has never been claimed."""
+
+    DEFAULT_STATS_SLOTS: int = 64
+    """int: The default number of per-process stats slots."""
+
+    NOTIFY_MSG: int = 0
+    NOTIFY_FREE: int = 1
+    """int: The kinds of notification pipes (see `notify`): published messages and freed blocks."""
+
+    DEFAULT_NOTIFY_SLOTS: int = 4
+    """int: The default number of processes that can watch a queue with notification pipes."""
+
+    NOTIFY_WORD_STRUCT: struct.Struct = struct.Struct('q')
+    """The notify shared memory area is an array of these words, updated under the free list lock.  It starts
+    with the number of watching slots of each kind, followed by one slot per process: the pid of its owner
+    (0 for a slot that has never been claimed) and whether it watches each kind."""
+
+    NOTIFY_SLOT_WORDS: int = 3
+    """int: The number of words in a notify slot."""
+
+    DIRECTORY_HEADER_STRUCT: struct.Struct = struct.Struct('Q')
+    """The header of a named queue's directory shared memory area: the length of the
+    pickled queue descriptor that follows it.  It is written last, so 0 means not ready."""
+
+    ARENA_ALIGNMENT: int = 8
+    """int: In arena mode, the stride between blocks is rounded up to a multiple of this
+    value so that every block's metadata starts on an aligned offset."""
 
     qid_counter: int = 0
     """int: Each message queue has a queue ID (qid) that identifies the queue for
@@ -176,8 +506,30 @@ class ShmQueue(mpq.Queue):
                  deadlock_immanent_check: bool=True,
                  watermark_check: bool = False,
                  use_semaphores: bool = True,
+                 use_arena: bool = True,
+                 out_of_band: bool = False,
+                 fast_types: bool = True,
+                 size_classes: typing.Optional[typing.Sequence[int]] = None,
+                 capacity: int = 0,
+                 compression: typing.Union[None, str, codec.Codec] = None,
+                 compression_threshold: int = codec.DEFAULT_COMPRESSION_THRESHOLD,
+                 max_bytes: int = 0,
+                 min_blocks: int = 0,
+                 grow_blocks: int = 0,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 channels: int = 1,
+                 stats: bool = False,
+                 stats_slots: int = DEFAULT_STATS_SLOTS,
+                 notify: typing.Union[bool, str] = False,
+                 notify_slots: int = DEFAULT_NOTIFY_SLOTS,
+                 spin_time: float = DEFAULT_SPIN_TIME,
+                 spin_yield: bool = True,
+                 poll_max_sleep: float = DEFAULT_POLL_MAX_SLEEP,
+                 magazine_size: int = 0,
+                 magazine_slots: int = DEFAULT_MAGAZINE_SLOTS,
+                 ctx: typing.Any = None,
                  verbose: bool=False):
-        ctx = mp.get_context() # TODO: What is the proper type hint here?
+        ctx = ctx or mp.get_context() # TODO: What is the proper type hint here?
 
         super().__init__(maxsize, ctx=ctx)
 
@@ -191,10 +543,77 @@ class ShmQueue(mpq.Queue):
         self.chunk_size: int = min(chunk_size, self.__class__.MAX_CHUNK_SIZE) \
             if chunk_size > 0 else self.__class__.MAX_CHUNK_SIZE
 
+        if notify not in (False, True, 'msg'):
+            raise ValueError("notify must be True, False or 'msg'.")
+        if notify and notify != 'msg' and magazine_size > 0:
+            raise ValueError("notify=True cannot be used with magazines: the blocks freed into a magazine wake no one.")
+
         self.maxsize: int = maxsize if maxsize > 0 else self.__class__.DEFAULT_MAXSIZE
+        if max_bytes > 0:
+            if size_classes:
+                raise ValueError("max_bytes (an elastic pool) is not supported with size_classes.")
+            if min_blocks > 0:
+                self.maxsize = min_blocks
+
+        self.class_chunk_sizes: typing.List[int]
+        self.class_block_counts: typing.List[int]
+        if size_classes:
+            self.class_chunk_sizes = sorted(set(min(size, self.__class__.MAX_CHUNK_SIZE) for size in size_classes if size > 0))
+            if len(self.class_chunk_sizes) == 0:
+                raise ValueError("size_classes must contain at least one positive chunk size.")
+            capacity = capacity if capacity > 0 else self.class_chunk_sizes[-1] * self.maxsize
+            class_capacity: int = capacity // len(self.class_chunk_sizes)
+            self.class_block_counts = [max(1, class_capacity // (self.__class__.META_BLOCK_SIZE + size))
+                                       for size in self.class_chunk_sizes]
+            self.chunk_size = self.class_chunk_sizes[-1]
+            self.maxsize = sum(self.class_block_counts)
+        else:
+            self.class_chunk_sizes = [self.chunk_size]
+            self.class_block_counts = [self.maxsize]
+        self.capacity: int = sum(size * count for size, count in zip(self.class_chunk_sizes, self.class_block_counts))
+
+        # Block IDs are assigned to the size classes in order.
+        self.class_first_block_ids: typing.List[int] = []
+        first_block_id: int = 0
+        block_count: int
+        for block_count in self.class_block_counts:
+            self.class_first_block_ids.append(first_block_id)
+            first_block_id += block_count
+
+        # In elastic mode, blocks maxsize and up live in extents of grow_blocks blocks each.
+        self.grow_blocks: int = grow_blocks if grow_blocks > 0 else self.maxsize
+        self.max_blocks: int = max(self.maxsize, max_bytes // self.chunk_size) if max_bytes > 0 else self.maxsize
+        self.idle_timeout: float = idle_timeout
+
+        # The wait policy.  The moving average of the waits is kept by each process.
+        self.spin_time: float = max(0.0, spin_time)
+        self.spin_yield: bool = spin_yield and hasattr(os, 'sched_yield')
+        self.poll_max_sleep: float = poll_max_sleep
+        self.wait_average: float = 0.0
+        self.pool_lock = ctx.Lock()
+        self.pool: typing.Optional[SharedMemory] = None
+        if max_bytes > 0:
+            max_extents: int = math.ceil((self.max_blocks - self.maxsize) / self.grow_blocks)
+            self.pool = SharedMemory(create=True, size=self.__class__.POOL_HEADER_STRUCT.size + self.__class__.POOL_NAME_STRUCT.size * max_extents)
+            self.__class__.POOL_HEADER_STRUCT.pack_into(self.pool.buf, 0, 0, 0, 0.0)
+        self.extent_segments: typing.List[SharedMemory] = []
+        self.pool_generation: int = 0
+        self.next_shrink_check: float = 0.0
+
+        # The free list heads of the size classes come first, followed by the message list head of each channel.
+        self.free_list_heads: typing.List[int] = list(range(len(self.class_chunk_sizes)))
+        self.msg_list_heads: typing.List[int] = list(range(len(self.free_list_heads), len(self.free_list_heads) + max(1, channels)))
 
         self.serializer = serializer or pickle
 
+        self.out_of_band: bool = out_of_band
+        if self.out_of_band and self.serializer is not pickle:
+            raise ValueError("out_of_band requires the default pickle serializer.")
+        self.fast_types: bool = fast_types and self.serializer is pickle
+
+        self.codec: typing.Optional[codec.Codec] = codec.get_codec(compression)
+        self.compression_threshold: int = compression_threshold
+
         self.integrity_check: bool = integrity_check
         self.deadlock_check: bool = deadlock_check
         self.deadlock_immanent_check: bool = deadlock_immanent_check
@@ -203,29 +622,99 @@ class ShmQueue(mpq.Queue):
 
         self.mid_counter: int = 0
 
+        # Each process claims a slot of counters the first time it updates one.
+        self.stats_slots: int = max(1, stats_slots)
+        self.stats_lock = ctx.Lock() if stats else None
+        self.stats_segment: typing.Optional[SharedMemory] = None
+        if stats:
+            self.stats_segment = SharedMemory(create=True, size=self.stats_slots * (self.__class__.STATS_PID_STRUCT.size + self.stats_slot_size()))
+            self.stats_segment.buf[:] = bytes(self.stats_segment.size)
+        self.stats_pid: typing.Optional[int] = None
+        self.stats_view: typing.Optional[memoryview] = None
+        self.stats_thread_lock: typing.Optional[threading.Lock] = None
+
         self.producer_lock = ctx.Lock()
         self.free_list_lock = ctx.Lock()
-        self.msg_list_lock = ctx.Lock()
+
+        # The magazine area holds the number of claimed slots, one starving flag per size class,
+        # then in each slot, for each size class, a block count followed by magazine_size block ids.
+        self.magazine_size: int = max(0, magazine_size)
+        self.magazine_slots: int = max(1, magazine_slots)
+        self.magazine_segment: typing.Optional[SharedMemory] = None
+        self.magazine_locks: typing.List[typing.Any] = []
+        if self.magazine_size > 0:
+            self.magazine_segment = SharedMemory(create=True, size=4 * (1 + len(self.class_chunk_sizes) * (1 + self.magazine_slots * (1 + self.magazine_size))))
+            self.magazine_segment.buf[:] = bytes(self.magazine_segment.size)
+            self.magazine_locks = [ctx.Lock() for _ in range(self.magazine_slots)]
+        self.magazine_pid: typing.Optional[int] = None
+        self.magazine_view: typing.Optional[memoryview] = None
+        self.magazine_slot: int = 0
+        self.msg_list_locks: typing.List[typing.Any] = [ctx.Lock() for _ in self.msg_list_heads]
 
         self.use_semaphores: bool = use_semaphores
         if not use_semaphores:
             # Put the None case first to make mypy happier.
-            self.free_list_semaphore: typing.Optional[typing.Any] = None # TODO: what is the type returned by ctx.Semaphore(0)?
-            self.msg_list_semaphore: typing.Optional[typing.Any] = None
+            self.free_list_semaphores: typing.Optional[typing.List[typing.Any]] = None # TODO: what is the type returned by ctx.Semaphore(0)?
+            self.msg_list_semaphores: typing.Optional[typing.List[typing.Any]] = None
         else:
-            self.free_list_semaphore = ctx.Semaphore(0)
-            self.msg_list_semaphore = ctx.Semaphore(0)
+            self.free_list_semaphores = [ctx.Semaphore(0) for _ in self.free_list_heads]
+            self.msg_list_semaphores = [ctx.Semaphore(0) for _ in self.msg_list_heads]
+
+        # The message list head, lock and semaphore of the channel this queue object puts to and gets from.
+        self.channel_id: int = 0
+        self.msg_list_head: int
+        self.msg_list_lock: typing.Any
+        self.msg_list_semaphore: typing.Optional[typing.Any]
+        self.select_channel(0)
         
-        self.list_heads: SharedMemory = SharedMemory(create=True, size=self.__class__.LIST_HEAD_SIZE * 2)
-        self.init_list_head(self.__class__.FREE_LIST_HEAD)
-        self.init_list_head(self.__class__.MSG_LIST_HEAD)
+        self.list_heads: SharedMemory = SharedMemory(create=True, size=self.__class__.LIST_HEAD_SIZE * (self.msg_list_heads[-1] + 1))
+        lh: int
+        for lh in self.free_list_heads + self.msg_list_heads:
+            self.init_list_head(lh)
 
-        self.block_locks: typing.List[typing.Any] = [ctx.Lock()] * maxsize # TODO: what is the type returned by ctx.Lock()?
-        self.data_blocks: typing.List[SharedMemory] = []
-        block_id: int
-        for block_id in range(maxsize):
-            self.data_blocks.append(SharedMemory(create=True, size=self.__class__.META_BLOCK_SIZE + self.chunk_size))
-            self.add_free_block(block_id)
+        # In arena mode, the blocks of each size class are laid out back-to-back in a single segment.
+        self.use_arena: bool = use_arena
+        alignment: int = self.__class__.ARENA_ALIGNMENT
+        self.class_strides: typing.List[int] = [((self.__class__.META_BLOCK_SIZE + size + alignment - 1) // alignment) * alignment
+                                                for size in self.class_chunk_sizes]
+        self.class_offsets: typing.List[int] = []
+        arena_size: int = 0
+        stride: int
+        for stride, block_count in zip(self.class_strides, self.class_block_counts):
+            self.class_offsets.append(arena_size)
+            arena_size += stride * block_count
+        # Other processes get the segment names and open each segment when one of its blocks is first touched.
+        self.segments: typing.List[typing.Optional[SharedMemory]]
+        if self.use_arena:
+            self.segments = [SharedMemory(create=True, size=arena_size)]
+        else:
+            self.segments = [SharedMemory(create=True, size=self.class_strides[self.block_size_class(block_id)])
+                             for block_id in range(self.maxsize)]
+        self.segment_names: typing.List[str] = [typing.cast(SharedMemory, segment).name for segment in self.segments]
+        self.data_blocks: ShmBlockViews = ShmBlockViews(self.map_data_block)
+
+        # A queue that was attached by name (see `attach`) leaves its segments to the creator.
+        self.attached: bool = False
+        self.directory: typing.Optional[SharedMemory] = None
+
+        # Each process that watches the queue claims a slot, and with it a pipe of each kind.
+        self.msg_notify: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]] = None
+        self.free_notify: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]] = None
+        self.notify_slots: int = max(1, notify_slots)
+        self.notify_segment: typing.Optional[SharedMemory] = None
+        if notify:
+            self.msg_notify = [ctx.Pipe(duplex=False) for _ in range(self.notify_slots)]
+            # Nothing reads a `free_notify` pipe in 'msg' mode.
+            if notify != 'msg':
+                self.free_notify = [ctx.Pipe(duplex=False) for _ in range(self.notify_slots)]
+            self.notify_segment = SharedMemory(create=True, size=self.__class__.NOTIFY_WORD_STRUCT.size *
+                                               (2 + self.notify_slots * self.__class__.NOTIFY_SLOT_WORDS))
+            self.notify_segment.buf[:] = bytes(self.notify_segment.size)
+            self.init_notify()
+        self.notify_pid: typing.Optional[int] = None
+        self.notify_view: typing.Optional[memoryview] = None
+        self.notify_slot: int = 0
+        self.add_global_free_blocks(range(self.maxsize))
 
     def __getstate__(self):
         """This routine retrieves queue information when forking a new process."""
@@ -233,7 +722,11 @@ class ShmQueue(mpq.Queue):
                 self.verbose,
                 self.chunk_size,
                 self.maxsize,
-                dill.dumps(self.serializer),
+                None if self.serializer is pickle else dill.dumps(self.serializer),
+                self.out_of_band,
+                self.fast_types,
+                dill.dumps(self.codec),
+                self.compression_threshold,
                 self.integrity_check,
                 self.deadlock_check,
                 self.deadlock_immanent_check,
@@ -242,13 +735,42 @@ class ShmQueue(mpq.Queue):
                 self.mid_counter,
                 self.producer_lock,
                 self.free_list_lock,
-                self.msg_list_lock,
+                self.msg_list_locks,
+                self.class_chunk_sizes,
+                self.class_block_counts,
+                self.capacity,
+                self.class_first_block_ids,
+                self.free_list_heads,
+                self.msg_list_heads,
+                self.channel_id,
                 self.use_semaphores,
-                self.free_list_semaphore,
-                self.msg_list_semaphore,
-                dill.dumps(self.list_heads),
-                self.block_locks,
-                dill.dumps(self.data_blocks))
+                self.free_list_semaphores,
+                self.msg_list_semaphores,
+                self.list_heads.name,
+                self.use_arena,
+                self.class_strides,
+                self.class_offsets,
+                self.segment_names,
+                self.grow_blocks,
+                self.max_blocks,
+                self.idle_timeout,
+                self.spin_time,
+                self.spin_yield,
+                self.poll_max_sleep,
+                self.magazine_size,
+                self.magazine_slots,
+                self.segment_name(self.magazine_segment),
+                self.magazine_locks,
+                self.pool_lock,
+                self.segment_name(self.pool),
+                self.stats_slots,
+                self.stats_lock,
+                self.segment_name(self.stats_segment),
+                self.msg_notify,
+                self.free_notify,
+                self.notify_slots,
+                self.segment_name(self.notify_segment),
+                self.attached)
 
     def __setstate__(self, state):
         """This routine saves queue information when forking a new process."""
@@ -257,6 +779,10 @@ class ShmQueue(mpq.Queue):
          self.chunk_size,
          self.maxsize,
          self.serializer,
+         self.out_of_band,
+         self.fast_types,
+         self.codec,
+         self.compression_threshold,
          self.integrity_check,
          self.deadlock_check,
          self.deadlock_immanent_check,
@@ -265,366 +791,3961 @@ class ShmQueue(mpq.Queue):
          self.mid_counter,
          self.producer_lock,
          self.free_list_lock,
-         self.msg_list_lock,
+         self.msg_list_locks,
+         self.class_chunk_sizes,
+         self.class_block_counts,
+         self.capacity,
+         self.class_first_block_ids,
+         self.free_list_heads,
+         self.msg_list_heads,
+         self.channel_id,
          self.use_semaphores,
-         self.free_list_semaphore,
-         self.msg_list_semaphore,
+         self.free_list_semaphores,
+         self.msg_list_semaphores,
          self.list_heads,
-         self.block_locks,
-         self.data_blocks) = state
-
-        self.list_heads = dill.loads(self.list_heads)
-        self.data_blocks = dill.loads(self.data_blocks)
-        self.serializer = dill.loads(self.serializer)
-
-    def get_list_head_field(self, lh: int, type_: str)->int:
-        """int: Get a field from a list head.
+         self.use_arena,
+         self.class_strides,
+         self.class_offsets,
+         self.segment_names,
+         self.grow_blocks,
+         self.max_blocks,
+         self.idle_timeout,
+         self.spin_time,
+         self.spin_yield,
+         self.poll_max_sleep,
+         self.magazine_size,
+         self.magazine_slots,
+         self.magazine_segment,
+         self.magazine_locks,
+         self.pool_lock,
+         self.pool,
+         self.stats_slots,
+         self.stats_lock,
+         self.stats_segment,
+         self.msg_notify,
+         self.free_notify,
+         self.notify_slots,
+         self.notify_segment,
+         self.attached) = state
+
+        self.select_channel(self.channel_id)
+        self.directory = None
+        self.list_heads = self.attach_segment(self.list_heads)
+        self.segments = [None] * len(self.segment_names)
+        self.data_blocks = ShmBlockViews(self.map_data_block)
+        self.pool = self.attach_segment(self.pool)
+        self.stats_segment = self.attach_segment(self.stats_segment)
+        self.stats_pid = None
+        self.stats_view = None
+        self.stats_thread_lock = None
+        self.wait_average = 0.0
+        self.magazine_segment = self.attach_segment(self.magazine_segment)
+        self.magazine_pid = None
+        self.magazine_view = None
+        self.magazine_slot = 0
+        self.extent_segments = []
+        self.pool_generation = 0
+        self.next_shrink_check = 0.0
+        if self.pool is not None:
+            self.map_extents()
+        self.serializer = pickle if self.serializer is None else dill.loads(self.serializer)
+        self.codec = dill.loads(self.codec)
+        self.notify_segment = self.attach_segment(self.notify_segment)
+        self.notify_pid = None
+        self.notify_view = None
+        self.notify_slot = 0
+        self.init_notify()
+
+    @classmethod
+    def create(cls, name: str, *args, **kwargs)->'ShmQueue':
+        """ShmQueue: Create a queue that processes which did not inherit it can open with `attach`.
+
+        The queue's locks and semaphores come from the spawn context, so they are named POSIX
+        semaphores that any process can open, and a descriptor of the queue (its class, layout,
+        segment and semaphore names) is published in a shared memory area called `name`.
+        The creator owns the queue: it stays attachable until the creator closes it.
 
         Args:
-            lh (int): The index of the list head in the list head shared memory.
-            type (str): The name of the list head field."""
-        addr_s: typing.Optional[int]
-        addr_e: typing.Optional[int]
-        ctype: typing.Optional[str]
-        addr_s, addr_e, ctype = self.__class__.LIST_HEAD_STRUCT.get(type_, (None, None, None))
-        if addr_s is None or addr_e is None or ctype is None:
-            raise ValueError("get_list_head_field: unrecognized %s" % repr(type_))
-        return struct.unpack(ctype, self.list_heads.buf[(self.__class__.LIST_HEAD_SIZE * lh) + addr_s : (self.__class__.LIST_HEAD_SIZE * lh) + addr_e])[0]
+            name (str): The name of the directory shared memory area.
+            args, kwargs: The arguments of the queue class, except `ctx` and `notify`.
 
-    def set_list_head_field(self, lh: int, data: int, type_: str):
-        addr_s: typing.Optional[int]
-        addr_e: typing.Optional[int]
-        ctype: typing.Optional[str]
-        addr_s, addr_e, ctype = self.__class__.LIST_HEAD_STRUCT.get(type_, (None, None, None))
-        if addr_s is None or addr_e is None or ctype is None:
-            raise ValueError("get_list_head_field: unrecognized %s" % repr(type_))
+        Raises:
+            ValueError: The platform has no named semaphores, or `notify` was requested
+                (the notification pipes can only be inherited).
+            FileExistsError: There is already a shared memory area called `name`.
+        """
+        if sys.platform == 'win32':
+            raise ValueError("%s.create: named queues need POSIX named semaphores." % cls.__name__)
+        if kwargs.get('notify'):
+            raise ValueError("%s.create: a named queue cannot have notification pipes." % cls.__name__)
+        queue: ShmQueue = cls(*args, ctx=mp.get_context('spawn'), **kwargs)
+
+        # Processes that attach by name do not own the segments.
+        queue.attached = True
+        try:
+            buffer: io.BytesIO = io.BytesIO()
+            pickler: pickle.Pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = cls.named_lock_id # type: ignore[assignment]
+            pickler.dump((queue.__class__, queue.__getstate__()))
+        finally:
+            queue.attached = False
+        descriptor: bytes = buffer.getvalue()
 
-        # TODO: find a better way to calm mypy's annoyance at the following:
-        self.list_heads.buf[(self.__class__.LIST_HEAD_SIZE * lh) + addr_s : (self.__class__.LIST_HEAD_SIZE * lh) + addr_e] = struct.pack(ctype, data) #type: ignore
+        header: struct.Struct = cls.DIRECTORY_HEADER_STRUCT
+        directory: SharedMemory = SharedMemory(name=name, create=True, size=header.size + len(descriptor))
+        directory.buf[header.size:header.size + len(descriptor)] = descriptor
+        header.pack_into(directory.buf, 0, len(descriptor))
+        queue.directory = directory
+        return queue
 
-    def get_meta(self, block: SharedMemory, type_: str)->typing.Union[bytes, int]:
-        """typing.Union[bytes, int]: Get a field from a block's metadata area in shared memory.
+    @classmethod
+    def attach(cls, name: str)->'ShmQueue':
+        """ShmQueue: Open a queue that another process made with `create`.
+
+        The queue object has the creator's class and shares its blocks, lists, locks and
+        semaphores.  Its `close` only releases this process's mappings.
 
         Args:
-            block (SharedMemory): The shared memory for the data block.
-            type_ (str): The name of the metadata field to extract."""
-        addr_s: typing.Optional[int]
-        addr_e: typing.Optional[int]
-        ctype: typing.Optional[str]
-        addr_s, addr_e, ctype = self.__class__.META_STRUCT.get(type_, (None, None, None))
-        if addr_s is None or addr_e is None or ctype is None:
-            raise ValueError("get_meta: unrecognized %s" % repr(type_))
-        return struct.unpack(ctype, block.buf[addr_s : addr_e])[0]
-
-    def set_meta(self, block: SharedMemory, data, type_: str):
-        addr_s: typing.Optional[int]
-        addr_e: typing.Optional[int]
-        ctype: typing.Optional[str]
-        addr_s, addr_e, ctype = self.__class__.META_STRUCT.get(type_, (None, None, None))
-        if addr_s is None or addr_e is None or ctype is None:
-            raise ValueError("set_meta: unrecognized %s" % repr(type_))
+            name (str): The name the queue was created with.
 
-        # TODO: find a better way to calm mypy's annoyance at the following:
-        block.buf[addr_s : addr_e] = struct.pack(ctype, data) #type: ignore
+        Raises:
+            FileNotFoundError: There is no queue called `name`, or it is not ready yet.
+        """
+        directory: SharedMemory = SharedMemory(name=name)
+        resource_tracker.unregister(directory._name, 'shared_memory') # type: ignore[attr-defined]
+        try:
+            header: struct.Struct = cls.DIRECTORY_HEADER_STRUCT
+            length: int = header.unpack_from(directory.buf, 0)[0]
+            if length == 0:
+                raise FileNotFoundError("%s.attach: queue %r is not ready" % (cls.__name__, name))
+            unpickler: pickle.Unpickler = pickle.Unpickler(io.BytesIO(bytes(directory.buf[header.size:header.size + length])))
+            unpickler.persistent_load = cls.load_named_lock # type: ignore[assignment]
+            queue_class: typing.Type[ShmQueue]
+            state: typing.Any
+            queue_class, state = unpickler.load()
+        finally:
+            directory.close()
+        queue: ShmQueue = queue_class.__new__(queue_class)
+        queue.__setstate__(state)
+        return queue
+
+    @staticmethod
+    def named_lock_id(obj: typing.Any)->typing.Optional[typing.Tuple[typing.Any, ...]]:
+        """Pickle a lock or semaphore of a named queue as its class, kind, maximum value and semaphore name."""
+        if not isinstance(obj, mp.synchronize.SemLock):
+            return None
+        semlock: typing.Any = obj._semlock # type: ignore[attr-defined]
+        if semlock.name is None:
+            raise ValueError("ShmQueue: a lock of a named queue has no name.")
+        return (obj.__class__, semlock.kind, semlock.maxvalue, semlock.name)
+
+    @staticmethod
+    def load_named_lock(lock_id: typing.Tuple[typing.Any, ...])->typing.Any:
+        """Open a lock or semaphore of a named queue by its semaphore name (see `named_lock_id`)."""
+        lock_class: typing.Any
+        kind: int
+        maxvalue: int
+        name: str
+        lock_class, kind, maxvalue, name = lock_id
+        lock: typing.Any = lock_class.__new__(lock_class)
+        lock.__setstate__((0, kind, maxvalue, name))
+        return lock
+
+    def init_notify(self):
+        """Make both ends of the notification pipes nonblocking: a full pipe already wakes its reader."""
+        pipes: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]]
+        for pipes in (self.msg_notify, self.free_notify):
+            for pipe in pipes or []:
+                os.set_blocking(pipe[0].fileno(), False)
+                os.set_blocking(pipe[1].fileno(), False)
+
+    @staticmethod
+    def drain_notify(reader: typing.Any)->int:
+        """int: Read all of the wakeup bytes waiting in a notification pipe, given its reading end, and return their number."""
+        count: int = 0
+        while True:
+            try:
+                data: bytes = os.read(reader.fileno(), 4096)
+            except BlockingIOError:
+                break
+            if len(data) == 0:
+                break
+            count += len(data)
+        return count
 
-    def get_data(self, block: SharedMemory, data_size: int)->bytes:
-        """bytes: Get a memoryview of the a shared memory data block.
+    def notify(self, kind: int, count: int=1):
+        """Write `count` wakeup bytes, as many as fit, to the notification pipe of each process that
+        watches `kind`.  The caller has just left the lock under which it published the messages or
+        freed the blocks, so a process that started to watch before that sees them.
 
         Args:
-            block (SharedMemory): The chared memory block.
-            data_size (int): The number of bytes in the returned memoryview slice."""
-        return block.buf[self.__class__.META_BLOCK_SIZE:self.__class__.META_BLOCK_SIZE+data_size]
+            kind (int): `NOTIFY_MSG` or `NOTIFY_FREE`.
+            count (int, optional): The number of messages or blocks.  (Default is 1.)
+        """
+        buf: memoryview = self.notify_segment.buf # type: ignore[union-attr]
+        word: struct.Struct = self.__class__.NOTIFY_WORD_STRUCT
+        words: int = self.__class__.NOTIFY_SLOT_WORDS
+        # Without a watcher, a put or a free only costs this read.
+        if word.unpack_from(buf, word.size * kind)[0] == 0:
+            return
+        pipes: typing.List[typing.Tuple[typing.Any, typing.Any]] = typing.cast(typing.List[typing.Tuple[typing.Any, typing.Any]],
+                                                                              self.msg_notify if kind == self.__class__.NOTIFY_MSG else self.free_notify)
+        slot: int
+        for slot in range(self.notify_slots):
+            if word.unpack_from(buf, word.size * (2 + slot * words + 1 + kind))[0] != 0:
+                try:
+                    os.write(pipes[slot][1].fileno(), bytes(count))
+                except BlockingIOError:
+                    pass
 
-    def set_data(self, block: SharedMemory, data: bytes, data_size: int):
-        # TODO: find a better way to calm mypy's annoyance at the following:
-        block.buf[self.__class__.META_BLOCK_SIZE:self.__class__.META_BLOCK_SIZE+data_size] = data # type: ignore
+    def get_notify_view(self)->memoryview:
+        """memoryview: Get the notify area as an array of 64-bit integers, claiming a slot if this process
+        has none yet (e.g. it was just forked).  The queue has `notify`.
 
-    def init_list_head(self, lh: int):
-        """Initialize a block list, clearing the block count and setting the first_block
-           and last_block fields to the reserved value that indicates that they are
-           void pointers.
+        Raises:
+            ValueError: Every slot is owned by another live process.
+        """
+        if self.notify_pid != os.getpid():
+            if self.notify_view is None:
+                self.notify_view = self.notify_segment.buf.cast('q') # type: ignore[union-attr]
+            self.notify_slot = self.claim_notify_slot()
+            self.notify_pid = os.getpid()
+        return typing.cast(memoryview, self.notify_view)
+
+    def claim_notify_slot(self)->int:
+        """int: Take the notify slot of this process: the one it already owns (through another object of
+        the queue, such as a channel), else one that has never been claimed or whose owner has exited.
+
+        Raises:
+            ValueError: Every slot is owned by another live process.
+        """
+        words: memoryview = typing.cast(memoryview, self.notify_view)
+        size: int = self.__class__.NOTIFY_SLOT_WORDS
+        pid: int = os.getpid()
+        with self.free_list_lock:
+            owners: typing.List[int] = [words[2 + slot * size] for slot in range(self.notify_slots)]
+            slot: int
+            if pid in owners:
+                return owners.index(pid)
+            if 0 in owners:
+                slot = owners.index(0)
+            else:
+                dead: typing.List[int] = [slot for slot, owner in enumerate(owners) if not self.pid_alive(owner)]
+                if len(dead) == 0:
+                    raise ValueError("ShmQueue: qid=%d: all %d notify slots are owned by live processes" % (self.qid, self.notify_slots))
+                slot = dead[0]
+                # The previous owner may have exited while it was watching.
+                kind: int
+                for kind in (self.__class__.NOTIFY_MSG, self.__class__.NOTIFY_FREE):
+                    if words[2 + slot * size + 1 + kind] != 0:
+                        words[2 + slot * size + 1 + kind] = 0
+                        words[kind] -= 1
+            words[2 + slot * size] = pid
+        pipes: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]]
+        for pipes in (self.msg_notify, self.free_notify):
+            if pipes is not None:
+                self.drain_notify(pipes[slot][0])
+        return slot
+
+    def notify_reader(self, kind: int)->typing.Any:
+        """Get the reading end of this process's notification pipe of a kind, for `select` or an event loop.
 
         Args:
-            lh (int): The index of the list head in the list head shared memory area."""
-        self.set_list_head_field(lh, 0, 'block_count')
-        self.set_list_head_field(lh, self.__class__.RESERVED_BLOCK_ID, 'first_block')
-        self.set_list_head_field(lh, self.__class__.RESERVED_BLOCK_ID, 'last_block')
+            kind (int): `NOTIFY_MSG` or `NOTIFY_FREE`.
 
-    def get_block_count(self, lh: int)->int:
-        """int: Get the count of blocks queued in a block list.
+        Raises:
+            ValueError: The queue has no pipes of that kind, or every slot is owned by another live process.
+        """
+        pipes: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]] = \
+            self.msg_notify if kind == self.__class__.NOTIFY_MSG else self.free_notify
+        if pipes is None:
+            raise ValueError("ShmQueue: qid=%d: the queue has no notification pipes of kind %d." % (self.qid, kind))
+        self.get_notify_view()
+        return pipes[self.notify_slot][0]
+
+    def watch(self, kind: int, watching: bool=True):
+        """Start (or stop) writing a byte to this process's notification pipe of a kind for each
+        message published or block freed.  A process watches or not as a whole, whichever object of
+        the queue it uses.  Check the queue after starting to watch and before waiting on the pipe:
+        what was published before the call writes no byte.
 
         Args:
-            lh (int): The index of the list head in the list head shared memory area.
+            kind (int): `NOTIFY_MSG` or `NOTIFY_FREE`.
+            watching (bool, optional): False to stop watching.  (Default is True.)
+
+        Raises:
+            ValueError: The queue has no pipes of that kind, or every slot is owned by another live process.
         """
-        return self.get_list_head_field(lh, 'block_count')
+        self.notify_reader(kind)
+        words: memoryview = typing.cast(memoryview, self.notify_view)
+        index: int = 2 + self.notify_slot * self.__class__.NOTIFY_SLOT_WORDS + 1 + kind
+        with self.free_list_lock:
+            if words[index] != int(watching):
+                words[index] = int(watching)
+                words[kind] += 1 if watching else -1
+        if watching:
+            # Messages are published under the message list locks and the flags are read after them,
+            # so once this process has been through each lock, either the publisher sees the flag or
+            # this process sees the message.  The free list lock orders the freed blocks likewise.
+            lock: typing.Any
+            for lock in {id(lock): lock for lock in self.msg_list_locks}.values():
+                with lock:
+                    pass
+
+    @staticmethod
+    def segment_name(segment: typing.Optional[SharedMemory])->typing.Optional[str]:
+        """typing.Optional[str]: Get the name of an optional shared memory segment."""
+        return segment.name if segment is not None else None
+
+    def attach_segment(self, name: typing.Optional[str])->typing.Optional[SharedMemory]:
+        """typing.Optional[SharedMemory]: Open an optional shared memory segment by name.
+
+        A queue that was attached by name keeps its segments out of this process's resource
+        tracker, which would otherwise unlink them under the creator when this process exits."""
+        if name is None:
+            return None
+        segment: SharedMemory = SharedMemory(name=name)
+        if self.attached:
+            resource_tracker.unregister(segment._name, 'shared_memory') # type: ignore[attr-defined]
+        return segment
 
-    def get_first_block(self, lh: int)->typing.Optional[int]:
-        """Get the first block on a block list, updating the list head fields.
+    def get_segment(self, index: int)->SharedMemory:
+        """SharedMemory: Get one of the pool's initial segments, opening it if this process has not yet.
 
         Args:
-            lh (int): The index of the list head in the list head shared memory area.
+            index (int): The segment index: 0 in arena mode, otherwise the block id.
+        """
+        segment: typing.Optional[SharedMemory] = self.segments[index]
+        if segment is None:
+            segment = typing.cast(SharedMemory, self.attach_segment(self.segment_names[index]))
+            self.segments[index] = segment
+        return segment
 
-        Returns:
-            None: No block is available
-            int: The block_id of the first available block.
+    def map_data_block(self, block_id: int)->memoryview:
+        """memoryview: Build the view of a block over its shared memory segment.
+
+        In arena mode there is a single segment, and block `block_id` of size class `c`
+        lives at offset `class_offsets[c] + (block_id - class_first_block_ids[c]) * class_strides[c]`.
+        Otherwise there is one segment per block.  The blocks of an elastic pool's extents
+        follow the initial `maxsize` blocks, `grow_blocks` to an extent.
+
+        Args:
+            block_id (int): The block identifier.
+
+        Raises:
+            IndexError: This process has no such block.
         """
+        stride: int
+        if block_id >= self.maxsize:
+            extent: int
+            index: int
+            extent, index = divmod(block_id - self.maxsize, self.grow_blocks)
+            if extent >= len(self.extent_segments):
+                raise IndexError("ShmQueue: qid=%d: block %d is not mapped" % (self.qid, block_id))
+            stride = self.class_strides[0]
+            return self.extent_segments[extent].buf[index * stride:(index + 1) * stride]
+        if block_id < 0:
+            raise IndexError("ShmQueue: qid=%d: block %d is not mapped" % (self.qid, block_id))
+        size_class: int = self.block_size_class(block_id)
+        stride = self.class_strides[size_class]
+        if self.use_arena:
+            offset: int = self.class_offsets[size_class] + (block_id - self.class_first_block_ids[size_class]) * stride
+            return self.get_segment(0).buf[offset:offset + stride]
+        return self.get_segment(block_id).buf[0:stride]
+
+    def block_size_class(self, block_id: int)->int:
+        """int: Get the index of the size class that a block belongs to.
 
-        block_count: int = self.get_block_count(lh)
-        if block_count == 0:
-            return None
+        Args:
+            block_id (int): The block identifier."""
+        return bisect.bisect_right(self.class_first_block_ids, block_id) - 1
 
-        block_id: int = self.get_list_head_field(lh, 'first_block')
+    def select_size_class(self, msg_len: int)->int:
+        """int: Get the index of the smallest size class whose chunks hold a whole message,
+        or of the largest size class if no chunk is large enough.
 
-        block_count -= 1
-        if block_count == 0:
-            self.init_list_head(lh)
-        else:
-            with self.block_locks[block_id]:
-                maybe_next_block_id: typing.Union[bytes, int] = self.get_meta(self.data_blocks[block_id], 'next_block_id')
-                if isinstance(maybe_next_block_id, int):
-                    next_block_id: int = maybe_next_block_id
-                else:
-                    raise ValueError("get_first_block internal error: next_block_id is not int.")
-            self.set_list_head_field(lh, next_block_id, 'first_block')
-            self.set_list_head_field(lh, block_count, 'block_count')
-        return block_id
+        Args:
+            msg_len (int): The length of the serialized message in bytes."""
+        return min(bisect.bisect_left(self.class_chunk_sizes, msg_len), len(self.class_chunk_sizes) - 1)
 
-    def add_block(self, lh: int, block_id: int):
-        """Add a block to a block list.
+    def select_channel(self, channel_id: int):
+        """Make `put`, `get` and the other queue methods of this object use a channel's message list.
 
         Args:
-            lh (int): The index of the list head in the list head shared memory area.
+            channel_id (int): The channel, between 0 and `channels` - 1.
         """
-        block_count: int = self.get_list_head_field(lh, 'block_count')
-        if block_count == 0:
-            self.set_list_head_field(lh, block_id, 'first_block')
-            self.set_list_head_field(lh, block_id, 'last_block')
-            self.set_list_head_field(lh, 1, 'block_count')
-        
-        else:
-            last_block: int = self.get_list_head_field(lh, 'last_block')
-            with self.block_locks[last_block]:
-                self.set_meta(self.data_blocks[last_block], block_id, 'next_block_id')
-            self.set_list_head_field(lh, block_id, 'last_block')
-            self.set_list_head_field(lh, block_count + 1, 'block_count')
-                
-    def get_free_block_count(self)->int:
-        """int: Get the number of free blocks."""
-        with self.free_list_lock:
-            return self.get_block_count(self.__class__.FREE_LIST_HEAD)
+        self.channel_id = channel_id
+        self.msg_list_head = self.msg_list_heads[channel_id]
+        self.msg_list_lock = self.msg_list_locks[channel_id]
+        self.msg_list_semaphore = self.msg_list_semaphores[channel_id] if self.msg_list_semaphores is not None else None
+
+    def get_pool_header(self)->typing.Tuple[int, int, float]:
+        """typing.Tuple[int, int, float]: Get the elastic pool header (extent_count, generation, last_pressure)."""
+        return typing.cast(typing.Tuple[int, int, float], self.__class__.POOL_HEADER_STRUCT.unpack_from(typing.cast(SharedMemory, self.pool).buf, 0))
+
+    def set_pool_header(self, extent_count: int, generation: int, last_pressure: float):
+        """Set the elastic pool header.  The caller must hold the pool lock."""
+        self.__class__.POOL_HEADER_STRUCT.pack_into(typing.cast(SharedMemory, self.pool).buf, 0, extent_count, generation, last_pressure)
+
+    def check_pool(self):
+        """Remap the extents if another process has added or released one since this
+        process last looked.  A no-op unless the pool is elastic."""
+        if self.pool is not None and self.get_pool_header()[1] != self.pool_generation:
+            self.map_extents()
+
+    def map_extents(self):
+        """Bring this process's extent mapping in line with the elastic pool's list of extents.
+
+        Extents that are still listed under the same name are kept; the rest are unmapped,
+        and the newly listed ones are attached (their block views are built on first access).
+        """
+        pool: SharedMemory = typing.cast(SharedMemory, self.pool)
+        names: typing.List[str]
+        with self.pool_lock:
+            extent_count: int
+            generation: int
+            extent_count, generation, _ = self.get_pool_header()
+            names = [self.__class__.POOL_NAME_STRUCT.unpack_from(pool.buf, self.__class__.POOL_HEADER_STRUCT.size + self.__class__.POOL_NAME_STRUCT.size * extent)[0].rstrip(b'\0').decode('utf-8')
+                     for extent in range(extent_count)]
+
+        keep: int = 0
+        while keep < min(len(self.extent_segments), len(names)) and self.extent_segments[keep].name == names[keep]:
+            keep += 1
+        self.unmap_extents(keep)
+        name: str
+        for name in names[keep:]:
+            self.attach_extent(typing.cast(SharedMemory, self.attach_segment(name)))
+        self.pool_generation = generation
+
+    def attach_extent(self, segment: SharedMemory):
+        """Append an extent's segment to this process's mapping.
 
-    def get_first_free_block(self, block: bool, timeout: typing.Optional[float])->typing.Optional[int]:
-        """Get the first free block.
+        Args:
+            segment (SharedMemory): The extent's shared memory segment.
+        """
+        self.extent_segments.append(segment)
 
-           When using semaphores, optionally block with an optional timeout.  If
-           you choose to block without a timeout, the method will not return until
-           a free block is available.
+    def unmap_extents(self, keep: int, unlink: bool=False):
+        """Release this process's views of all extents but the first `keep`, and close their segments.
 
         Args:
-            block (bool): When True, and when using semaphores, wait until an
-               free block is available or a timeout occurs.
-            timeout (typing.Optional[float]): When block is True and timeout is
-               positive, block for at most timeout seconds attempting to acquire
-               the free block.
+            keep (int): The number of extents to keep.
+            unlink (bool): When True, also unlink the segments (only for extents that are no longer listed).
+        """
+        self.data_blocks.release(self.maxsize + keep * self.grow_blocks)
+        segment: SharedMemory
+        for segment in self.extent_segments[keep:]:
+            segment.close()
+            if unlink:
+                segment.unlink()
+        del self.extent_segments[keep:]
+
+    def grow_pool(self, count: int)->int:
+        """Add extents to an elastic pool so that `count` more free blocks can be taken.
+
+        This is called by producers that could not get a free block.  If the blocks have
+        meanwhile become available (another producer grew the pool, or a consumer freed
+        blocks), nothing is added.  The pool never grows beyond `max_blocks` blocks.
+
+        Args:
+            count (int): The number of free blocks the caller needs.
 
         Returns:
-            None: No block is available
-            int: The block_id of the first available block.
+            int: The number of blocks added.
         """
-        if self.free_list_semaphore is not None:
-            self.free_list_semaphore.acquire(block=block, timeout=timeout)
+        if self.pool is None:
+            return 0
+        added: int = 0
+        lh: int = self.free_list_heads[0]
         with self.free_list_lock:
-            return self.get_first_block(self.__class__.FREE_LIST_HEAD)
-
-    def add_free_block(self, block_id: int):
-        """Return a block to the free block list.
+            self.check_pool()
+            shortfall: int
+            if self.free_list_semaphores is not None:
+                semaphore = self.free_list_semaphores[0]
+                permits: int = 0
+                while permits < count and semaphore.acquire(block=False):
+                    permits += 1
+                for _ in range(permits):
+                    semaphore.release()
+                shortfall = count - permits
+            else:
+                shortfall = count - self.get_block_count(lh)
+
+            extent_count: int
+            generation: int
+            with self.pool_lock:
+                extent_count, generation, _ = self.get_pool_header()
+                self.set_pool_header(extent_count, generation, time.time())
+            while shortfall > 0 and self.maxsize + (extent_count + 1) * self.grow_blocks <= self.max_blocks:
+                segment: SharedMemory = SharedMemory(create=True, size=self.class_strides[0] * self.grow_blocks)
+                first_block_id: int = self.maxsize + len(self.extent_segments) * self.grow_blocks
+                self.attach_extent(segment)
+                block_id: int
+                for block_id in range(first_block_id, first_block_id + self.grow_blocks):
+                    self.add_block(lh, block_id)
+                with self.pool_lock:
+                    self.__class__.POOL_NAME_STRUCT.pack_into(self.pool.buf, self.__class__.POOL_HEADER_STRUCT.size + self.__class__.POOL_NAME_STRUCT.size * extent_count,
+                                                              segment.name.encode('utf-8'))
+                    extent_count += 1
+                    generation += 1
+                    self.set_pool_header(extent_count, generation, time.time())
+                self.pool_generation = generation
+                added += self.grow_blocks
+                shortfall -= self.grow_blocks
+                if self.verbose:
+                    print("grow_pool: qid=%d pid=%d: added %d blocks in %s (%d extents)" % (self.qid, os.getpid(), self.grow_blocks, segment.name, extent_count), file=sys.stderr, flush=True) # ***
+
+        if self.free_list_semaphores is not None:
+            for _ in range(added):
+                self.free_list_semaphores[0].release()
+        return added
+
+    def shrink_check_interval(self)->float:
+        """float: The time, in seconds, between two checks of this process for idle extents."""
+        return min(self.__class__.SHRINK_CHECK_INTERVAL, max(self.__class__.SHRINK_CHECK_MIN_INTERVAL, self.idle_timeout / 2))
+
+    def maybe_shrink_pool(self):
+        """Call `shrink_pool` unless this process did less than `shrink_check_interval` seconds ago.
+        This is called when blocks are freed and while a process waits on an elastic pool, so that
+        the free list is not walked on every free and an idle queue still releases its extents."""
+        now: float = time.time()
+        if now < self.next_shrink_check:
+            return
+        self.next_shrink_check = now + self.shrink_check_interval()
+        self.shrink_pool()
+
+    def shrink_pool(self, force: bool=False)->int:
+        """Release idle extents of an elastic pool, newest first.
+
+        An extent is released when all of its blocks are free and, unless `force` is True,
+        no producer has run short of free blocks for `idle_timeout` seconds.  The `min_blocks`
+        blocks that the queue was created with are never released.
 
         Args:
-            block_id (int): The identifier of the block being returned.
+            force (bool): When True, ignore the quiet period.
+
+        Returns:
+            int: The number of blocks released.
         """
+        if self.pool is None:
+            return 0
+        extent_count: int
+        generation: int
+        last_pressure: float
+        extent_count, generation, last_pressure = self.get_pool_header()
+        if extent_count == 0 or (not force and time.time() - last_pressure < self.idle_timeout):
+            return 0
+
+        released: int = 0
+        lh: int = self.free_list_heads[0]
         with self.free_list_lock:
-            self.add_block(self.__class__.FREE_LIST_HEAD, block_id)
-        if self.free_list_semaphore is not None:
-            self.free_list_semaphore.release()
-
-    def get_msg_count(self)->int:
-        """int: Get the number of messages on the message list."""
-        with self.msg_list_lock:
-            return self.get_block_count(self.__class__.MSG_LIST_HEAD)
+            self.check_pool()
+            extent_count, generation, last_pressure = self.get_pool_header()
+            if not force and time.time() - last_pressure < self.idle_timeout:
+                return 0
+            if self.get_block_count(lh) < self.grow_blocks:
+                return 0  # Not even one extent can be entirely free.
+
+            # Walk the free list once, then peel off extents from the top while they are entirely free.
+            free_block_ids: typing.List[int] = []
+            block_id: typing.Optional[int] = self.get_list_head(lh)[0]
+            for _ in range(self.get_block_count(lh)):
+                free_block_ids.append(typing.cast(int, block_id))
+                block_id = typing.cast(int, self.get_meta(self.data_blocks[typing.cast(int, block_id)], 'next_block_id'))
+            while extent_count > 0:
+                first_block_id: int = self.maxsize + (extent_count - 1) * self.grow_blocks
+                if sum(1 for block_id in free_block_ids if block_id >= first_block_id) - released < self.grow_blocks:
+                    break
+                if self.free_list_semaphores is not None:
+                    permits: int = 0
+                    while permits < self.grow_blocks and self.free_list_semaphores[0].acquire(block=False):
+                        permits += 1
+                    if permits < self.grow_blocks:
+                        # Some of the free blocks are already promised to producers.
+                        for _ in range(permits):
+                            self.free_list_semaphores[0].release()
+                        break
+                extent_count -= 1
+                released += self.grow_blocks
+
+            if released == 0:
+                return 0
+
+            limit: int = self.maxsize + extent_count * self.grow_blocks
+            self.init_list_head(lh)
+            for block_id in free_block_ids:
+                if block_id < limit:
+                    self.add_block(lh, block_id)
+            with self.pool_lock:
+                self.set_pool_header(extent_count, generation + 1, last_pressure)
+            self.pool_generation = generation + 1
+            self.unmap_extents(extent_count, unlink=True)
+            if self.verbose:
+                print("shrink_pool: qid=%d pid=%d: released %d blocks (%d extents left)" % (self.qid, os.getpid(), released, extent_count), file=sys.stderr, flush=True) # ***
+        return released
 
-    def get_first_msg(self, block: bool, timeout: typing.Optional[float])->typing.Optional[int]:
-        """Take the first available message, if any, from the available message list.
+    def stats_slot_size(self)->int:
+        """int: The size of a per-process stats slot in bytes."""
+        return 8 * (len(self.__class__.STATS_FIELDS) + self.__class__.STATS_HISTOGRAM_BUCKETS)
 
-           When using semaphores, optionally block with an optional timeout.  If
-           you choose to block without a timeout, the method will not return until
-           a free block is available.
+    def get_stats_view(self)->memoryview:
+        """memoryview: Get this process's stats counters as an array of unsigned 64-bit integers,
+        claiming a slot if this process has none yet (e.g. it was just forked).  The queue has `stats`.
 
-        Args:
-            block (bool): When True, and when using semaphores, wait until an
-               message is available or a timeout occurs.
-            timeout (typing.Optional[float]): When block is True and timeout is
-               positive, block for at most timeout seconds attempting to acquire
-               the message.
+        Raises:
+            ValueError: Every slot is owned by a live process.
+        """
+        if self.stats_pid != os.getpid():
+            slot: int = self.claim_stats_slot()
+            offset: int = self.stats_slot_offset(slot)
+            if self.stats_view is not None:
+                self.stats_view.release()
+            self.stats_view = self.stats_segment.buf[offset:offset + self.stats_slot_size()].cast('Q') # type: ignore[union-attr]
+            # The threads of this process share the slot, so they update it under a lock of this process.
+            self.stats_thread_lock = threading.Lock()
+            self.stats_pid = os.getpid()
+        return typing.cast(memoryview, self.stats_view)
+
+    def stats_slot_offset(self, slot: int)->int:
+        """int: The offset of a stats slot in the stats shared memory area."""
+        return self.stats_slots * self.__class__.STATS_PID_STRUCT.size + slot * self.stats_slot_size()
+
+    def claim_stats_slot(self)->int:
+        """int: Take a stats slot for this process: one that has never been claimed, or else one whose
+        owner has exited.  The counts of that owner stay in the slot.
 
-        Returns:
-            None: No message is available
-            int: The block_id of the first chunk of the first available message.
+        Raises:
+            ValueError: Every slot is owned by a live process.
         """
-        if self.msg_list_semaphore is not None:
-            self.msg_list_semaphore.acquire(block=block, timeout=timeout)
-        with self.msg_list_lock:
-            return self.get_first_block(self.__class__.MSG_LIST_HEAD)
+        pid_struct: struct.Struct = self.__class__.STATS_PID_STRUCT
+        buf: memoryview = self.stats_segment.buf # type: ignore[union-attr]
+        with self.stats_lock: # type: ignore[union-attr]
+            owners: typing.List[int] = [pid_struct.unpack_from(buf, slot * pid_struct.size)[0] for slot in range(self.stats_slots)]
+            slot: int
+            if 0 in owners:
+                slot = owners.index(0)
+            else:
+                dead: typing.List[int] = [slot for slot, pid in enumerate(owners) if not self.pid_alive(pid)]
+                if len(dead) == 0:
+                    raise ValueError("ShmQueue: qid=%d: all %d stats slots are owned by live processes" % (self.qid, self.stats_slots))
+                slot = dead[0]
+            pid_struct.pack_into(buf, slot * pid_struct.size, os.getpid())
+        return slot
+
+    @staticmethod
+    def pid_alive(pid: int)->bool:
+        """bool: True unless the process `pid` is known to have exited."""
+        if sys.platform == 'win32':
+            return True  # os.kill would terminate it.
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
 
-    def add_msg(self, block_id: int):
-        """Add a message to the available message list
+    def claim_stats(self):
+        """Make sure this process has a stats slot, if the queue has `stats`.  Called before a put or a
+        get takes any blocks, so that a failure to claim one leaves the queue untouched.
 
-        Args:
-            block_id (int): The block identifier of the first chunk of the message.
+        Raises:
+            ValueError: Every slot is owned by a live process.
         """
-        with self.msg_list_lock:
-            self.add_block(self.__class__.MSG_LIST_HEAD, block_id)
-        if self.msg_list_semaphore is not None:
-            self.msg_list_semaphore.release()
-        
-    def generate_msg_id(self)->bytes:
-        """bytes: Generate the next message identifier, but do not consume it.
+        if self.stats_segment is not None and self.stats_pid != os.getpid():
+            self.get_stats_view()
 
-        Note:
-            Message IDs are assigned independenyly by each process using the queue.
-            They need to be paired with the source process ID to be used to identify
-            a message for debugging.
+    def count_stat(self, stat: int, amount: int=1):
+        """Add to a counter of this process's stats slot, if the queue has `stats`.
+
+        Args:
+            stat (int): The index of the counter, e.g. `STAT_FULL`.
+            amount (int, optional): The amount to add.  (Default is 1.)
         """
-        return ("%012x" % (self.mid_counter + 1)).encode('utf-8')
+        if self.stats_segment is not None:
+            counters: memoryview = self.get_stats_view()
+            with self.stats_thread_lock: # type: ignore[union-attr]
+                counters[stat] += amount
 
-    def consume_msg_id(self):
-        """Consume a message identifier.
+    def count_put(self, msg_len: int, total_chunks: int):
+        """Count a message put in this process's stats slot.
 
-        Note:
-            Message identifiers are consumed when we are certain that we can process
-            the message.  They will not be consumed if we start to process a message
-            but fail due to a conition such as insufficient free buffers.
+        Args:
+            msg_len (int): The serialized length of the message.
+            total_chunks (int): The number of chunks of the message.
         """
-        self.mid_counter += 1
+        if self.stats_segment is None:
+            return
+        cls = self.__class__
+        counters: memoryview = self.stats_view if self.stats_pid == os.getpid() else self.get_stats_view() # type: ignore[assignment]
+        with self.stats_thread_lock: # type: ignore[union-attr]
+            counters[cls.STAT_PUTS] += 1
+            counters[cls.STAT_BYTES_IN] += msg_len
+            counters[cls.STAT_HISTOGRAM + min((total_chunks - 1).bit_length(), cls.STATS_HISTOGRAM_BUCKETS - 1)] += 1
+            if total_chunks > counters[cls.STAT_MAX_MSG_CHUNKS]:
+                counters[cls.STAT_MAX_MSG_CHUNKS] = total_chunks
+
+    def count_get(self, msg_len: int):
+        """Count a message got in this process's stats slot.
 
-    def next_writable_block_id(self, block: bool, timeout: typing.Optional[float], msg_id: bytes, src_pid: int)->int:
-        """int: Get the block ID of the first free block.
+        Args:
+            msg_len (int): The serialized length of the message.
+        """
+        if self.stats_segment is None:
+            return
+        cls = self.__class__
+        counters: memoryview = self.stats_view if self.stats_pid == os.getpid() else self.get_stats_view() # type: ignore[assignment]
+        with self.stats_thread_lock: # type: ignore[union-attr]
+            counters[cls.STAT_GETS] += 1
+            counters[cls.STAT_BYTES_OUT] += msg_len
 
-        Get the block ID of the first free block, supporting
-        blocking/nonblocking modes and timeouts when blocking, even when
-        semaphores are not being used.  Store int he block's metadata area the
-        message ID for the message we are building and the pid of the process
-        acquiring the block.
+    def count_queued(self, queued: int):
+        """Raise this process's high-water mark of queued messages.
 
         Args:
-            block (bool): When True, and when using semaphores, wait until an
-               free block is available or a timeout occurs.
-            timeout (typing.Optional[float]): When block is True and timeout is
-               positive, block for at most timeout seconds attempting to acquire
-               the free block.
-            msg_id (bytes): The message ID assigned to the message being built.
-            src_pid: The process ID (pid) of the process that is acquiring the block.
+            queued (int): The number of messages on the message list.
+        """
+        if self.stats_segment is None:
+            return
+        counters: memoryview = self.stats_view if self.stats_pid == os.getpid() else self.get_stats_view() # type: ignore[assignment]
+        with self.stats_thread_lock: # type: ignore[union-attr]
+            if queued > counters[self.__class__.STAT_MAX_QUEUED]:
+                counters[self.__class__.STAT_MAX_QUEUED] = queued
 
-        Raises:
-            queue.Full: No block is available.  Full is raised immediately in nonblocking
-               mode, or after the timeout in blocking mode when a timeout is specified.
+    def wait_semaphore(self, semaphore, block: bool, timeout: typing.Optional[float], stat: int)->bool:
+        """bool: Acquire a semaphore after a nonblocking attempt failed, adding the time spent
+        blocked to a stats counter.
 
+        Args:
+            semaphore: The semaphore.
+            block (bool): When False, only try once more without blocking.
+            timeout (typing.Optional[float]): When block is True and timeout is not None, block for at most timeout seconds.
+            stat (int): `STAT_FREE_WAIT_NS` or `STAT_MSG_WAIT_NS`.
         """
-        looped: bool = False
-        loop_cnt: int = 0
-        time_start = time.time()
-        while True:
-            remaining_timeout: typing.Optional[float] = timeout
+        if not block:
+            return semaphore.acquire(block=False)
+        time_start: float = time.perf_counter()
+        acquired: bool = False
+        spin_end: float = time_start + (self.spin_budget() if timeout is None else min(self.spin_budget(), timeout))
+        while time.perf_counter() < spin_end:
+            if self.spin_yield:
+                os.sched_yield()
+            if semaphore.acquire(block=False):
+                acquired = True
+                break
+        while not acquired:
+            remaining_timeout: typing.Optional[float] = None if timeout is None else max(0.0, timeout - (time.perf_counter() - time_start))
+            if self.pool is None:
+                acquired = semaphore.acquire(block=True, timeout=remaining_timeout)
+                break
+            # A process waiting on an elastic pool checks it for idle extents from time to time,
+            # so that a queue without traffic gives its extents back.
+            slice_timeout: float = self.shrink_check_interval()
             if remaining_timeout is not None:
-                remaining_timeout -= (time.time() - time_start)
-                if remaining_timeout <= 0:
-                    if self.verbose:
-                        print("next_writable_block_id: qid=%d src_pid=%d: queue FULL (timeout)" % (self.qid, src_pid), file=sys.stderr, flush=True) # ***
-                    raise Full
-
-            block_id: typing.Optional[int] = self.get_first_free_block(block, remaining_timeout)
-            if block_id is not None:
+                slice_timeout = min(slice_timeout, remaining_timeout)
+            acquired = semaphore.acquire(block=True, timeout=slice_timeout)
+            if acquired or (remaining_timeout is not None and remaining_timeout <= slice_timeout):
                 break
+            self.maybe_shrink_pool()
+        waited: float = time.perf_counter() - time_start
+        self.observe_wait(waited)
+        self.count_stat(stat, int(waited * 1e9))
+        return acquired
+
+    def spin_budget(self)->float:
+        """float: The time a waiting process may spin for, in seconds: `spin_time`, unless the recent
+        waits of this process have been much longer than that."""
+        if self.wait_average > self.spin_time * self.__class__.SPIN_WAIT_RATIO:
+            return 0.0
+        return self.spin_time
+
+    def observe_wait(self, waited: float):
+        """Add the duration of a wait, in seconds, to the moving average of the waits of this process."""
+        self.wait_average += (waited - self.wait_average) * self.__class__.WAIT_AVERAGE_WEIGHT
+
+    def poll_pause(self, wait_start: float):
+        """Pause between two polls of the lists without semaphores: spin (see `spin_budget`), then
+        sleep for about as long as the wait has lasted so far, between `POLL_MIN_SLEEP` and `poll_max_sleep`.
 
-            if not block:
-                if self.verbose:
-                    print("next_writable_block_id: qid=%d src_pid=%d: FULL (nonblocking)" % (self.qid, src_pid), file=sys.stderr, flush=True) # ***
-                raise Full
+        Args:
+            wait_start (float): The `time.time()` at which the wait began.
+        """
+        waited: float = time.time() - wait_start
+        if waited < self.spin_budget():
+            if self.spin_yield:
+                os.sched_yield()
+            return
+        if self.pool is not None:
+            self.maybe_shrink_pool()
+        time.sleep(min(self.poll_max_sleep, max(self.__class__.POLL_MIN_SLEEP, waited)))
+
+    def stats(self)->typing.Dict[str, typing.Any]:
+        """Get the queue's counters, summed over all the processes that used it.
 
-            if self.deadlock_check or self.verbose:
-                loop_cnt += 1
-                if (self.verbose and loop_cnt == 2) or (self.deadlock_check and loop_cnt % 10000 == 0):
-                    looped = True
-                    print("next_writable_block_id: qid=%d src_pid=%d: looping (%d loops)" % (self.qid, src_pid, loop_cnt), file=sys.stderr, flush=True) # ***
+        Returns:
+            typing.Dict[str, typing.Any]: The counters in `STATS_FIELDS` (`max_queued` and `max_msg_chunks`
+            are the maxima over the processes, and the wait times are converted to seconds as
+            `free_wait_time` and `msg_wait_time`), `chunks_histogram` mapping the upper bound of each
+            nonempty bucket of chunks per message to its message count, and the current `queued`
+            message and `free_blocks` counts.
 
-        if looped:
-            print("next_writable_block_id: qid=%d src_pid=%d: looping ended after %d loops." % (self.qid, src_pid, loop_cnt), file=sys.stderr, flush=True) # ***
+        Raises:
+            ValueError: The queue was not created with `stats`.
+        """
+        if self.stats_segment is None:
+            raise ValueError("ShmQueue: qid=%d: the queue was not created with stats." % self.qid)
+        fields: typing.Sequence[str] = self.__class__.STATS_FIELDS
+        totals: typing.List[int] = [0] * (len(fields) + self.__class__.STATS_HISTOGRAM_BUCKETS)
+        pid_struct: struct.Struct = self.__class__.STATS_PID_STRUCT
+        slot_size: int = self.stats_slot_size()
+        slot: int
+        for slot in range(self.stats_slots):
+            if pid_struct.unpack_from(self.stats_segment.buf, slot * pid_struct.size)[0] == 0:
+                continue
+            offset: int = self.stats_slot_offset(slot)
+            counters: memoryview = self.stats_segment.buf[offset:offset + slot_size].cast('Q')
+            index: int
+            value: int
+            for index, value in enumerate(counters.tolist()):
+                if index in (self.__class__.STAT_MAX_QUEUED, self.__class__.STAT_MAX_MSG_CHUNKS):
+                    totals[index] = max(totals[index], value)
+                else:
+                    totals[index] += value
+            counters.release()
+
+        result: typing.Dict[str, typing.Any] = dict(zip(fields, totals))
+        result['free_wait_time'] = result.pop('free_wait_ns') / 1e9
+        result['msg_wait_time'] = result.pop('msg_wait_ns') / 1e9
+        result['chunks_histogram'] = {2 ** bucket: count for bucket, count in enumerate(totals[len(fields):]) if count > 0}
+        result['queued'] = self.get_msg_count()
+        result['free_blocks'] = self.get_free_block_count()
+        return result
+
+    def get_list_head(self, lh: int)->typing.Tuple[int, int, int]:
+        """typing.Tuple[int, int, int]: Get a whole list head (first_block, last_block, block_count)
+        with a single unpack.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory."""
+        return self.__class__.LIST_HEAD_CODEC.unpack_from(self.list_heads.buf, self.__class__.LIST_HEAD_SIZE * lh)
+
+    def set_list_head(self, lh: int, first_block: int, last_block: int, block_count: int):
+        """Set a whole list head with a single pack.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory.
+            first_block (int): The block_id of the first block on the list.
+            last_block (int): The block_id of the last block on the list.
+            block_count (int): The number of blocks on the list."""
+        self.__class__.LIST_HEAD_CODEC.pack_into(self.list_heads.buf, self.__class__.LIST_HEAD_SIZE * lh, first_block, last_block, block_count)
+
+    def get_list_head_field(self, lh: int, type_: str)->int:
+        """int: Get a field from a list head.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory.
+            type (str): The name of the list head field."""
+        try:
+            addr_s: int
+            codec: struct.Struct
+            addr_s, codec = self.__class__.LIST_HEAD_FIELD_CODECS[type_]
+        except KeyError:
+            raise ValueError("get_list_head_field: unrecognized %s" % repr(type_))
+        return codec.unpack_from(self.list_heads.buf, (self.__class__.LIST_HEAD_SIZE * lh) + addr_s)[0]
+
+    def set_list_head_field(self, lh: int, data: int, type_: str):
+        try:
+            addr_s: int
+            codec: struct.Struct
+            addr_s, codec = self.__class__.LIST_HEAD_FIELD_CODECS[type_]
+        except KeyError:
+            raise ValueError("set_list_head_field: unrecognized %s" % repr(type_))
+        codec.pack_into(self.list_heads.buf, (self.__class__.LIST_HEAD_SIZE * lh) + addr_s, data)
+
+    def get_header(self, block: memoryview)->typing.Tuple[bytes, int, int, int, int, int, int, int, int, int]:
+        """Get a block's whole metadata area with a single unpack.
+
+        Args:
+            block (memoryview): The shared memory view of the data block.
+
+        Returns:
+            The metadata fields in `META_STRUCT` order: (msg_id, msg_size, chunk_id,
+            total_chunks, total_msg_size, checksum, src_pid, next_chunk_block_id,
+            next_block_id, msg_flags)."""
+        return self.__class__.META_CODEC.unpack_from(block, 0)
+
+    def set_header(self, block: memoryview, msg_id: bytes, msg_size: int, chunk_id: int, total_chunks: int,
+                   total_msg_size: int, checksum: int, src_pid: int, next_chunk_block_id: int,
+                   next_block_id: int, msg_flags: int):
+        """Set a block's whole metadata area with a single pack.
+
+        Args:
+            block (memoryview): The shared memory view of the data block.
+            The other arguments are the metadata fields in `META_STRUCT` order."""
+        self.__class__.META_CODEC.pack_into(block, 0, msg_id, msg_size, chunk_id, total_chunks, total_msg_size,
+                                            checksum, src_pid, next_chunk_block_id, next_block_id, msg_flags)
+
+    def get_meta(self, block: memoryview, type_: str)->typing.Union[bytes, int]:
+        """typing.Union[bytes, int]: Get a field from a block's metadata area in shared memory.
+
+        Args:
+            block (memoryview): The shared memory view of the data block.
+            type_ (str): The name of the metadata field to extract."""
+        try:
+            addr_s: int
+            codec: struct.Struct
+            addr_s, codec = self.__class__.META_FIELD_CODECS[type_]
+        except KeyError:
+            raise ValueError("get_meta: unrecognized %s" % repr(type_))
+        return codec.unpack_from(block, addr_s)[0]
+
+    def set_meta(self, block: memoryview, data, type_: str):
+        try:
+            addr_s: int
+            codec: struct.Struct
+            addr_s, codec = self.__class__.META_FIELD_CODECS[type_]
+        except KeyError:
+            raise ValueError("set_meta: unrecognized %s" % repr(type_))
+        codec.pack_into(block, addr_s, data)
+
+    def get_data(self, block: memoryview, data_size: int)->bytes:
+        """bytes: Get a memoryview of the a shared memory data block.
+
+        Args:
+            block (memoryview): The shared memory view of the data block.
+            data_size (int): The number of bytes in the returned memoryview slice."""
+        return block[self.__class__.META_BLOCK_SIZE:self.__class__.META_BLOCK_SIZE+data_size] # type: ignore
+
+    def set_data(self, block: memoryview, data: bytes, data_size: int):
+        # TODO: find a better way to calm mypy's annoyance at the following:
+        block[self.__class__.META_BLOCK_SIZE:self.__class__.META_BLOCK_SIZE+data_size] = data # type: ignore
+
+    def set_data_pieces(self, block: memoryview, pieces: typing.List[memoryview]):
+        """Copy a sequence of buffers back-to-back into a shared memory data block.
+
+        Args:
+            block (memoryview): The shared memory view of the data block.
+            pieces (typing.List[memoryview]): The byte-formatted buffers that make up the chunk."""
+        offset: int = self.__class__.META_BLOCK_SIZE
+        piece: memoryview
+        for piece in pieces:
+            block[offset:offset + piece.nbytes] = piece
+            offset += piece.nbytes
+
+    def split_msg_parts(self, msg_parts: typing.List[memoryview], chunk_size: int)->typing.List[typing.List[memoryview]]:
+        """typing.List[typing.List[memoryview]]: Split the parts of a serialized message into chunks.
+
+        Each chunk is a list of memoryview slices of the original parts whose sizes add
+        up to `chunk_size` (except for the last chunk).  No data is copied.
+
+        Args:
+            msg_parts (typing.List[memoryview]): The byte-formatted buffers that make up the message.
+            chunk_size (int): The chunk size of the size class the message is stored in."""
+        chunks: typing.List[typing.List[memoryview]] = [[]]
+        room: int = chunk_size
+        part: memoryview
+        for part in msg_parts:
+            pos: int = 0
+            while pos < part.nbytes:
+                if room == 0:
+                    chunks.append([])
+                    room = chunk_size
+                n: int = min(room, part.nbytes - pos)
+                chunks[-1].append(part[pos:pos + n])
+                pos += n
+                room -= n
+        return chunks
+
+    def dumps_out_of_band(self, msg: typing.Any)->typing.List[memoryview]:
+        """typing.List[memoryview]: Serialize a message as an out-of-band frame.
+
+        The message is pickled with protocol 5.  The pickle stream and the raw
+        contents of each out-of-band buffer are returned as separate parts after a
+        small header, so they can be copied straight into the shared blocks.
+
+        Args:
+            msg (obj): The object to serialize."""
+        buffers: typing.List[pickle.PickleBuffer] = []
+        body: bytes = pickle.dumps(msg, protocol=5, buffer_callback=buffers.append)
+        parts: typing.List[memoryview] = [memoryview(body).cast('B')]
+        buffer: pickle.PickleBuffer
+        for buffer in buffers:
+            parts.append(buffer.raw())
+        header: bytearray = bytearray(self.__class__.OOB_FRAME_COUNT_STRUCT.pack(len(parts)))
+        part: memoryview
+        for part in parts:
+            header += self.__class__.OOB_FRAME_LENGTH_STRUCT.pack(part.nbytes)
+        return [memoryview(header)] + parts
+
+    def loads_out_of_band(self, chunks: typing.List[memoryview])->typing.Any:
+        """Deserialize an out-of-band frame that is spread over a list of chunks.
+
+        Each out-of-band buffer is rebuilt with a single copy out of the chunks, and
+        the unpickled object refers to the rebuilt buffers directly.
+
+        Args:
+            chunks (typing.List[memoryview]): The chunk contents, in message order."""
+        cursor: typing.List[int] = [0, 0] # chunk index, offset in chunk
+
+        def read(size: int)->bytearray:
+            data: bytearray = bytearray(size)
+            pos: int = 0
+            while pos < size:
+                chunk: memoryview = chunks[cursor[0]]
+                n: int = min(size - pos, len(chunk) - cursor[1])
+                data[pos:pos + n] = chunk[cursor[1]:cursor[1] + n]
+                pos += n
+                cursor[1] += n
+                if cursor[1] == len(chunk):
+                    cursor[0] += 1
+                    cursor[1] = 0
+            return data
+
+        count_struct: struct.Struct = self.__class__.OOB_FRAME_COUNT_STRUCT
+        length_struct: struct.Struct = self.__class__.OOB_FRAME_LENGTH_STRUCT
+        part_count: int = count_struct.unpack(read(count_struct.size))[0]
+        part_lengths: typing.List[int] = [length_struct.unpack(read(length_struct.size))[0] for _ in range(part_count)]
+        body: bytearray = read(part_lengths[0])
+        buffers: typing.List[bytearray] = [read(length) for length in part_lengths[1:]]
+        return pickle.loads(body, buffers=buffers)
+
+    def dumps_typed(self, msg: typing.Any)->typing.Optional[typing.Tuple[int, typing.List[memoryview]]]:
+        """Write a message of one of the `fast_types` raw.
+
+        Args:
+            msg (obj): The object to serialize.
+
+        Returns:
+            None: The message has to go through the serializer.
+            tuple: The type tag and the byte-formatted buffers that make up the message.
+        """
+        msg_type: type = type(msg)
+        if msg_type is bytes:
+            return self.__class__.MSG_TYPE_BYTES, [memoryview(msg)]
+        if msg_type is bytearray:
+            return self.__class__.MSG_TYPE_BYTEARRAY, [memoryview(msg)]
+        if msg_type is str:
+            return self.__class__.MSG_TYPE_STR, [memoryview(msg.encode('utf-8', 'surrogatepass'))]
+        if msg_type is memoryview:
+            return self.__class__.MSG_TYPE_BYTES, [msg.cast('B') if msg.c_contiguous else memoryview(msg.tobytes())]
+
+        # NumPy is optional: a message can only be an array if NumPy has been imported.
+        numpy: typing.Any = sys.modules.get('numpy')
+        if numpy is not None and msg_type is numpy.ndarray and not msg.dtype.hasobject and msg.dtype.fields is None \
+           and (msg.flags.c_contiguous or msg.flags.f_contiguous):
+            return self.__class__.MSG_TYPE_NDARRAY, self.dumps_array(msg)
+        return None
+
+    def dumps_array(self, arr: typing.Any)->typing.List[memoryview]:
+        """typing.List[memoryview]: The header and the raw contents of a C- or Fortran-contiguous NumPy array
+        of a plain dtype (see `MSG_TYPE_NDARRAY`)."""
+        dtype: bytes = arr.dtype.str.encode('ascii')
+        fortran: bool = arr.ndim > 1 and not arr.flags.c_contiguous
+        header: bytearray = bytearray(self.__class__.ARRAY_HEADER_STRUCT.pack(len(dtype), arr.ndim,
+                                                                               self.__class__.ARRAY_FORTRAN if fortran else 0))
+        header += dtype
+        dim: int
+        for dim in arr.shape:
+            header += self.__class__.ARRAY_DIM_STRUCT.pack(dim)
+        header += bytes(-len(header) % self.__class__.ARRAY_ALIGNMENT)
+        return [memoryview(header), memoryview(arr.reshape(-1, order='F' if fortran else 'C').view('u1'))]
+
+    def loads_array(self, chunks: typing.List[memoryview], out: typing.Any=None)->typing.Any:
+        """Rebuild a NumPy array written by `dumps_array` with a single copy of each chunk.
+
+        Args:
+            chunks (typing.List[memoryview]): The chunk contents, in message order.
+            out (numpy.ndarray, optional): An array of the message's dtype and shape, in the message's
+                                memory order, to copy the data into.  If it is None (default), a new
+                                array is allocated.
+
+        Returns:
+            numpy.ndarray: The array (`out`, if given).
+
+        Raises:
+            ValueError: `out` does not match the message.
+        """
+        import numpy  # type: ignore
+        dtype: str
+        shape: typing.Tuple[int, ...]
+        order: str
+        offset: int
+        dtype, shape, order, offset = self.read_array_header(chunks)
+        if out is None:
+            out = numpy.empty(shape, dtype=dtype, order=order)
+        elif out.dtype != numpy.dtype(dtype) or out.shape != shape or not out.flags[order + '_CONTIGUOUS']:
+            raise ValueError("ShmQueue: qid=%d: out must be a %s-contiguous array of dtype %s and shape %r." % (self.qid, order, dtype, shape))
+        dest: memoryview = memoryview(out.reshape(-1, order=order).view('u1'))
+        pos: int = 0
+        chunk: memoryview
+        for chunk in chunks:
+            if offset >= len(chunk):
+                offset -= len(chunk)
+                continue
+            n: int = len(chunk) - offset
+            dest[pos:pos + n] = chunk[offset:]
+            pos += n
+            offset = 0
+        return out
+
+    def read_array_header(self, chunks: typing.List[memoryview])->typing.Tuple[str, typing.Tuple[int, ...], str, int]:
+        """Parse the header of an array message.
+
+        Args:
+            chunks (typing.List[memoryview]): The chunk contents, in message order.
+
+        Returns:
+            dtype (str): The dtype string.
+            shape (tuple): The shape.
+            order (str): 'C' or 'F', the memory order of the data.
+            offset (int): The offset of the data in the message.
+        """
+        def prefix(size: int)->bytes:
+            data: bytes = bytes(chunks[0][:size])
+            idx: int = 1
+            while len(data) < size:
+                data += bytes(chunks[idx][:size - len(data)])
+                idx += 1
+            return data
+
+        header_struct: struct.Struct = self.__class__.ARRAY_HEADER_STRUCT
+        dim_struct: struct.Struct = self.__class__.ARRAY_DIM_STRUCT
+        dtype_len: int
+        ndim: int
+        array_flags: int
+        dtype_len, ndim, array_flags = header_struct.unpack(prefix(header_struct.size))
+        header: bytes = prefix(header_struct.size + dtype_len + dim_struct.size * ndim)
+        dtype: str = header[header_struct.size:header_struct.size + dtype_len].decode('ascii')
+        shape: typing.Tuple[int, ...] = tuple(dim for dim, in dim_struct.iter_unpack(header[header_struct.size + dtype_len:]))
+        offset: int = len(header) + -len(header) % self.__class__.ARRAY_ALIGNMENT
+        return dtype, shape, 'F' if array_flags & self.__class__.ARRAY_FORTRAN else 'C', offset
+
+    def loads_typed(self, msg_type: int, chunks: typing.List[memoryview])->typing.Any:
+        """Rebuild a message that was written by `dumps_typed` from its chunks.
+
+        Args:
+            msg_type (int): The type tag.
+            chunks (typing.List[memoryview]): The chunk contents, in message order.
+
+        Raises:
+            ValueError: The type tag is unknown.
+        """
+        if msg_type == self.__class__.MSG_TYPE_BYTES:
+            return b''.join(chunks)
+        if msg_type == self.__class__.MSG_TYPE_STR:
+            return str(b''.join(chunks), 'utf-8', 'surrogatepass')
+        if msg_type == self.__class__.MSG_TYPE_BYTEARRAY:
+            body: bytearray = bytearray()
+            chunk: memoryview
+            for chunk in chunks:
+                body += chunk
+            return body
+        if msg_type == self.__class__.MSG_TYPE_NDARRAY:
+            return self.loads_array(chunks)
+        raise ValueError("ShmQueue: qid=%d: unknown message type tag %d" % (self.qid, msg_type))
+
+    def init_list_head(self, lh: int):
+        """Initialize a block list, clearing the block count and setting the first_block
+           and last_block fields to the reserved value that indicates that they are
+           void pointers.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory area."""
+        self.set_list_head(lh, self.__class__.RESERVED_BLOCK_ID, self.__class__.RESERVED_BLOCK_ID, 0)
+
+    def get_block_count(self, lh: int)->int:
+        """int: Get the count of blocks queued in a block list.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory area.
+        """
+        return self.get_list_head_field(lh, 'block_count')
+
+    def get_first_block(self, lh: int)->typing.Optional[int]:
+        """Get the first block on a block list, updating the list head fields.
+        The caller must hold the lock of the list.
+
+        Args:
+            lh (int): The index of the list head in the list head shared memory area.
 
-        with self.block_locks[block_id]:
-            data_block = self.data_blocks[block_id]
-            self.set_meta(data_block, msg_id, 'msg_id')
-            self.set_meta(data_block, src_pid, 'src_pid')
+        Returns:
+            None: No block is available
+            int: The block_id of the first available block.
+        """
+
+        block_id: int
+        last_block: int
+        block_count: int
+        block_id, last_block, block_count = self.get_list_head(lh)
+        if block_count == 0:
+            return None
+        if self.pool is not None:
+            self.check_pool()
 
+        block_count -= 1
+        if block_count == 0:
+            self.init_list_head(lh)
+        else:
+            maybe_next_block_id: typing.Union[bytes, int] = self.get_meta(self.data_blocks[block_id], 'next_block_id')
+            if isinstance(maybe_next_block_id, int):
+                next_block_id: int = maybe_next_block_id
+            else:
+                raise ValueError("get_first_block internal error: next_block_id is not int.")
+            self.set_list_head(lh, next_block_id, last_block, block_count)
         return block_id
 
-    def next_readable_msg(self, block: bool, timeout: typing.Optional[float]=None)->typing.Tuple[int, bytes, int, int, int]:
-        """Get the next available message, with blocking and timeouts.
+    def add_block(self, lh: int, block_id: int)->int:
+        """int: Add a block to a block list and return the new number of blocks on the list.
+        The caller must hold the lock of the list.
 
-        This method returns a 5-tuple: the data block and certain metadata.
-        The reason for this complexity is to
-        retrieve the metadata under a single access lock.
+        Args:
+            lh (int): The index of the list head in the list head shared memory area.
+        """
+        first_block: int
+        last_block: int
+        block_count: int
+        first_block, last_block, block_count = self.get_list_head(lh)
+        if block_count == 0:
+            self.set_list_head(lh, block_id, block_id, 1)
+        
+        else:
+            if self.pool is not None:
+                self.check_pool()
+            self.set_meta(self.data_blocks[last_block], block_id, 'next_block_id')
+            self.set_list_head(lh, first_block, block_id, block_count + 1)
+        return block_count + 1
+                
+    def get_free_block_count(self, size_class: typing.Optional[int]=None)->int:
+        """int: Get the number of free blocks, including the blocks cached in magazines.
+
+        Args:
+            size_class (typing.Optional[int]): The index of the size class to count,
+               or None (default) to count the free blocks of all size classes.
+        """
+        size_classes: typing.List[int] = list(range(len(self.free_list_heads))) if size_class is None else [size_class]
+        with self.free_list_lock:
+            count: int = sum(self.get_block_count(self.free_list_heads[c]) for c in size_classes)
+        if self.magazine_segment is not None:
+            words: memoryview = self.get_magazine_view()
+            slot: int
+            for slot in range(min(words[0], self.magazine_slots)):
+                count += sum(words[self.magazine_offset(slot, c)] for c in size_classes)
+        return count
+
+    def get_magazine_view(self)->memoryview:
+        """memoryview: Get the magazine area as an array of unsigned 32-bit integers, claiming
+        a magazine slot if this process has none yet (e.g. it was just forked)."""
+        if self.magazine_pid != os.getpid():
+            magazine_segment: SharedMemory = typing.cast(SharedMemory, self.magazine_segment)
+            if self.magazine_view is not None:
+                self.magazine_view.release()
+            self.magazine_view = magazine_segment.buf.cast('I')
+            with self.free_list_lock:
+                claimed: int = self.magazine_view[0]
+                self.magazine_view[0] = claimed + 1
+            self.magazine_slot = min(claimed, self.magazine_slots - 1)
+            self.magazine_pid = os.getpid()
+        return typing.cast(memoryview, self.magazine_view)
+
+    def magazine_offset(self, slot: int, size_class: int)->int:
+        """int: The index, in the magazine area, of the block count of the magazine of a slot and size class.
+        The block ids follow it."""
+        return 1 + len(self.free_list_heads) + (slot * len(self.free_list_heads) + size_class) * (1 + self.magazine_size)
+
+    @contextlib.contextmanager
+    def starving(self, size_class: int):
+        """Raise the starving flag of a size class while this process waits for a free block,
+        so that the other processes free their blocks to the free list instead of their magazines."""
+        words: memoryview = self.get_magazine_view()
+        with self.free_list_lock:
+            words[1 + size_class] += 1
+        try:
+            yield
+        finally:
+            with self.free_list_lock:
+                words[1 + size_class] -= 1
+
+    def take_magazine_blocks(self, size_class: int, count: int)->typing.List[int]:
+        """typing.List[int]: Take up to `count` blocks of a size class out of this process's magazine."""
+        words: memoryview = self.get_magazine_view()
+        offset: int = self.magazine_offset(self.magazine_slot, size_class)
+        with self.magazine_locks[self.magazine_slot]:
+            n: int = words[offset]
+            taken: int = min(n, count)
+            block_ids: typing.List[int] = list(words[offset + 1 + n - taken:offset + 1 + n])
+            words[offset] = n - taken
+        return block_ids
+
+    def put_magazine_blocks(self, size_class: int, block_ids: typing.List[int])->typing.List[int]:
+        """Put freed blocks of a size class into this process's magazine.
+
+        When the magazine overflows, it keeps the most recently freed half of its capacity.
+        When another process is starving for blocks of the size class, nothing is kept.
+
+        Returns:
+            typing.List[int]: The blocks that have to go to the free list.
+        """
+        words: memoryview = self.get_magazine_view()
+        offset: int = self.magazine_offset(self.magazine_slot, size_class)
+        with self.magazine_locks[self.magazine_slot]:
+            if words[1 + size_class] > 0:
+                return block_ids
+            n: int = words[offset]
+            if n + len(block_ids) <= self.magazine_size:
+                words[offset + 1 + n:offset + 1 + n + len(block_ids)] = array.array('I', block_ids)
+                words[offset] = n + len(block_ids)
+                return []
+            all_ids: typing.List[int] = list(words[offset + 1:offset + 1 + n]) + block_ids
+            keep: int = self.magazine_size // 2
+            words[offset + 1:offset + 1 + keep] = array.array('I', all_ids[len(all_ids) - keep:])
+            words[offset] = keep
+            return all_ids[:len(all_ids) - keep]
+
+    def steal_magazine_blocks(self, size_class: int)->int:
+        """int: Move the blocks of a size class out of every magazine to the free list, returning their number."""
+        words: memoryview = self.get_magazine_view()
+        block_ids: typing.List[int] = []
+        slot: int
+        for slot in range(min(words[0], self.magazine_slots)):
+            offset: int = self.magazine_offset(slot, size_class)
+            # The count is only read under the slot lock: a process that has not seen the
+            # starving flag may be putting blocks into its magazine right now.
+            with self.magazine_locks[slot]:
+                n: int = words[offset]
+                block_ids.extend(words[offset + 1:offset + 1 + n])
+                words[offset] = 0
+        if len(block_ids) > 0:
+            self.add_global_free_blocks(block_ids)
+        return len(block_ids)
+
+    def take_global_free_blocks(self, size_class: int, max_n: int)->typing.List[int]:
+        """typing.List[int]: Take up to `max_n` blocks of a size class off the free list without waiting."""
+        permits: int = max_n
+        if self.free_list_semaphores is not None:
+            semaphore = self.free_list_semaphores[size_class]
+            permits = 0
+            while permits < max_n and semaphore.acquire(block=False):
+                permits += 1
+        block_ids: typing.List[int] = []
+        with self.free_list_lock:
+            while len(block_ids) < permits:
+                block_id: typing.Optional[int] = self.get_first_block(self.free_list_heads[size_class])
+                if block_id is None:
+                    break
+                block_ids.append(block_id)
+        if self.free_list_semaphores is not None:
+            for _ in range(permits - len(block_ids)):
+                self.free_list_semaphores[size_class].release()
+        return block_ids
+
+    def get_first_free_block(self, block: bool, timeout: typing.Optional[float], size_class: int=0)->typing.Optional[int]:
+        """Get the first free block of a size class.
+
+           When using semaphores, optionally block with an optional timeout.  If
+           you choose to block without a timeout, the method will not return until
+           a free block is available.
+
+           With magazines, the block comes from this process's magazine, which is
+           refilled with half a magazine of blocks from the free list when it is empty.
 
         Args:
             block (bool): When True, and when using semaphores, wait until an
                free block is available or a timeout occurs.
             timeout (typing.Optional[float]): When block is True and timeout is
-               positive, block for at most timeout seconds attempting to acquire
-               the free block.
+               positive, block for at most timeout seconds attempting to acquire
+               the free block.
+            size_class (int): The index of the size class to take the block from.
+
+        Returns:
+            None: No block is available
+            int: The block_id of the first available block.
+        """
+        if self.magazine_segment is None:
+            return self.get_global_free_block(block, timeout, size_class)
+
+        block_ids: typing.List[int] = self.take_magazine_blocks(size_class, 1)
+        if len(block_ids) == 0:
+            block_ids = self.take_global_free_blocks(size_class, max(1, self.magazine_size // 2))
+            if len(block_ids) > 1:
+                rest: typing.List[int] = self.put_magazine_blocks(size_class, block_ids[1:])
+                if len(rest) > 0:
+                    self.add_global_free_blocks(rest)
+        if len(block_ids) > 0:
+            return block_ids[0]
+        time_start: float = time.time()
+        with self.starving(size_class):
+            while True:
+                self.steal_magazine_blocks(size_class)
+                if not block or self.free_list_semaphores is None:
+                    return self.get_global_free_block(block, timeout, size_class)
+                slice_timeout: float = self.starving_slice(timeout, time_start)
+                block_id: typing.Optional[int] = self.get_global_free_block(block, slice_timeout, size_class)
+                if block_id is not None or (timeout is not None and time.time() - time_start >= timeout):
+                    return block_id
+
+    def starving_slice(self, timeout: typing.Optional[float], time_start: float)->float:
+        """float: How long a starving process waits on the free list before it steals from the magazines
+        again: `STARVING_STEAL_INTERVAL`, or what is left of the timeout if that is shorter."""
+        if timeout is None:
+            return self.__class__.STARVING_STEAL_INTERVAL
+        return max(0.0, min(self.__class__.STARVING_STEAL_INTERVAL, timeout - (time.time() - time_start)))
+
+    def get_global_free_block(self, block: bool, timeout: typing.Optional[float], size_class: int=0)->typing.Optional[int]:
+        """Get the first free block of a size class off the free list.  See `get_first_free_block`."""
+        if self.free_list_semaphores is not None:
+            semaphore = self.free_list_semaphores[size_class]
+            if not semaphore.acquire(block=False):
+                self.grow_pool(1)
+                if not self.wait_semaphore(semaphore, block, timeout, self.__class__.STAT_FREE_WAIT_NS):
+                    return None
+        with self.free_list_lock:
+            block_id: typing.Optional[int] = self.get_first_block(self.free_list_heads[size_class])
+        if block_id is None and self.free_list_semaphores is None and self.grow_pool(1) > 0:
+            with self.free_list_lock:
+                block_id = self.get_first_block(self.free_list_heads[size_class])
+        return block_id
+
+    def add_free_block(self, block_id: int):
+        """Return a block to the free block list of its size class (or, with magazines,
+        to this process's magazine).
+
+        Args:
+            block_id (int): The identifier of the block being returned.
+        """
+        if self.magazine_segment is not None:
+            self.add_free_blocks([block_id])
+            return
+        size_class: int = self.block_size_class(block_id)
+        with self.free_list_lock:
+            self.add_block(self.free_list_heads[size_class], block_id)
+        if self.free_list_semaphores is not None:
+            self.free_list_semaphores[size_class].release()
+        if self.free_notify is not None:
+            self.notify(self.__class__.NOTIFY_FREE)
+        if self.pool is not None:
+            self.maybe_shrink_pool()
+
+    def get_first_free_blocks(self, count: int, block: bool, timeout: typing.Optional[float], size_class: int=0)->typing.List[int]:
+        """Take `count` free blocks of a size class, all or nothing.
+
+           The blocks are taken off the free list under a single acquisition of the
+           free list lock.
+
+        Args:
+            count (int): The number of blocks to take.
+            block (bool): When True, wait until enough free blocks are available
+               or a timeout occurs.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               not None, block for at most timeout seconds.
+            size_class (int): The index of the size class to take the blocks from.
+
+        Returns:
+            typing.List[int]: The block_ids of the blocks.
+
+        Raises:
+            queue.Full: Not enough blocks are available in nonblocking mode, or a timeout occurred.
+        """
+        if self.magazine_segment is None:
+            return self.get_global_free_blocks(count, block, timeout, size_class)
+
+        block_ids: typing.List[int] = self.take_magazine_blocks(size_class, count)
+        if len(block_ids) == count:
+            return block_ids
+        if len(block_ids) > 0:
+            self.add_global_free_blocks(block_ids)
+        time_start: float = time.time()
+        with self.starving(size_class):
+            while True:
+                self.steal_magazine_blocks(size_class)
+                if not block or self.free_list_semaphores is None:
+                    return self.get_global_free_blocks(count, block, timeout, size_class)
+                try:
+                    return self.get_global_free_blocks(count, block, self.starving_slice(timeout, time_start), size_class)
+                except Full:
+                    if timeout is not None and time.time() - time_start >= timeout:
+                        raise
+
+    def get_global_free_blocks(self, count: int, block: bool, timeout: typing.Optional[float], size_class: int=0)->typing.List[int]:
+        """Take `count` free blocks of a size class off the free list, all or nothing.  See `get_first_free_blocks`."""
+        time_start: float = time.time()
+        lh: int = self.free_list_heads[size_class]
+        if self.free_list_semaphores is not None:
+            semaphore = self.free_list_semaphores[size_class]
+            permits: int = 0
+            while permits < count:
+                remaining_timeout: typing.Optional[float] = None
+                if timeout is not None:
+                    remaining_timeout = max(0.0, timeout - (time.time() - time_start))
+                if not semaphore.acquire(block=False):
+                    self.grow_pool(count - permits)
+                    if not self.wait_semaphore(semaphore, block, remaining_timeout, self.__class__.STAT_FREE_WAIT_NS):
+                        for _ in range(permits):
+                            semaphore.release()
+                        if not block:
+                            self.count_stat(self.__class__.STAT_FULL)
+                        raise Full
+                permits += 1
+
+        while True:
+            with self.free_list_lock:
+                if self.get_block_count(lh) >= count:
+                    return [typing.cast(int, self.get_first_block(lh)) for _ in range(count)]
+            if self.free_list_semaphores is None and self.grow_pool(count) > 0:
+                continue
+            # Only reached without semaphores (or if the semaphore count drifted).
+            if not block or (timeout is not None and time.time() - time_start >= timeout):
+                if self.free_list_semaphores is not None:
+                    for _ in range(count):
+                        self.free_list_semaphores[size_class].release()
+                if not block:
+                    self.count_stat(self.__class__.STAT_FULL)
+                raise Full
+            self.poll_pause(time_start)
+
+    def add_free_blocks(self, block_ids: typing.Iterable[int]):
+        """Return blocks to the free block lists of their size classes under a single
+        acquisition of the free list lock (or, with magazines, to this process's magazines).
+
+        Args:
+            block_ids (typing.Iterable[int]): The identifiers of the blocks being returned.
+        """
+        if self.magazine_segment is None:
+            self.add_global_free_blocks(block_ids)
+            return
+        class_block_ids: typing.List[typing.List[int]] = [[] for _ in self.free_list_heads]
+        block_id: int
+        for block_id in block_ids:
+            class_block_ids[self.block_size_class(block_id)].append(block_id)
+        rest: typing.List[int] = []
+        size_class: int
+        for size_class, ids in enumerate(class_block_ids):
+            if len(ids) > 0:
+                rest.extend(self.put_magazine_blocks(size_class, ids))
+        if len(rest) > 0:
+            self.add_global_free_blocks(rest)
+
+    def add_global_free_blocks(self, block_ids: typing.Iterable[int]):
+        """Return blocks to the free block lists of their size classes under a single
+        acquisition of the free list lock.  See `add_free_blocks`."""
+        class_counts: typing.List[int] = [0] * len(self.free_list_heads)
+        with self.free_list_lock:
+            block_id: int
+            for block_id in block_ids:
+                size_class: int = self.block_size_class(block_id)
+                self.add_block(self.free_list_heads[size_class], block_id)
+                class_counts[size_class] += 1
+        if self.free_list_semaphores is not None:
+            count: int
+            for size_class, count in enumerate(class_counts):
+                for _ in range(count):
+                    self.free_list_semaphores[size_class].release()
+        if self.free_notify is not None:
+            self.notify(self.__class__.NOTIFY_FREE, sum(class_counts))
+        if self.pool is not None:
+            self.maybe_shrink_pool()
+
+    def get_msg_count(self)->int:
+        """int: Get the number of messages on the message list."""
+        with self.msg_list_lock:
+            return self.get_block_count(self.msg_list_head)
+
+    def get_first_msg(self, block: bool, timeout: typing.Optional[float])->typing.Optional[int]:
+        """Take the first available message, if any, from the available message list.
+
+           When using semaphores, optionally block with an optional timeout.  If
+           you choose to block without a timeout, the method will not return until
+           a free block is available.
+
+        Args:
+            block (bool): When True, and when using semaphores, wait until an
+               message is available or a timeout occurs.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               positive, block for at most timeout seconds attempting to acquire
+               the message.
+
+        Returns:
+            None: No message is available
+            int: The block_id of the first chunk of the first available message.
+        """
+        if self.msg_list_semaphore is not None and not self.msg_list_semaphore.acquire(block=False):
+            self.wait_semaphore(self.msg_list_semaphore, block, timeout, self.__class__.STAT_MSG_WAIT_NS)
+        with self.msg_list_lock:
+            return self.pop_msg()
+
+    def pop_msg(self)->typing.Optional[int]:
+        """Take the first message off the message list.  The caller holds the message list lock.
+
+        Returns:
+            None: No message is available
+            int: The block_id of the first chunk of the message.
+        """
+        return self.get_first_block(self.msg_list_head)
+
+    def add_msg(self, block_id: int, list_head: typing.Optional[int]=None):
+        """Add a message to the available message list
+
+        Args:
+            block_id (int): The block identifier of the first chunk of the message.
+            list_head (typing.Optional[int], optional): The message list to add to, when not
+                this object's own (`msg_list_head`).  It must be guarded by `msg_list_lock`.
+        """
+        with self.msg_list_lock:
+            queued: int = self.add_block(self.msg_list_head if list_head is None else list_head, block_id)
+        if self.msg_list_semaphore is not None:
+            self.msg_list_semaphore.release()
+        if self.msg_notify is not None:
+            self.notify(self.__class__.NOTIFY_MSG)
+        self.count_queued(queued)
+
+    def get_first_msgs(self, max_n: int, block: bool, timeout: typing.Optional[float])->typing.List[int]:
+        """Take up to `max_n` messages off the available message list under a single
+           acquisition of the message list lock.
+
+           When blocking, wait (with an optional timeout) for the first message only.
+
+        Args:
+            max_n (int): The maximum number of messages to take.
+            block (bool): When True, wait until a message is available or a timeout occurs.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               not None, block for at most timeout seconds.
+
+        Returns:
+            typing.List[int]: The block_ids of the first chunks of the messages (possibly empty).
+        """
+        wait_start: float = time.time()
+        while True:
+            permits: int = max_n
+            if self.msg_list_semaphore is not None:
+                remaining_timeout: typing.Optional[float] = None if timeout is None else max(0.0, timeout - (time.time() - wait_start))
+                if not self.msg_list_semaphore.acquire(block=False) and \
+                   not self.wait_semaphore(self.msg_list_semaphore, block, remaining_timeout, self.__class__.STAT_MSG_WAIT_NS):
+                    return []
+                permits = 1
+                while permits < max_n and self.msg_list_semaphore.acquire(block=False):
+                    permits += 1
+
+            block_ids: typing.List[int] = []
+            with self.msg_list_lock:
+                while len(block_ids) < permits:
+                    block_id: typing.Optional[int] = self.pop_msg()
+                    if block_id is None:
+                        break
+                    block_ids.append(block_id)
+            if len(block_ids) > 0 or not block:
+                return block_ids
+            if timeout is not None and time.time() - wait_start >= timeout:
+                return []
+            if self.msg_list_semaphore is None:
+                self.poll_pause(wait_start)
+
+    def add_msgs(self, block_ids: typing.List[int], list_head: typing.Optional[int]=None):
+        """Add messages to the available message list under a single acquisition of
+        the message list lock.
+
+        Args:
+            block_ids (typing.List[int]): The block identifiers of the first chunks of the messages.
+            list_head (typing.Optional[int], optional): The message list to add to, as for `add_msg`.
+        """
+        if list_head is None:
+            list_head = self.msg_list_head
+        with self.msg_list_lock:
+            queued: int = 0
+            block_id: int
+            for block_id in block_ids:
+                queued = self.add_block(list_head, block_id)
+        if self.msg_list_semaphore is not None:
+            for _ in block_ids:
+                self.msg_list_semaphore.release()
+        if self.msg_notify is not None:
+            self.notify(self.__class__.NOTIFY_MSG, len(block_ids))
+        self.count_queued(queued)
+        
+    def generate_msg_id(self)->bytes:
+        """bytes: Generate the next message identifier, but do not consume it.
+
+        Note:
+            Message IDs are assigned independenyly by each process using the queue.
+            They need to be paired with the source process ID to be used to identify
+            a message for debugging.
+        """
+        return ("%012x" % (self.mid_counter + 1)).encode('utf-8')
+
+    def consume_msg_id(self):
+        """Consume a message identifier.
+
+        Note:
+            Message identifiers are consumed when we are certain that we can process
+            the message.  They will not be consumed if we start to process a message
+            but fail due to a conition such as insufficient free buffers.
+        """
+        self.mid_counter += 1
+
+    def next_writable_block_id(self, block: bool, timeout: typing.Optional[float], msg_id: bytes, src_pid: int, size_class: int=0)->int:
+        """int: Get the block ID of the first free block.
+
+        Get the block ID of the first free block, supporting
+        blocking/nonblocking modes and timeouts when blocking, even when
+        semaphores are not being used.  Store int he block's metadata area the
+        message ID for the message we are building and the pid of the process
+        acquiring the block.
+
+        Args:
+            block (bool): When True, and when using semaphores, wait until an
+               free block is available or a timeout occurs.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               positive, block for at most timeout seconds attempting to acquire
+               the free block.
+            msg_id (bytes): The message ID assigned to the message being built.
+            src_pid: The process ID (pid) of the process that is acquiring the block.
+            size_class (int): The index of the size class to take the block from.
+
+        Raises:
+            queue.Full: No block is available.  Full is raised immediately in nonblocking
+               mode, or after the timeout in blocking mode when a timeout is specified.
+
+        """
+        looped: bool = False
+        loop_cnt: int = 0
+        polled: bool = False
+        time_start = time.time()
+        while True:
+            remaining_timeout: typing.Optional[float] = timeout
+            if remaining_timeout is not None:
+                remaining_timeout -= (time.time() - time_start)
+                if remaining_timeout <= 0:
+                    if self.verbose:
+                        print("next_writable_block_id: qid=%d src_pid=%d: queue FULL (timeout)" % (self.qid, src_pid), file=sys.stderr, flush=True) # ***
+                    raise Full
+
+            block_id: typing.Optional[int] = self.get_first_free_block(block, remaining_timeout, size_class)
+            if block_id is not None:
+                if polled:
+                    self.observe_wait(time.time() - time_start)
+                break
+
+            if not block:
+                if self.verbose:
+                    print("next_writable_block_id: qid=%d src_pid=%d: FULL (nonblocking)" % (self.qid, src_pid), file=sys.stderr, flush=True) # ***
+                self.count_stat(self.__class__.STAT_FULL)
+                raise Full
+
+            if self.deadlock_check or self.verbose:
+                loop_cnt += 1
+                if (self.verbose and loop_cnt == 2) or (self.deadlock_check and loop_cnt % 10000 == 0):
+                    looped = True
+                    print("next_writable_block_id: qid=%d src_pid=%d: looping (%d loops)" % (self.qid, src_pid, loop_cnt), file=sys.stderr, flush=True) # ***
+
+            if self.free_list_semaphores is None:
+                self.poll_pause(time_start)
+                polled = True
+
+        if looped:
+            print("next_writable_block_id: qid=%d src_pid=%d: looping ended after %d loops." % (self.qid, src_pid, loop_cnt), file=sys.stderr, flush=True) # ***
+
+        # The message ID and pid are stored in the block's metadata area
+        # together with the rest of its header in `write_msg`.
+        return block_id
+
+    def next_readable_msg(self, block: bool, timeout: typing.Optional[float]=None)->typing.Tuple[int, bytes, int, int, int]:
+        """Get the next available message, with blocking and timeouts.
+
+        This method returns a 5-tuple: the data block and certain metadata.
+        The reason for this complexity is to
+        retrieve the metadata under a single access lock.
+
+        Args:
+            block (bool): When True, and when using semaphores, wait until an
+               free block is available or a timeout occurs.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               positive, block for at most timeout seconds attempting to acquire
+               the free block.
+
+        Returns:
+            src_pid (int): The process iodentifier of the process that originated the message.
+            msg_id (bytes): The messag identifier.
+            block_id (int): The identifier for the first chunk in the message.
+            total_chunks (int): The total number of chunks in the message.
+            next_chunk_block_id (int): The identifier for the next chunk in the message.
+
+        Raises:
+            queue.Empty: no messages are available and either nonblocking mode or a timeout occured.
+            ValueError: An internal error occured in accessing the message's metadata.
+        """
+        polled: bool = False
+        time_start = time.time()
+        while True:
+            remaining_timeout: typing.Optional[float] = timeout
+            if remaining_timeout is not None:
+                remaining_timeout -= (time.time() - time_start)
+                if remaining_timeout <= 0:
+                    raise Empty
+            block_id: typing.Optional[int] = self.get_first_msg(block=block, timeout=remaining_timeout)
+            if block_id is not None:
+                if polled:
+                    self.observe_wait(time.time() - time_start)
+                break
+
+            if not block:
+                self.count_stat(self.__class__.STAT_EMPTY)
+                raise Empty
+
+            if self.msg_list_semaphore is None:
+                self.poll_pause(time_start)
+                polled = True
+
+        return self.get_msg_header(block_id)
+
+    def get_msg_header(self, block_id: int)->typing.Tuple[int, bytes, int, int, int]:
+        """Get the metadata of the first chunk of a message.
+
+        Args:
+            block_id (int): The identifier for the first chunk in the message.
+
+        Returns:
+            The same 5-tuple as `next_readable_msg`.
+
+        Raises:
+            ValueError: An internal error occured in accessing the message's metadata.
+        """
+        msg_id: bytes
+        total_chunks: int
+        src_pid: int
+        next_chunk_block_id: int
+        msg_id, _, _, total_chunks, _, _, src_pid, next_chunk_block_id, _, _ = self.get_header(self.data_blocks[block_id])
+        return src_pid, msg_id, block_id, total_chunks, next_chunk_block_id
+
+    # def debug_data_block(self):
+    #     for b in self.data_blocks:
+    #         print(bytes(b.buf[0:24]))
+
+    def serialize_msg(self, msg: typing.Any, msg_id: bytes, src_pid: int)->typing.Tuple[typing.List[memoryview], int, int]:
+        """Serialize a message into the parts that will be copied into the chunks.
+
+        Args:
+            msg (obj): The object to serialize.
+            msg_id (bytes): The message ID assigned to the message (for diagnostics).
+            src_pid (int): The process ID (pid) of the sending process (for diagnostics).
+
+        Returns:
+            msg_parts (typing.List[memoryview]): The byte-formatted buffers that make up the message.
+            msg_flags (int): The value for the msg_flags metadata field.
+            msg_len (int): The total length of the serialized message.
+        """
+        msg_flags: int = 0
+        msg_parts: typing.List[memoryview]
+        typed: typing.Optional[typing.Tuple[int, typing.List[memoryview]]] = self.dumps_typed(msg) if self.fast_types else None
+        if typed is not None:
+            msg_flags |= typed[0] << self.__class__.MSG_FLAG_TYPE_SHIFT
+            msg_parts = typed[1]
+        elif self.out_of_band:
+            msg_parts = self.dumps_out_of_band(msg)
+            msg_flags |= self.__class__.MSG_FLAG_OUT_OF_BAND
+        else:
+            msg_parts = [memoryview(self.serializer.dumps(msg))] # type: ignore[union-attr]
+        msg_len: int = sum(part.nbytes for part in msg_parts)
+        if self.integrity_check:
+            msg2: typing.Any
+            if typed is not None:
+                msg2 = self.loads_typed(typed[0], msg_parts)
+            elif self.out_of_band:
+                msg2 = self.loads_out_of_band(msg_parts)
+            else:
+                msg2 = self.serializer.loads(msg_parts[0]) # type: ignore[union-attr]
+            if self.verbose:
+                print("put: qid=%d src_pid=%d msg_id=%r: serialization integrity check is OK." % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
+        if self.codec is not None and msg_len >= self.compression_threshold:
+            codec_id: int
+            body: typing.Any
+            codec_id, body = codec.compress(self.codec, msg_parts[0] if len(msg_parts) == 1 else b''.join(msg_parts), self.compression_threshold)
+            if codec_id != 0:
+                if self.verbose:
+                    print("put: qid=%d src_pid=%d msg_id=%r: compressed %d bytes to %d with %s" % (self.qid, src_pid, msg_id, msg_len, len(body), self.codec.name), file=sys.stderr, flush=True) # ***
+                msg_parts = [memoryview(body)]
+                msg_flags |= codec_id << self.__class__.MSG_FLAG_CODEC_SHIFT
+                msg_len = len(body)
+        return msg_parts, msg_flags, msg_len
+
+    def plan_msg_chunks(self, msg_len: int, msg_id: bytes, src_pid: int)->typing.Tuple[int, int, int]:
+        """Choose the size class for a serialized message and count its chunks.
+
+        Args:
+            msg_len (int): The total length of the serialized message.
+            msg_id (bytes): The message ID assigned to the message (for diagnostics).
+            src_pid (int): The process ID (pid) of the sending process (for diagnostics).
+
+        Returns:
+            size_class (int): The index of the size class.
+            chunk_size (int): The chunk size of the size class.
+            total_chunks (int): The number of chunks needed for the message.
+
+        Raises:
+            ValueError: The message needs more chunks than its size class has blocks.
+        """
+        size_class: int = self.select_size_class(msg_len)
+        chunk_size: int = self.class_chunk_sizes[size_class]
+        total_chunks: int = max(1, math.ceil(msg_len / chunk_size))
+        if self.verbose:
+            print("put: qid=%d src_pid=%d msg_id=%r: total_chunks=%d msg_len=%d chunk_size=%d" % (self.qid, src_pid, msg_id, total_chunks, msg_len, chunk_size), file=sys.stderr, flush=True) # ***
+        if self.watermark_check or self.verbose:
+            if total_chunks > self.chunk_watermark:
+                print("put: qid=%d src_pid=%d msg_id=%r: total_chunks=%d maxsize=%d new watermark" % (self.qid, src_pid, msg_id, total_chunks, self.maxsize), file=sys.stderr, flush=True) # ***
+                self.chunk_watermark = total_chunks
+
+        block_limit: int = self.max_blocks if self.pool is not None else self.class_block_counts[size_class]
+        if self.deadlock_immanent_check and total_chunks > block_limit:
+            raise ValueError("DEADLOCK IMMANENT: qid=%d src_pid=%d: total_chunks=%d > block_count=%d (chunk_size=%d)" % (self.qid, src_pid, total_chunks, block_limit, chunk_size))
+        return size_class, chunk_size, total_chunks
+
+    def write_msg(self, block_id_list: typing.List[int], msg_parts: typing.List[memoryview], msg_flags: int, msg_len: int,
+                  chunk_size: int, msg_id: bytes, src_pid: int):
+        """Copy a serialized message into a reserved set of blocks, building the chunk chain.
+
+        Args:
+            block_id_list (typing.List[int]): The reserved blocks, one per chunk, in chunk order.
+            msg_parts (typing.List[memoryview]): The byte-formatted buffers that make up the message.
+            msg_flags (int): The value for the msg_flags metadata field.
+            msg_len (int): The total length of the serialized message.
+            chunk_size (int): The chunk size of the blocks' size class.
+            msg_id (bytes): The message ID assigned to the message.
+            src_pid (int): The process ID (pid) of the sending process.
+        """
+        total_chunks: int = len(block_id_list)
+        chunk_pieces: typing.List[typing.List[memoryview]] = self.split_msg_parts(msg_parts, chunk_size)
+        block_idx: int
+        block_id: int
+        for block_idx, block_id in enumerate(block_id_list):
+            chunk_id = block_idx + 1
+            if self.verbose:
+                print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d of total_chunks=%d" % (self.qid, src_pid, msg_id, chunk_id, total_chunks), file=sys.stderr, flush=True) # *** 
+               
+            data_block: memoryview = self.data_blocks[block_id]
+            pieces: typing.List[memoryview] = chunk_pieces[block_idx]
+            msg_size: int = sum(piece.nbytes for piece in pieces)
+            if self.verbose:
+                print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d msg_size=%d." % (self.qid, src_pid, msg_id, chunk_id, block_id, msg_size), file=sys.stderr, flush=True) # ***
+            if self.integrity_check:
+                checksum: int = 1 # The adler32 starting value.
+                piece: memoryview
+                for piece in pieces:
+                    checksum = zlib.adler32(piece, checksum)
+                if self.verbose:
+                    print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: checksum=%x total_msg_size=%d" % (self.qid, src_pid, msg_id, chunk_id, checksum, msg_len), file=sys.stderr, flush=True) # ***
+
+            if chunk_id == total_chunks:
+                # No more chunks, store a reserved value to simplify debugging.
+                next_chunk_block_id: int = self.__class__.RESERVED_BLOCK_ID
+            else:
+                # Store the block ID of the next chunk.
+                next_chunk_block_id = block_id_list[block_idx + 1]
+
+            # The block is not on any list, so its next_block_id is void.  No lock is
+            # needed: the block belongs to this producer until it is published.
+            self.set_header(data_block, msg_id, msg_size, chunk_id, total_chunks,
+                            msg_len if self.integrity_check else 0, checksum if self.integrity_check else 0,
+                            src_pid, next_chunk_block_id, self.__class__.RESERVED_BLOCK_ID, msg_flags)
+            self.set_data_pieces(data_block, pieces)
+        self.count_put(msg_len, total_chunks)
+
+    def put(self, msg: typing.Any, block: bool=True, timeout: typing.Optional[float]=None):
+
+        """
+        Put an object into a shared memory queue.
+
+        Args:
+            msg (obj): The object which is to be put into queue.
+            block (bool, optional): If it is set to True (default), it will return after an item is put into queue.
+            timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
+
+        Raises:
+            queue.Full: Raised if the call times out or the queue is full when `block` is False.
+            ValueError: An internal error occured in accessing the message's metadata.
+            ValueError: A request was made to send a message that, when serialized, exceeds the capacity of the queue.
+            PicklingError: This exception is raised when the serializer is pickle and
+                an error occured in serializing the message.
+            UnpicklingError: This exception is raised when the serializer is pickle and
+                an error occured in deserializing the message for an integrity check.
+
+        Note:
+            - Errors other then PicklingError might be raised if a serialized other then
+              pickle is specified.
+        """
+        self._put(msg, block, timeout)
+
+    def _put(self, msg: typing.Any, block: bool, timeout: typing.Optional[float], list_head: typing.Optional[int]=None):
+        """Put an object into a message list.  See `put`.
+
+        Args:
+            list_head (typing.Optional[int], optional): The message list, when not this object's own.
+                It is passed down rather than selected on `self`, so that threads sharing this object
+                may put to different lists.
+        """
+        if timeout is not None:
+            if not block:
+                raise ValueError("A timeout is allowed only when not blocking.")
+            if timeout < 0:
+                raise Full
+        self.claim_stats()
+
+        msg_id: bytes = self.generate_msg_id()
+        src_pid: int = os.getpid()
+        msg_parts: typing.List[memoryview]
+        msg_flags: int
+        msg_len: int
+        msg_parts, msg_flags, msg_len = self.serialize_msg(msg, msg_id, src_pid)
+        size_class: int
+        chunk_size: int
+        total_chunks: int
+        size_class, chunk_size, total_chunks = self.plan_msg_chunks(msg_len, msg_id, src_pid)
+        
+        time_start: float = time.time()
+
+        # We acquire the producer lock to avoid deadlock if multiple
+        # producers need multiple chunks each.  A producer that needs a
+        # single chunk never waits while holding a block, so it can skip it.
+        use_producer_lock: bool = total_chunks > 1
+        lock_acquired: bool = self.producer_lock.acquire(timeout=timeout) if use_producer_lock else True
+        if not lock_acquired:
+            # We must have timed out.
+            if self.verbose:
+                print("put: qid=%d src_pid=%d msg_id=%r: queue FULL" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
+            raise Full
+
+        block_id: int
+        block_id_list: typing.List[int] = [ ]
+        try:
+            # In case we will process more than one chunk and this is a
+            # nonblocking or timed out request, start by reserving all the
+            # blocks that we will need.
+            i: int
+            for i in range(total_chunks):
+                try:
+                    remaining_timeout: typing.Optional[float] = timeout
+                    if remaining_timeout is not None:
+                        remaining_timeout -= (time.time() - time_start)
+                        if remaining_timeout <= 0:
+                            if self.verbose:
+                                print("put: qid=%d src_pid=%d msg_id=%r: queue FULL" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
+                            raise Full
+
+                    block_id = self.next_writable_block_id(block, remaining_timeout, msg_id, src_pid, size_class)
+                    block_id_list.append(block_id)
+
+                except Full:
+                    # We failed to find a free block and/or a timeout occured.
+                    # Release the reserved blocks.
+                    if self.verbose:
+                        print("put: qid=%d src_pid=%d msg_id=%r: releasing %d blocks" % (self.qid, src_pid, msg_id, len(block_id_list)), file=sys.stderr, flush=True) # ***
+                    self.add_free_blocks(block_id_list)
+                    raise
+
+        finally:
+            # Now that we have acquired the full set of chunks, we can release
+            # the producer lock.  We don't want to hold it while we transfer
+            # data into the blocks.
+            if use_producer_lock:
+                if self.verbose:
+                    print("put: qid=%d src_pid=%d msg_id=%r: releasing producer lock" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # *** 
+                self.producer_lock.release()
+
+            # Consume this message ID.
+            self.consume_msg_id()
+
+        if self.verbose:
+            print("put: qid=%d src_pid=%d msg_id=%r: acquired %d blocks" % (self.qid, src_pid, msg_id, total_chunks), file=sys.stderr, flush=True) # *** 
+
+        # Now that we have a full set of blocks, build the
+        # chunks:
+        self.write_msg(block_id_list, msg_parts, msg_flags, msg_len, chunk_size, msg_id, src_pid)
+
+        # Now that the entire message has built, queue it:
+        self.add_msg(block_id_list[0], list_head)
+        if self.verbose:
+            print("put: qid=%d src_pid=%d msg_id=%r: message sent" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # *** 
+
+    def put_many(self, msgs: typing.Iterable[typing.Any], block: bool=True, timeout: typing.Optional[float]=None):
+        """
+        Put a sequence of objects into a shared memory queue, in order.
+
+        The messages are processed in runs.  For each run, the blocks of all of its
+        messages are reserved under a single acquisition of the producer lock and
+        the free list lock, and the messages are published with a single
+        acquisition of the message list lock.  A run is as long as possible without
+        needing more blocks of a size class than the size class has.
+
+        Args:
+            msgs (typing.Iterable[obj]): The objects which are to be put into queue.
+            block (bool, optional): If it is set to True (default), it will return after all items are put into queue.
+            timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
+
+        Raises:
+            queue.Full: Raised if the call times out or the queue is full when `block` is False.
+                The messages of the runs before the one that failed are in the queue.
+            ValueError: A request was made to send a message that, when serialized, exceeds the capacity of the queue.
+        """
+        self._put_many(msgs, block, timeout)
+
+    def _put_many(self, msgs: typing.Iterable[typing.Any], block: bool, timeout: typing.Optional[float],
+                  list_head: typing.Optional[int]=None):
+        """Put a sequence of objects into a message list, in order.  See `put_many` and `_put`."""
+        if timeout is not None:
+            if not block:
+                raise ValueError("A timeout is allowed only when not blocking.")
+            if timeout < 0:
+                raise Full
+        self.claim_stats()
+
+        time_start: float = time.time()
+        src_pid: int = os.getpid()
+        run: typing.List[typing.Tuple[bytes, typing.List[memoryview], int, int, int, int, int]] = []
+        run_block_counts: typing.List[int] = [0] * len(self.class_chunk_sizes)
+        msg: typing.Any
+        for msg in msgs:
+            msg_id: bytes = self.generate_msg_id()
+            self.consume_msg_id()
+            msg_parts: typing.List[memoryview]
+            msg_flags: int
+            msg_len: int
+            msg_parts, msg_flags, msg_len = self.serialize_msg(msg, msg_id, src_pid)
+            size_class: int
+            chunk_size: int
+            total_chunks: int
+            size_class, chunk_size, total_chunks = self.plan_msg_chunks(msg_len, msg_id, src_pid)
+            if len(run) > 0 and run_block_counts[size_class] + total_chunks > self.class_block_counts[size_class]:
+                self.put_run(run, run_block_counts, block, timeout, time_start, src_pid, list_head)
+                run = []
+                run_block_counts = [0] * len(self.class_chunk_sizes)
+            run.append((msg_id, msg_parts, msg_flags, msg_len, size_class, chunk_size, total_chunks))
+            run_block_counts[size_class] += total_chunks
+
+        if len(run) > 0:
+            self.put_run(run, run_block_counts, block, timeout, time_start, src_pid, list_head)
+
+    def put_run(self, run: typing.List[typing.Tuple[bytes, typing.List[memoryview], int, int, int, int, int]],
+                run_block_counts: typing.List[int], block: bool, timeout: typing.Optional[float], time_start: float, src_pid: int,
+                list_head: typing.Optional[int]=None):
+        """Reserve the blocks for a run of serialized messages, write the messages, and publish them.
+
+        Args:
+            run: The messages as (msg_id, msg_parts, msg_flags, msg_len, size_class, chunk_size, total_chunks) tuples.
+            run_block_counts (typing.List[int]): The number of blocks the run needs from each size class.
+            block (bool): When True, wait for free blocks.
+            timeout (typing.Optional[float]): The timeout of the whole `put_many` call.
+            time_start (float): When the `put_many` call started.
+            src_pid (int): The process ID (pid) of the sending process.
+            list_head (typing.Optional[int], optional): The message list, when not this object's own.
+
+        Raises:
+            queue.Full: No blocks are available in nonblocking mode, or a timeout occurred.
+        """
+        remaining_timeout: typing.Optional[float] = timeout
+        if remaining_timeout is not None:
+            remaining_timeout -= (time.time() - time_start)
+            if remaining_timeout <= 0:
+                raise Full
+
+        # As in `put`, a run that needs a single block does not need the producer lock.
+        use_producer_lock: bool = sum(run_block_counts) > 1
+        if use_producer_lock and not self.producer_lock.acquire(timeout=remaining_timeout):
+            raise Full
+        reserved: typing.List[typing.List[int]] = [[] for _ in run_block_counts]
+        try:
+            size_class: int
+            block_count: int
+            for size_class, block_count in enumerate(run_block_counts):
+                if block_count > 0:
+                    if remaining_timeout is not None:
+                        remaining_timeout = timeout - (time.time() - time_start) # type: ignore[operator]
+                    reserved[size_class] = self.get_first_free_blocks(block_count, block, remaining_timeout, size_class)
+        except Full:
+            for block_id_list in reserved:
+                self.add_free_blocks(block_id_list)
+            raise
+        finally:
+            if use_producer_lock:
+                self.producer_lock.release()
+
+        first_block_ids: typing.List[int] = []
+        for msg_id, msg_parts, msg_flags, msg_len, size_class, chunk_size, total_chunks in run:
+            block_id_list: typing.List[int] = reserved[size_class][:total_chunks]
+            del reserved[size_class][:total_chunks]
+            self.write_msg(block_id_list, msg_parts, msg_flags, msg_len, chunk_size, msg_id, src_pid)
+            first_block_ids.append(block_id_list[0])
+
+        self.add_msgs(first_block_ids, list_head)
+
+    def collect_msg_block_ids(self, block_id: int, total_chunks: int, next_chunk_block_id: int,
+                              src_pid: int, msg_id: bytes)->typing.List[int]:
+        """typing.List[int]: Follow the chunk chain of a message and return its blocks in chunk order.
+
+        Args:
+            block_id (int): The identifier for the first chunk in the message.
+            total_chunks (int): The total number of chunks in the message.
+            next_chunk_block_id (int): The identifier for the second chunk in the message.
+            src_pid (int): The process identifier of the process that originated the message.
+            msg_id (bytes): The message identifier.
+
+        Raises:
+            ValueError: An internal error occured in accessing the message's metadata.
+        """
+        msg_block_ids: typing.List[int] = [block_id]
+
+        # Acquire the chunks for the rest of the message:
+        i: int
+        for i in range(1, total_chunks):
+            chunk_id = i + 1
+            if self.verbose:
+                print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d." % (self.qid, src_pid, msg_id, chunk_id, next_chunk_block_id), file=sys.stderr, flush=True) # ***
+            msg_block_ids.append(next_chunk_block_id)
+            data_block: memoryview = self.data_blocks[next_chunk_block_id]
+            maybe_next_chunk_block_id: typing.Union[bytes, int] = self.get_meta(data_block, 'next_chunk_block_id')
+            if isinstance(maybe_next_chunk_block_id, int):
+                next_chunk_block_id = maybe_next_chunk_block_id
+            else:
+                raise ValueError("get: internal error getting next_chunk_block_id")
+        return msg_block_ids
+
+    def read_msg(self, msg_block_ids: typing.List[int], src_pid: int, msg_id: bytes)->typing.Any:
+        """Reassemble and deserialize a message from its blocks.
+
+        The blocks are not released.
+
+        Args:
+            msg_block_ids (typing.List[int]): The blocks of the message in chunk order.
+            src_pid (int): The process identifier of the process that originated the message.
+            msg_id (bytes): The message identifier.
+
+        Returns:
+            object: The deserialized message.
+
+        Raises:
+            ValueError: An internal error occured in accessing the message's metadata,
+                or an integrity check failed.
+            UnpicklingError: This exception is raised when the serializer is pickle and
+                an error occured in deserializing the message.
+        """
+        total_chunks: int = len(msg_block_ids)
+        buf_msg_body: typing.List[bytes] = []
+        try:
+            block_idx: int
+            block_id: int
+            for block_idx, block_id in enumerate(msg_block_ids):
+                chunk_id = block_idx + 1
+                data_block = self.data_blocks[block_id]
+                msg_size: int
+                chunk_total_msg_size: int
+                checksum: int
+                chunk_msg_flags: int
+                _, msg_size, _, _, chunk_total_msg_size, checksum, _, _, _, chunk_msg_flags = self.get_header(data_block)
+                if block_idx == 0:
+                    msg_flags: int = chunk_msg_flags
+                    total_msg_size: int = chunk_total_msg_size
+                chunk_data: bytes = self.get_data(data_block, msg_size) # This may make a reference, not a deep copy.
+                if self.verbose:
+                    print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d msg_size=%d total_chunks=%d." % (self.qid, src_pid, msg_id, chunk_id, block_id, msg_size, total_chunks), file=sys.stderr, flush=True) # ***
+                if self.integrity_check:
+                    checksum2: int = zlib.adler32(chunk_data)
+                    if checksum == checksum2:
+                        if self.verbose:
+                            print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: checksum=%x is OK" % (self.qid, src_pid, msg_id, chunk_id, checksum), file=sys.stderr, flush=True) # ***
+                    else:
+                        raise ValueError("ShmQueue.get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d checksum=%x != checksum2=%x -- FAIL!" % (self.qid, src_pid, msg_id, chunk_id, block_id, checksum, checksum2)) # TODO: use a better exception
+
+                buf_msg_body.append(chunk_data) # This may copy the reference.
+
+            msg_len: int = sum(len(chunk_data) for chunk_data in buf_msg_body)
+            self.count_get(msg_len)
+            if self.integrity_check:
+                if total_msg_size == msg_len:
+                    if self.verbose:
+                        print("get: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d is OK" % (self.qid, src_pid, msg_id, total_msg_size), file=sys.stderr, flush=True) # ***
+                else:
+                    raise ValueError("get: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d != msg_len=%d -- FAIL!" % (self.qid, src_pid, msg_id, total_msg_size, msg_len)) # TODO: use a beter exception.
+
+            codec_id: int = (msg_flags & self.__class__.MSG_FLAG_CODEC_MASK) >> self.__class__.MSG_FLAG_CODEC_SHIFT
+            if codec_id != 0:
+                buf_msg_body = [codec.decompress(codec_id, b''.join(buf_msg_body))]
+
+            try:
+                # Finally, we are guaranteed to copy the data.
+                msg: typing.Any
+                msg_type: int = (msg_flags & self.__class__.MSG_FLAG_TYPE_MASK) >> self.__class__.MSG_FLAG_TYPE_SHIFT
+                if msg_type != self.__class__.MSG_TYPE_SERIALIZED:
+                    msg = self.loads_typed(msg_type, buf_msg_body)
+                elif msg_flags & self.__class__.MSG_FLAG_OUT_OF_BAND:
+                    msg = self.loads_out_of_band(buf_msg_body)
+                else:
+                    msg_body: bytes = b''.join(buf_msg_body) # Even this might copy the references.
+                    msg = self.serializer.loads(msg_body)  # type: ignore[union-attr]
+                return msg
+
+            except pickle.UnpicklingError as e:
+                print("get: Fail: qid=%d src_pid=%d msg_id=%r: msg_size=%d chunk_id=%d total_chunks=%d." % (self.qid, src_pid, msg_id, msg_size, chunk_id, total_chunks), file=sys.stderr, flush=True) # ***
+                if self.integrity_check:
+                    print("get: Fail: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d checksum=%x" % (self.qid, src_pid, msg_id, total_msg_size, checksum), file=sys.stderr, flush=True) # ***
+                raise
+
+        finally:
+            buf_msg_body.clear()
+
+    def get(self, block: bool=True, timeout: typing.Optional[float]=None)->typing.Any:
+        """
+        Get the next available message from the queue.
+
+        Args:
+            block (bool, optional): If it is set to True (default), it will only return when an item is available.
+            timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
+
+        Returns:
+            object: A message object retrieved from the queue.
+
+        Raises:
+            queue.Empty: This exception will be raised if it times out or queue is empty when `block` is False.
+            ValueError: An internal error occured in accessing the message's metadata.
+            UnpicklingError: This exception is raised when the serializer is pickle and
+                an error occured in deserializing the message.
+
+        Note:
+            - Errors other then UnpicklingError might be raised if a serialized other then
+              pickle is specified.
+        """
+        self.claim_stats()
+
+        # We will build a list of message chunks.  We can't
+        # release them until after we deserialize the data.
+        block_id: int
+        msg_block_ids: typing.List[int] = [ ]
+        
+        src_pid: int
+        msg_id: bytes
+        total_chunks: int
+        next_chunk_block_id: int
+        if timeout is not None and timeout <= 0:
+            if self.verbose:
+                print("get: qid=%d: queue EMPTY" % self.qid, file=sys.stderr, flush=True) # ***
+            raise Empty
+        src_pid, msg_id, block_id, total_chunks, next_chunk_block_id = self.next_readable_msg(block, timeout) # This call might raise Empty.
+        if self.verbose:
+            print("get: qid=%d src_pid=%d msg_id=%r: total_chunks=%d next_chunk_block_id=%d." % (self.qid, src_pid, msg_id, total_chunks, next_chunk_block_id), file=sys.stderr, flush=True) # ***
+
+        try:
+            msg_block_ids = self.collect_msg_block_ids(block_id, total_chunks, next_chunk_block_id, src_pid, msg_id)
+        except Exception:
+            # Release the data blocks (losing the message) if we get an
+            # unexpected exception:
+            if self.verbose:
+                print("get: qid=%d: releasing data blocks due to Exception" % self.qid, file=sys.stderr, flush=True) # *** 
+            self.add_free_block(block_id)
+            raise
+
+        try:
+            return self.read_msg(msg_block_ids, src_pid, msg_id)
+
+        finally:
+            # It is now safe to release the data blocks.  This is a good place
+            # to release them, because it covers error paths as well as the main return.
+            if self.verbose:
+                print("get: qid=%d src_pid=%d msg_id=%r: releasing %d blocks." % (self.qid, src_pid, msg_id, len(msg_block_ids)), file=sys.stderr, flush=True) # ***
+            self.release_msg(msg_block_ids)
+            msg_block_ids.clear()
+
+    @contextlib.contextmanager
+    def get_view(self, block: bool=True, timeout: typing.Optional[float]=None)->typing.Iterator[typing.List[memoryview]]:
+        """
+        Borrow the next available message from the queue without copying it.
+
+        This is a context manager that yields a list of read-only memoryviews, one per
+        chunk, straight into the shared memory blocks that hold the serialized message
+        (the bytes produced by `serializer.dumps`; the message is not deserialized).
+        A single-chunk message is `views[0]`.  The blocks return to the free list only
+        when the context exits, so parsers such as `struct.unpack_from` or
+        `numpy.frombuffer` can work on the message in place::
+
+            with q.get_view() as views:
+                header = struct.unpack_from('II', views[0])
+
+        Args:
+            block (bool, optional): If it is set to True (default), it will only return when an item is available.
+            timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
+
+        Raises:
+            queue.Empty: This exception will be raised if it times out or queue is empty when `block` is False.
+            ValueError: An internal error occured in accessing the message's metadata, or an integrity check failed.
+            BufferError: An object created from one of the views (e.g. a NumPy array) was still alive when the
+                context exited.  The blocks have been freed regardless, so that object must not be used.
+
+        Note:
+            - The views, and anything built on them, are invalid after the context exits.
+            - A message that was compressed (see `compression`) is yielded as a single view of its
+              decompressed copy.
+            - A message of one of the `fast_types` is yielded raw: a bytes, bytearray or str message
+              (as UTF-8) is the contents of the views, with nothing to deserialize.
+        """
+        if timeout is not None and timeout <= 0:
+            raise Empty
+        self.claim_stats()
+        src_pid: int
+        msg_id: bytes
+        block_id: int
+        total_chunks: int
+        next_chunk_block_id: int
+        src_pid, msg_id, block_id, total_chunks, next_chunk_block_id = self.next_readable_msg(block, timeout) # This call might raise Empty.
+        try:
+            msg_block_ids: typing.List[int] = self.collect_msg_block_ids(block_id, total_chunks, next_chunk_block_id, src_pid, msg_id)
+        except Exception:
+            self.add_free_block(block_id)
+            raise
+
+        views: typing.List[memoryview] = []
+        released: bool = True
+        try:
+            chunk_id: int
+            msg_flags: int = 0
+            for chunk_id, block_id in enumerate(msg_block_ids, 1):
+                msg_size: int
+                checksum: int
+                _, msg_size, _, _, _, checksum, _, _, _, msg_flags = self.get_header(self.data_blocks[block_id])
+                view: memoryview = self.get_data(self.data_blocks[block_id], msg_size).toreadonly() # type: ignore[attr-defined]
+                views.append(view)
+                if self.integrity_check and zlib.adler32(view) != checksum:
+                    raise ValueError("ShmQueue.get_view: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d checksum=%x -- FAIL!" % (self.qid, src_pid, msg_id, chunk_id, block_id, checksum))
+
+            self.count_get(sum(view.nbytes for view in views))
+            codec_id: int = (msg_flags & self.__class__.MSG_FLAG_CODEC_MASK) >> self.__class__.MSG_FLAG_CODEC_SHIFT
+            if codec_id != 0:
+                # A compressed message can only be borrowed as its decompressed copy.
+                body: bytes = codec.decompress(codec_id, b''.join(views))
+                for view in views:
+                    view.release()
+                views[:] = [memoryview(body)]
+
+            yield views
+
+        finally:
+            for view in views:
+                try:
+                    view.release()
+                except BufferError:
+                    released = False
+            views.clear()
+            self.release_msg(msg_block_ids)
+
+        if not released:
+            raise BufferError("ShmQueue.get_view: qid=%d src_pid=%d msg_id=%r: a view of the message was still in use when its blocks were freed." % (self.qid, src_pid, msg_id))
+
+    def release_msg(self, msg_block_ids: typing.List[int]):
+        """Release the blocks of a message that has been read.
+
+        Args:
+            msg_block_ids (typing.List[int]): The blocks of the message in chunk order.
+        """
+        self.add_free_blocks(msg_block_ids)
+
+    def release_msgs(self, msgs_block_ids: typing.List[typing.List[int]]):
+        """Release the blocks of messages that have been read under a single acquisition of
+        the free list lock.
+
+        Args:
+            msgs_block_ids (typing.List[typing.List[int]]): The blocks of each message in chunk order.
+        """
+        self.add_free_blocks(block_id for msg_block_ids in msgs_block_ids for block_id in msg_block_ids)
+
+    def get_many(self, max_n: int, block: bool=True, timeout: typing.Optional[float]=None)->typing.List[typing.Any]:
+        """
+        Get up to `max_n` of the available messages from the queue, in order.
+
+        The messages are taken off the message list under a single acquisition of
+        the message list lock, and all of their blocks are returned to the free
+        lists under a single acquisition of the free list lock.
+
+        Args:
+            max_n (int): The maximum number of messages to return.
+            block (bool, optional): If it is set to True (default), it will only return when at least one item is available.
+            timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
+
+        Returns:
+            typing.List[object]: Between 1 and `max_n` message objects retrieved from the queue.
+
+        Raises:
+            queue.Empty: This exception will be raised if it times out or queue is empty when `block` is False.
+            ValueError: An internal error occured in accessing the message's metadata.
+        """
+        if timeout is not None and timeout <= 0:
+            raise Empty
+        self.claim_stats()
+        first_block_ids: typing.List[int] = self.get_first_msgs(max_n, block, timeout)
+        if len(first_block_ids) == 0:
+            if not block:
+                self.count_stat(self.__class__.STAT_EMPTY)
+            raise Empty
+
+        # Collect the blocks of every message first, so that all of them are
+        # released even if one of the messages turns out to be unreadable.
+        msgs_block_ids: typing.List[typing.Tuple[int, bytes, typing.List[int]]] = []
+        all_block_ids: typing.List[int] = []
+        try:
+            first_block_id: int
+            for first_block_id in first_block_ids:
+                src_pid: int
+                msg_id: bytes
+                block_id: int
+                total_chunks: int
+                next_chunk_block_id: int
+                src_pid, msg_id, block_id, total_chunks, next_chunk_block_id = self.get_msg_header(first_block_id)
+                msg_block_ids: typing.List[int] = self.collect_msg_block_ids(block_id, total_chunks, next_chunk_block_id, src_pid, msg_id)
+                msgs_block_ids.append((src_pid, msg_id, msg_block_ids))
+                all_block_ids.extend(msg_block_ids)
+
+            return [self.read_msg(msg_block_ids, src_pid, msg_id) for src_pid, msg_id, msg_block_ids in msgs_block_ids]
+
+        finally:
+            collected: typing.Set[int] = set(all_block_ids)
+            self.release_msgs([msg_block_ids for _, _, msg_block_ids in msgs_block_ids] +
+                              [[block_id] for block_id in first_block_ids if block_id not in collected])
+
+    def get_nowait(self)->typing.Any:
+        """
+        Equivalent to `get(False)`.
+        """
+        return self.get(False)
+
+    def put_nowait(self, msg: typing.Any):
+        """
+        Equivalent to `put(obj, False)`.
+        """
+        return self.put(msg, False)
+
+    def qsize(self)->int:
+        """int: Return the number of ready messages."""
+        return self.get_msg_count()
+
+    def empty(self)->bool:
+        """bool: True when no messages are ready."""
+        return self.get_msg_count() == 0
+
+    def full(self)->bool:
+        """bool: True when no free blocks are available (and, in elastic mode, the pool is at `max_blocks`)."""
+        if self.get_free_block_count() > 0:
+            return False
+        return self.pool is None or self.maxsize + self.get_pool_header()[0] * self.grow_blocks + self.grow_blocks > self.max_blocks
+
+    def close(self):
+        """
+        Indicate no more new data will be added and release the shared memory areas.
+
+        A queue that was attached by name (see `attach`) only closes this process's
+        mappings; the shared memory areas are released when the creator closes the queue.
+        """
+        unlink: bool = not self.attached
+        if self.pool is not None:
+            # Drop the extents another process has already released, then release the rest.
+            self.map_extents()
+            self.unmap_extents(0, unlink=unlink)
+            self.pool.close()
+            if unlink:
+                self.pool.unlink()
+            self.pool = None
+
+        # The per-block views must be released before their segments can be closed.
+        self.data_blocks.release()
+
+        index: int
+        for index in range(len(self.segment_names)):
+            if self.segments[index] is None and not unlink:
+                continue
+            segment: SharedMemory = self.get_segment(index)
+            segment.close()
+            if unlink:
+                segment.unlink()
+        self.segments = [None] * len(self.segment_names)
+
+        if self.stats_segment is not None:
+            if self.stats_view is not None:
+                self.stats_view.release()
+                self.stats_view = None
+            self.stats_segment.close()
+            if unlink:
+                self.stats_segment.unlink()
+
+        if self.magazine_segment is not None:
+            if self.magazine_view is not None:
+                self.magazine_view.release()
+                self.magazine_view = None
+            self.magazine_segment.close()
+            if unlink:
+                self.magazine_segment.unlink()
+
+        self.list_heads.close()
+        if unlink:
+            self.list_heads.unlink()
+
+        if self.directory is not None:
+            self.directory.close()
+            self.directory.unlink()
+            self.directory = None
+
+        if self.notify_segment is not None:
+            if self.notify_view is not None:
+                self.notify_view.release()
+                self.notify_view = None
+            self.notify_segment.close()
+            if unlink:
+                self.notify_segment.unlink()
+        pipes: typing.Optional[typing.List[typing.Tuple[typing.Any, typing.Any]]]
+        for pipes in (self.msg_notify, self.free_notify):
+            for pipe in pipes or []:
+                pipe[0].close()
+                pipe[1].close()
+
+    def __del__(self):
+        # Release the per-block views, otherwise the segments cannot be closed
+        # when they are garbage collected.
+        if getattr(self, 'data_blocks', None) is not None:
+            self.data_blocks.release()
+        if getattr(self, 'stats_view', None) is not None:
+            self.stats_view.release()
+        if getattr(self, 'magazine_view', None) is not None:
+            self.magazine_view.release()
+        if getattr(self, 'notify_view', None) is not None:
+            self.notify_view.release()
+
+
+class ShmChannelGroup(ShmQueue):
+    """ShmChannelGroup is a set of logical queues (channels) that share one ShmQueue block pool.
+
+    There is one free list (per size class) for the whole group and one message list per channel,
+    all in a single list heads segment, so N queues cost the shared memory areas and the memory
+    of one.  A channel only receives the messages that were put to that channel, but the blocks
+    are pooled: a busy channel can use the blocks that idle channels are not using, and `maxsize`
+    (or `capacity`) is the size of the whole group, not of each channel.
+
+    `channel(channel_id)` returns a queue object for one channel; it has the whole `ShmQueue`
+    interface and can be passed to other processes like any ShmQueue.  The group object itself
+    is channel 0.  All other arguments are those of `ShmQueue`.
+
+    Args:
+        channels (int): The number of channels.
+        max_size_per_channel (int, optional): When positive, a put to a channel that already holds this
+                          many messages waits (or raises `queue.Full`) as if the channel were full, so that
+                          a channel whose consumer is slow cannot take up the whole pool.  Each channel has
+                          a semaphore of this many permits: a put takes one per message before it takes
+                          any block, and a get gives it back.  `put_many` puts a longer sequence in slices
+                          of at most this many messages.  (Default is 0, no limit.)
+
+    Note:
+        - `close` needs to be invoked once, on the group or on any of its channels, and closes
+          every channel.  Closing again is a no-op.
+
+    Example::
+
+        def worker(q):
+            print(q.get())
+
+        if __name__ == '__main__':
+            group = ShmChannelGroup(4, chunk_size=1024 * 4, maxsize=64)
+            channels = [group.channel(i) for i in range(4)]
+            processes = [Process(target=worker, args=(q,)) for q in channels]
+            for p in processes:
+                p.start()
+            for i, q in enumerate(channels):
+                q.put(i)
+            for p in processes:
+                p.join()
+            group.close()
+
+    """
+
+    def __init__(self, channels: int, chunk_size: int=ShmQueue.DEFAULT_CHUNK_SIZE, maxsize: int=ShmQueue.DEFAULT_MAXSIZE,
+                 max_size_per_channel: int=0, **kwargs):
+        if channels < 1:
+            raise ValueError("A channel group needs at least one channel.")
+        super().__init__(chunk_size, maxsize, channels=channels, **kwargs)
+        self.channels: int = channels
+        self.max_size_per_channel: int = max_size_per_channel
+        self.channel_semaphores: typing.Optional[typing.List[typing.Any]] = None
+        if max_size_per_channel > 0:
+            ctx = kwargs.get('ctx') or mp.get_context()
+            self.channel_semaphores = [ctx.Semaphore(max_size_per_channel) for _ in range(channels)]
+        # Channel objects made by `channel` share this object's mappings and keep it alive.
+        self.group: typing.Optional[ShmChannelGroup] = None
+        self.closed: typing.List[bool] = [False]
+
+    def __getstate__(self):
+        return (super().__getstate__(), self.max_size_per_channel, self.channel_semaphores)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[0])
+        self.max_size_per_channel = state[1]
+        self.channel_semaphores = state[2]
+        self.channels = len(self.msg_list_heads)
+        self.group = None
+        self.closed = [False]
+
+    def wait_channel_room(self, count: int, block: bool, timeout: typing.Optional[float])->typing.Optional[float]:
+        """Take `count` permits of this channel's semaphore, one per message about to be put.
+
+        Args:
+            count (int): The number of messages, at most `max_size_per_channel`.
+            block (bool): When False, do not wait.
+            timeout (typing.Optional[float]): When block is True and timeout is not None, wait for at most timeout seconds.
+
+        Returns:
+            typing.Optional[float]: What is left of the timeout.
+
+        Raises:
+            queue.Full: The channel is full in nonblocking mode, or a timeout occurred.  No permit is kept.
+        """
+        if self.channel_semaphores is None:
+            return timeout
+        semaphore: typing.Any = self.channel_semaphores[self.channel_id]
+        time_start: float = time.time()
+        acquired: int = 0
+        try:
+            while acquired < count:
+                if semaphore.acquire(block=False):
+                    acquired += 1
+                    continue
+                remaining_timeout: typing.Optional[float] = None if timeout is None else timeout - (time.time() - time_start)
+                if not block or (remaining_timeout is not None and remaining_timeout <= 0):
+                    raise Full
+                if self.use_semaphores:
+                    if not self.wait_semaphore(semaphore, block, remaining_timeout, self.__class__.STAT_FREE_WAIT_NS):
+                        raise Full
+                    acquired += 1
+                else:
+                    self.poll_pause(time_start)
+        except Full:
+            self.release_channel_room(acquired)
+            self.count_stat(self.__class__.STAT_FULL)
+            raise
+        return None if timeout is None else max(0.0, timeout - (time.time() - time_start))
+
+    def release_channel_room(self, count: int):
+        """Give back `count` permits of this channel's semaphore."""
+        if self.channel_semaphores is not None:
+            for _ in range(count):
+                self.channel_semaphores[self.channel_id].release()
+            if self.free_notify is not None and count > 0:
+                # A producer that starts to watch takes the free list lock before it retries,
+                # so either it sees the permits or this reads its flag.
+                with self.free_list_lock:
+                    pass
+                self.notify(self.__class__.NOTIFY_FREE, count)
+
+    def _put(self, msg: typing.Any, block: bool, timeout: typing.Optional[float], list_head: typing.Optional[int]=None):
+        remaining_timeout: typing.Optional[float] = self.wait_channel_room(1, block, timeout)
+        try:
+            super()._put(msg, block, remaining_timeout, list_head)
+        except BaseException:
+            self.release_channel_room(1)
+            raise
+
+    def put_run(self, run: typing.List[typing.Tuple[bytes, typing.List[memoryview], int, int, int, int, int]],
+                run_block_counts: typing.List[int], block: bool, timeout: typing.Optional[float], time_start: float, src_pid: int,
+                list_head: typing.Optional[int]=None):
+        if self.channel_semaphores is None:
+            return super().put_run(run, run_block_counts, block, timeout, time_start, src_pid, list_head)
+        # A run either publishes all of its messages or none, so its permits are kept or given back together.
+        start: int
+        for start in range(0, len(run), self.max_size_per_channel):
+            part: typing.List[typing.Tuple[bytes, typing.List[memoryview], int, int, int, int, int]] = run[start:start + self.max_size_per_channel]
+            part_block_counts: typing.List[int] = [0] * len(run_block_counts)
+            for entry in part:
+                part_block_counts[entry[4]] += entry[6]
+            self.wait_channel_room(len(part), block, None if timeout is None else timeout - (time.time() - time_start))
+            try:
+                super().put_run(part, part_block_counts, block, timeout, time_start, src_pid, list_head)
+            except BaseException:
+                self.release_channel_room(len(part))
+                raise
+
+    def get_first_msg(self, block: bool, timeout: typing.Optional[float])->typing.Optional[int]:
+        block_id: typing.Optional[int] = super().get_first_msg(block, timeout)
+        if block_id is not None:
+            self.release_channel_room(1)
+        return block_id
+
+    def get_first_msgs(self, max_n: int, block: bool, timeout: typing.Optional[float])->typing.List[int]:
+        block_ids: typing.List[int] = super().get_first_msgs(max_n, block, timeout)
+        self.release_channel_room(len(block_ids))
+        return block_ids
+
+    def channel(self, channel_id: int)->'ShmChannelGroup':
+        """ShmChannelGroup: Get a queue object that puts to and gets from one channel.
+
+        Args:
+            channel_id (int): The channel, between 0 and `channels` - 1.
+
+        Raises:
+            IndexError: There is no such channel.
+        """
+        if not 0 <= channel_id < self.channels:
+            raise IndexError("ShmChannelGroup.channel: qid=%d: no channel %d in %d channels" % (self.qid, channel_id, self.channels))
+        if self.stats_segment is not None:
+            self.get_stats_view()  # The channels share this process's stats slot, magazines and notify slot.
+        if self.magazine_segment is not None:
+            self.get_magazine_view()
+        if self.notify_segment is not None:
+            self.get_notify_view()
+        # A shallow copy: copy.copy would go through __getstate__ and map the segments again.
+        q: ShmChannelGroup = self.__class__.__new__(self.__class__)
+        q.__dict__.update(self.__dict__)
+        q.select_channel(channel_id)
+        q.group = self.group or self
+        return q
+
+    def close(self):
+        """
+        Release the shared memory areas of the whole group.  Only the first call has an effect.
+        """
+        if self.closed[0]:
+            return
+        self.closed[0] = True
+        super().close()
+
+    def __del__(self):
+        if self.group is None:
+            super().__del__()
+
+
+class PriorityShmQueue(ShmQueue):
+    """PriorityShmQueue is a ShmQueue whose messages have a priority.
+
+    There is one message list per priority, between 0 and `priorities` - 1, and `get` takes the oldest
+    message of the highest priority that has one: a message is never overtaken by a message of the same
+    or of a lower priority, so each priority is FIFO.  The lists share one lock and one semaphore, so a
+    consumer waits for a message of any priority and takes it with a single lock acquisition, and the
+    blocks are shared by all the priorities.  All other arguments are those of `ShmQueue`.
+
+    Args:
+        priorities (int): The number of priorities.
+
+    Example::
+
+        q = PriorityShmQueue(2, chunk_size=1024 * 4, maxsize=64)
+        q.put('backfill')
+        q.put('interactive', priority=1)
+        q.get()  # 'interactive'
+
+    """
+
+    def __init__(self, priorities: int, chunk_size: int=ShmQueue.DEFAULT_CHUNK_SIZE, maxsize: int=ShmQueue.DEFAULT_MAXSIZE, **kwargs):
+        if priorities < 1:
+            raise ValueError("A priority queue needs at least one priority.")
+        super().__init__(chunk_size, maxsize, channels=priorities, **kwargs)
+        self.priorities: int = priorities
+        # One lock and one semaphore for all the message lists.
+        self.msg_list_locks = [self.msg_list_locks[0]] * priorities
+        if self.msg_list_semaphores is not None:
+            self.msg_list_semaphores = [self.msg_list_semaphores[0]] * priorities
+        self.select_channel(0)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.priorities = len(self.msg_list_heads)
+
+    def check_priority(self, priority: int):
+        if not 0 <= priority < self.priorities:
+            raise ValueError("PriorityShmQueue: qid=%d: priority %d is not between 0 and %d" % (self.qid, priority, self.priorities - 1))
+
+    def put(self, msg: typing.Any, block: bool=True, timeout: typing.Optional[float]=None, priority: int=0):
+        """
+        Put an object into the queue.  See `ShmQueue.put`.
+
+        Args:
+            priority (int, optional): The priority of the message, between 0 (default, lowest) and `priorities` - 1.
+        """
+        self.check_priority(priority)
+        self._put(msg, block, timeout, self.msg_list_heads[priority])
+
+    def put_many(self, msgs: typing.Iterable[typing.Any], block: bool=True, timeout: typing.Optional[float]=None, priority: int=0):
+        """
+        Put a sequence of objects of the same priority into the queue, in order.  See `ShmQueue.put_many`.
+
+        Args:
+            priority (int, optional): The priority of the messages, between 0 (default, lowest) and `priorities` - 1.
+        """
+        self.check_priority(priority)
+        self._put_many(msgs, block, timeout, self.msg_list_heads[priority])
+
+    def put_nowait(self, msg: typing.Any, priority: int=0):
+        """
+        Equivalent to `put(obj, False, priority=priority)`.
+        """
+        return self.put(msg, False, priority=priority)
+
+    def pop_msg(self)->typing.Optional[int]:
+        lh: int
+        for lh in reversed(self.msg_list_heads):
+            block_id: typing.Optional[int] = self.get_first_block(lh)
+            if block_id is not None:
+                return block_id
+        return None
+
+    def get_msg_count(self)->int:
+        """int: Get the number of messages of all the priorities."""
+        with self.msg_list_lock:
+            return sum(self.get_block_count(lh) for lh in self.msg_list_heads)
+
+    def get_priority_counts(self)->typing.List[int]:
+        """typing.List[int]: Get the number of messages of each priority."""
+        with self.msg_list_lock:
+            return [self.get_block_count(lh) for lh in self.msg_list_heads]
+
+
+class ShmBroadcastQueue(ShmChannelGroup):
+    """ShmBroadcastQueue delivers every message to each of a fixed set of subscribers.
+
+    `put` serializes a message and writes it into the blocks once, however many subscribers there are.
+    Each subscriber has a read cursor into a shared log of the published messages, and each message
+    has a count of the subscribers that still have to read it: the last subscriber to read a message
+    frees its blocks.  A subscriber that does not read therefore holds the blocks of every message
+    published since, and `put` blocks (or raises Full) once they run out: a subscriber that stops
+    reading, or whose process dies, stalls the publisher and every other subscriber.  With `max_lag`,
+    a subscriber that falls more than `max_lag` messages behind is dropped when the next message is
+    published: its unread messages are released, later messages are not kept for it, and its `get`
+    raises ValueError.
+
+    `subscriber(subscriber_id)` returns a queue object that gets the messages of one subscriber, in
+    the order they were published.  It can be passed to other processes like any ShmQueue, and each
+    subscriber should be read by one process.  Any of the objects can put.  The group object itself
+    is subscriber 0.  All other arguments are those of `ShmQueue`.
+
+    Args:
+        subscribers (int): The number of subscribers.
+        max_lag (int, optional): The number of unread messages after which a subscriber is dropped.
+                                 It is 0 (default) for no limit.  `max_lag` + 1 messages must fit
+                                 into the blocks, otherwise the publisher runs out of blocks before
+                                 a lagging subscriber reaches the limit.
+
+    Note:
+        - `get_many` takes its messages off the log under a single acquisition of the log lock, and
+          releases them under another one.
+        - `close` needs to be invoked once, as for ShmChannelGroup.
+
+    Example::
+
+        def worker(q):
+            model = q.get()
+
+        if __name__ == '__main__':
+            q = ShmBroadcastQueue(4, chunk_size=1024 * 1024, maxsize=64)
+            processes = [Process(target=worker, args=(q.subscriber(i),)) for i in range(4)]
+            for p in processes:
+                p.start()
+            q.put(model)  # serialized once
+            for p in processes:
+                p.join()
+            q.close()
+
+    """
+
+    LOG_SEQ_STRUCT: struct.Struct = struct.Struct('Q')
+    """struct.Struct: The log starts with the sequence number of the next message and the cursor
+    (the sequence number of the next message to read) of each subscriber."""
+
+    LOG_SLOT_STRUCT: struct.Struct = struct.Struct('I')
+    """struct.Struct: They are followed by a ring of the first block ids of the messages, indexed by
+    sequence number, then by the count of pending readers of each message, indexed by first block id.
+    A message holds at least one block, so there are never more live messages than `max_blocks`."""
+
+    DROPPED: int = 2 ** 64 - 1
+    """int: The cursor of a subscriber that has been dropped for lagging."""
+
+    def __init__(self, subscribers: int, chunk_size: int=ShmQueue.DEFAULT_CHUNK_SIZE, maxsize: int=ShmQueue.DEFAULT_MAXSIZE,
+                 max_lag: int=0, **kwargs):
+        if max_lag < 0:
+            raise ValueError("ShmBroadcastQueue: max_lag=%d must not be negative." % max_lag)
+        super().__init__(subscribers, chunk_size, maxsize, **kwargs)
+        self.max_lag: int = max_lag
+        # One lock for the log.
+        self.msg_list_locks = [self.msg_list_locks[0]] * subscribers
+        self.select_channel(0)
+        self.log: SharedMemory = SharedMemory(create=True, size=self.__class__.LOG_SEQ_STRUCT.size * (1 + subscribers) +
+                                              self.__class__.LOG_SLOT_STRUCT.size * 2 * self.max_blocks)
+        self.log.buf[:] = bytes(self.log.size)
+
+    def __getstate__(self):
+        return (super().__getstate__(), self.log.name, self.max_lag)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[0])
+        self.log = self.attach_segment(state[1])
+        self.max_lag = state[2]
+
+    def subscriber(self, subscriber_id: int)->'ShmBroadcastQueue':
+        """ShmBroadcastQueue: Get a queue object that gets the messages of one subscriber.
+
+        Args:
+            subscriber_id (int): The subscriber, between 0 and `channels` - 1.
+
+        Raises:
+            IndexError: There is no such subscriber.
+        """
+        return typing.cast(ShmBroadcastQueue, self.channel(subscriber_id))
+
+    def get_log_seq(self, index: int)->int:
+        """int: Get the next sequence number (index 0) or the cursor of subscriber `index` - 1."""
+        return self.__class__.LOG_SEQ_STRUCT.unpack_from(self.log.buf, self.__class__.LOG_SEQ_STRUCT.size * index)[0]
+
+    def set_log_seq(self, index: int, seq: int):
+        self.__class__.LOG_SEQ_STRUCT.pack_into(self.log.buf, self.__class__.LOG_SEQ_STRUCT.size * index, seq)
+
+    def get_log_slot(self, index: int)->int:
+        """int: Get a ring slot (index below `max_blocks`) or a reader count (index `max_blocks` + block_id)."""
+        return self.__class__.LOG_SLOT_STRUCT.unpack_from(self.log.buf, self.__class__.LOG_SEQ_STRUCT.size * (1 + self.channels) +
+                                                          self.__class__.LOG_SLOT_STRUCT.size * index)[0]
+
+    def set_log_slot(self, index: int, data: int):
+        self.__class__.LOG_SLOT_STRUCT.pack_into(self.log.buf, self.__class__.LOG_SEQ_STRUCT.size * (1 + self.channels) +
+                                                 self.__class__.LOG_SLOT_STRUCT.size * index, data)
+
+    def add_msg(self, block_id: int, list_head: typing.Optional[int]=None):
+        """Publish a message to every subscriber.
+
+        Args:
+            block_id (int): The block identifier of the first chunk of the message.
+            list_head (typing.Optional[int], optional): Ignored: the messages go to the log.
+        """
+        self.add_msgs([block_id])
+
+    def add_msgs(self, block_ids: typing.List[int], list_head: typing.Optional[int]=None):
+        """Publish messages to every subscriber under a single acquisition of the log lock.
+
+        Args:
+            block_ids (typing.List[int]): The block identifiers of the first chunks of the messages.
+            list_head (typing.Optional[int], optional): Ignored: the messages go to the log.
+        """
+        freed: typing.List[int] = []
+        with self.msg_list_lock:
+            cursors: typing.List[int] = [self.get_log_seq(1 + i) for i in range(self.channels)]
+            readers: int = sum(1 for cursor in cursors if cursor != self.__class__.DROPPED)
+            seq: int = self.get_log_seq(0)
+            block_id: int
+            for block_id in block_ids:
+                self.set_log_slot(seq % self.max_blocks, block_id)
+                self.set_log_slot(self.max_blocks + block_id, readers)
+                seq += 1
+            self.set_log_seq(0, seq)
+            if readers == 0:
+                freed.extend(block_ids)
+            if self.max_lag > 0:
+                freed.extend(self.drop_lagging(cursors, seq))
+            queued: int = seq - min((cursor for cursor in cursors if cursor != self.__class__.DROPPED), default=seq)
+        if self.msg_list_semaphores is not None:
+            semaphore: typing.Any
+            for semaphore in self.msg_list_semaphores:
+                for _ in block_ids:
+                    semaphore.release()
+        if self.msg_notify is not None:
+            self.notify(self.__class__.NOTIFY_MSG, self.channels * len(block_ids))
+        if len(freed) > 0:
+            self.add_free_blocks(block_id for first_block_id in freed for block_id in self.get_msg_block_ids(first_block_id))
+        self.count_queued(queued)
+
+    def drop_lagging(self, cursors: typing.List[int], seq: int)->typing.List[int]:
+        """Drop the subscribers that are more than `max_lag` messages behind.  The caller holds the log lock.
+
+        A dropped subscriber's unread messages lose a reader and its cursor is set to `DROPPED`.
+        The cursors are updated in place.
+
+        Args:
+            cursors (typing.List[int]): The cursor of each subscriber.
+            seq (int): The sequence number of the next message.
+
+        Returns:
+            typing.List[int]: The first block ids of the messages that no subscriber has to read any more.
+        """
+        freed: typing.List[int] = []
+        subscriber_id: int
+        cursor: int
+        for subscriber_id, cursor in enumerate(cursors):
+            if cursor == self.__class__.DROPPED or seq - cursor <= self.max_lag:
+                continue
+            msg_seq: int
+            for msg_seq in range(cursor, seq):
+                first_block_id: int = self.get_log_slot(msg_seq % self.max_blocks)
+                readers: int = self.get_log_slot(self.max_blocks + first_block_id) - 1
+                self.set_log_slot(self.max_blocks + first_block_id, readers)
+                if readers == 0:
+                    freed.append(first_block_id)
+            self.set_log_seq(1 + subscriber_id, self.__class__.DROPPED)
+            cursors[subscriber_id] = self.__class__.DROPPED
+        return freed
+
+    def get_msg_block_ids(self, first_block_id: int)->typing.List[int]:
+        """typing.List[int]: Get the blocks of a message in chunk order."""
+        src_pid: int
+        msg_id: bytes
+        block_id: int
+        total_chunks: int
+        next_chunk_block_id: int
+        src_pid, msg_id, block_id, total_chunks, next_chunk_block_id = self.get_msg_header(first_block_id)
+        return self.collect_msg_block_ids(block_id, total_chunks, next_chunk_block_id, src_pid, msg_id)
+
+    def pop_msg(self)->typing.Optional[int]:
+        cursor: int = self.get_log_seq(1 + self.channel_id)
+        if cursor == self.__class__.DROPPED:
+            raise ValueError("ShmBroadcastQueue: qid=%d: subscriber %d fell more than max_lag=%d messages behind and was dropped." %
+                             (self.qid, self.channel_id, self.max_lag))
+        if cursor == self.get_log_seq(0):
+            return None
+        self.set_log_seq(1 + self.channel_id, cursor + 1)
+        return self.get_log_slot(cursor % self.max_blocks)
+
+    def release_msg(self, msg_block_ids: typing.List[int]):
+        """Free the blocks of a message once every subscriber has read it.
+
+        Args:
+            msg_block_ids (typing.List[int]): The blocks of the message in chunk order.
+        """
+        self.release_msgs([msg_block_ids])
+
+    def release_msgs(self, msgs_block_ids: typing.List[typing.List[int]]):
+        """Count this subscriber's reads of messages under a single acquisition of the log lock,
+        and free the blocks of those that every subscriber has now read.
+
+        Args:
+            msgs_block_ids (typing.List[typing.List[int]]): The blocks of each message in chunk order.
+        """
+        freed: typing.List[int] = []
+        with self.msg_list_lock:
+            msg_block_ids: typing.List[int]
+            for msg_block_ids in msgs_block_ids:
+                readers: int = self.get_log_slot(self.max_blocks + msg_block_ids[0]) - 1
+                self.set_log_slot(self.max_blocks + msg_block_ids[0], readers)
+                if readers == 0:
+                    freed.extend(msg_block_ids)
+        if len(freed) > 0:
+            self.add_free_blocks(freed)
+
+    def get_msg_count(self)->int:
+        """int: Get the number of messages this subscriber has not read yet (0 once it has been dropped)."""
+        with self.msg_list_lock:
+            cursor: int = self.get_log_seq(1 + self.channel_id)
+            if cursor == self.__class__.DROPPED:
+                return 0
+            return self.get_log_seq(0) - cursor
+
+    def close(self):
+        """
+        Release the shared memory areas of the queue and of all the subscribers.  Only the first call has an effect.
+        """
+        if self.closed[0]:
+            return
+        super().close()
+        self.log.close()
+        if not self.attached:
+            self.log.unlink()
+
+
+class ShmArrayQueue(ShmQueue):
+    """ShmArrayQueue is a ShmQueue of NumPy arrays that never pickles them.
+
+    `put_array` writes a small dtype and shape header followed by the raw contents of the array straight
+    into the blocks.  `get_array` allocates the array (or takes `out`) and fills it with one copy per
+    chunk out of the blocks, and `get_array_view` lends an array that is backed by the shared memory
+    itself.  There is no pickle stream and no intermediate bytes object on either side.  All other
+    arguments are those of `ShmQueue`; NumPy is imported on first use.
+
+    Note:
+        - Arrays of object or structured dtypes are rejected.  An array that is neither C- nor
+          Fortran-contiguous is copied to C order before it is written.
+        - `put` and `get` are `put_array` and `get_array`.
+
+    Example::
+
+        q = ShmArrayQueue(chunk_size=1024 * 1024, maxsize=16)
+        q.put_array(numpy.ones((256, 256)))
+        with q.get_array_view() as a:
+            total = a.sum()
+
+    """
+
+    def __init__(self, chunk_size: int=ShmQueue.DEFAULT_CHUNK_SIZE, maxsize: int=ShmQueue.DEFAULT_MAXSIZE, **kwargs):
+        if kwargs.get('serializer') is not None or kwargs.get('out_of_band'):
+            raise ValueError("ShmArrayQueue does not take a serializer.")
+        kwargs['fast_types'] = True
+        super().__init__(chunk_size, maxsize, **kwargs)
+
+    def as_array(self, arr: typing.Any)->typing.Any:
+        """numpy.ndarray: Check an array, and make it a contiguous base-class array if it isn't one."""
+        import numpy  # type: ignore
+        arr = numpy.asanyarray(arr)
+        if arr.dtype.hasobject or arr.dtype.fields is not None:
+            raise TypeError("ShmArrayQueue: qid=%d: arrays of dtype %s cannot be written raw." % (self.qid, arr.dtype))
+        if not (arr.flags.c_contiguous or arr.flags.f_contiguous):
+            arr = numpy.ascontiguousarray(arr)
+        if type(arr) is not numpy.ndarray:
+            arr = arr.view(numpy.ndarray)
+        return arr
+
+    def put_array(self, arr: typing.Any, block: bool=True, timeout: typing.Optional[float]=None):
+        """
+        Put a NumPy array into the queue.  See `ShmQueue.put`.
+
+        Raises:
+            TypeError: The array has an object or structured dtype.
+        """
+        super().put(self.as_array(arr), block, timeout)
+
+    def put(self, msg: typing.Any, block: bool=True, timeout: typing.Optional[float]=None):
+        """
+        Equivalent to `put_array`.
+        """
+        self.put_array(msg, block, timeout)
+
+    def put_many(self, msgs: typing.Iterable[typing.Any], block: bool=True, timeout: typing.Optional[float]=None):
+        """
+        Put a sequence of NumPy arrays into the queue, in order.  See `ShmQueue.put_many`.
+        """
+        super().put_many([self.as_array(msg) for msg in msgs], block, timeout)
+
+    def get_array(self, block: bool=True, timeout: typing.Optional[float]=None, out: typing.Any=None)->typing.Any:
+        """
+        Get the next NumPy array from the queue.  See `ShmQueue.get`.
+
+        Args:
+            out (numpy.ndarray, optional): An array of the same dtype, shape and memory order to fill in
+                                place of a new array.
+
+        Returns:
+            numpy.ndarray: The array (`out`, if given).
+
+        Raises:
+            ValueError: `out` does not match the array.  The array is lost.
+        """
+        with self.get_view(block, timeout) as views:
+            return self.loads_array(views, out)
+
+    def get(self, block: bool=True, timeout: typing.Optional[float]=None)->typing.Any:
+        """
+        Equivalent to `get_array`.
+        """
+        return self.get_array(block, timeout)
+
+    @contextlib.contextmanager
+    def get_array_view(self, block: bool=True, timeout: typing.Optional[float]=None)->typing.Iterator[typing.Any]:
+        """
+        Borrow the next NumPy array from the queue.  See `ShmQueue.get_view`.
+
+        This is a context manager that yields a read-only array backed by the shared memory block when
+        the array fits in one chunk (and was not compressed), and a copy otherwise.  The blocks return
+        to the free list when the context exits, so the array must not be kept.
+        """
+        import numpy  # type: ignore
+        with self.get_view(block, timeout) as views:
+            if len(views) > 1:
+                yield self.loads_array(views)
+                return
+            dtype: str
+            shape: typing.Tuple[int, ...]
+            order: str
+            offset: int
+            dtype, shape, order, offset = self.read_array_header(views)
+            arr: typing.Any = numpy.frombuffer(views[0], dtype=dtype, offset=offset).reshape(shape, order=order)
+            try:
+                yield arr
+            finally:
+                del arr
+
+
+class AsyncShmQueue(object):
+    """AsyncShmQueue lets asyncio coroutines put to and get from a ShmQueue without blocking the event loop.
+
+    The queue must be created with `notify=True`.  This process's notification pipes (see `ShmQueue.watch`)
+    are registered with the running event loop (`loop.add_reader`), so coroutines that find the queue empty
+    (or full) simply wait for a wakeup byte: there is no thread per call and any number of coroutines can
+    share the queue.  Each byte wakes one waiting coroutine, which then retries without blocking.
+
+    The process only watches the queue while some coroutine waits, so the other processes write no
+    wakeup bytes the rest of the time.  The pipes are its own, so no other process can take its wakeups,
+    and a waiting coroutine sleeps until it is woken up or its timeout expires.
+
+    Args:
+        queue (ShmQueue): The queue, created with `notify=True`.  It can also be used synchronously
+                          by other processes, and is not closed by `close`.
+
+    Note:
+        - Use one AsyncShmQueue per queue and event loop.
+        - Each process that uses an AsyncShmQueue takes one of the queue's `notify_slots`.
+
+    Example::
+
+        async def consume(q):
+            while True:
+                print(await q.get())
+
+        async def main(shm_queue):
+            q = AsyncShmQueue(shm_queue)
+            await asyncio.gather(*(consume(q) for _ in range(100)))
+
+    """
+
+    def __init__(self, queue: ShmQueue):
+        if queue.msg_notify is None or queue.free_notify is None:
+            raise ValueError("AsyncShmQueue requires a ShmQueue created with notify=True.")
+        self.queue: ShmQueue = queue
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        # The waiting coroutines and whether this process watches the queue, by kind of notification.
+        self.waiters: typing.List[typing.Deque[asyncio.Future]] = [collections.deque(), collections.deque()]
+        self.watching: typing.List[bool] = [False, False]
+
+    def attach(self)->asyncio.AbstractEventLoop:
+        """asyncio.AbstractEventLoop: Register this process's notification pipes with the running event loop."""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.close()
+            self.loop = loop
+            kind: int
+            for kind in (ShmQueue.NOTIFY_MSG, ShmQueue.NOTIFY_FREE):
+                loop.add_reader(self.queue.notify_reader(kind).fileno(), self.on_notify, kind)
+        return loop
+
+    def on_notify(self, kind: int):
+        """Drain a notification pipe and wake one waiting coroutine per byte.  Stop watching
+        the queue once no coroutine waits."""
+        count: int = ShmQueue.drain_notify(self.queue.notify_reader(kind))
+        waiters: typing.Deque[asyncio.Future] = self.waiters[kind]
+        while count > 0 and len(waiters) > 0:
+            waiter: asyncio.Future = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+        while len(waiters) > 0 and waiters[0].done():
+            waiters.popleft()
+        if len(waiters) == 0 and self.watching[kind]:
+            self.queue.watch(kind, False)
+            self.watching[kind] = False
+
+    async def wait(self, kind: int, deadline: typing.Optional[float]):
+        """Wait for a wakeup of a kind, or until the deadline.  When this process is not watching the queue
+        yet, start watching and return at once: the caller has to check the queue again before it waits."""
+        loop: asyncio.AbstractEventLoop = self.attach()
+        if not self.watching[kind]:
+            self.queue.watch(kind)
+            self.watching[kind] = True
+            return
+        waiter: asyncio.Future = loop.create_future()
+        self.waiters[kind].append(waiter)
+        try:
+            if deadline is None:
+                await waiter
+            else:
+                await asyncio.wait_for(waiter, max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            pass  # wait_for cancelled the waiter, and on_notify skips it.
+
+    async def put(self, msg: typing.Any, timeout: typing.Optional[float]=None):
+        """
+        Put an object into the queue, waiting for free blocks without blocking the event loop.
+
+        Args:
+            msg (obj): The object which is to be put into queue.
+            timeout (float, optional): When not None, wait for at most this many seconds.
+
+        Raises:
+            queue.Full: Raised if the call times out.
+        """
+        deadline: typing.Optional[float] = None if timeout is None else self.attach().time() + timeout
+        while True:
+            try:
+                return self.queue.put_nowait(msg)
+            except Full:
+                if deadline is not None and self.attach().time() >= deadline:
+                    raise
+            await self.wait(ShmQueue.NOTIFY_FREE, deadline)
+
+    async def get(self, timeout: typing.Optional[float]=None)->typing.Any:
+        """
+        Get the next available message, waiting for one without blocking the event loop.
+
+        Args:
+            timeout (float, optional): When not None, wait for at most this many seconds.
+
+        Returns:
+            object: A message object retrieved from the queue.
+
+        Raises:
+            queue.Empty: Raised if the call times out.
+        """
+        deadline: typing.Optional[float] = None if timeout is None else self.attach().time() + timeout
+        while True:
+            try:
+                return self.queue.get_nowait()
+            except Empty:
+                if deadline is not None and self.attach().time() >= deadline:
+                    raise
+            await self.wait(ShmQueue.NOTIFY_MSG, deadline)
+
+    def put_nowait(self, msg: typing.Any):
+        """
+        Equivalent to `ShmQueue.put_nowait`.
+        """
+        return self.queue.put_nowait(msg)
+
+    def get_nowait(self)->typing.Any:
+        """
+        Equivalent to `ShmQueue.get_nowait`.
+        """
+        return self.queue.get_nowait()
+
+    def qsize(self)->int:
+        """int: Return the number of ready messages."""
+        return self.queue.qsize()
+
+    def empty(self)->bool:
+        """bool: True when no messages are ready."""
+        return self.queue.empty()
+
+    def full(self)->bool:
+        """bool: True when no free blocks are available."""
+        return self.queue.full()
+
+    def close(self):
+        """
+        Unregister the notification pipes from the event loop and stop watching the queue.  The ShmQueue stays open.
+        """
+        if self.loop is not None:
+            kind: int
+            for kind in (ShmQueue.NOTIFY_MSG, ShmQueue.NOTIFY_FREE):
+                if not self.loop.is_closed():
+                    self.loop.remove_reader(self.queue.notify_reader(kind).fileno())
+                if self.watching[kind]:
+                    self.queue.watch(kind, False)
+                    self.watching[kind] = False
+                self.waiters[kind].clear()
+            self.loop = None
+
+
+class ShmObjectHandle(typing.NamedTuple):
+    """ShmObjectHandle is a small picklable token for an object in a `ShmObjectStore`.
+
+    It can be passed to any process that has the store, e.g. as a task argument, and costs a few
+    dozen bytes however large the object is.
+    """
+
+    name: str
+    """str: The name of the shared memory segment that holds the object."""
+
+    slot: int
+    """int: The index of the object's reference count in the store's table."""
+
+    generation: int
+    """int: The generation of the slot when the object was stored, to detect stale handles."""
+
+
+class ShmObjectStore(object):
+    """ShmObjectStore keeps large objects in shared memory once, for any number of processes to read.
+
+    `put_object` serializes an object a single time into a shared memory segment of its own and returns
+    a `ShmObjectHandle`.  Sending the handle instead of the object makes fan-out cheap: N tasks that
+    refer to the same 1GB table cost one copy.  `get_object` rebuilds the object without copying its
+    buffers: the object is pickled with protocol 5, and its out-of-band buffers (NumPy arrays,
+    `pickle.PickleBuffer`, and bytes-like objects passed directly) are read-only views of the segment.
+
+    Each object has a reference count in a shared table.  `put_object` returns a handle holding one
+    reference, `incref` adds references (e.g. one per task that is sent the handle) and
+    `release_object` drops one.  The process that drops the last reference unlinks the segment.
+
+    Args:
+        max_objects (int, optional): The number of objects that may be alive at the same time.
+                                By default, it is `ShmObjectStore.DEFAULT_MAX_OBJECTS`.
+
+    Note:
+        - `get_object` returns a read-only memoryview for a bytes, bytearray or memoryview object.
+        - Objects returned by `get_object`, and anything built on them, must not be used after the last
+          reference has been released.  A process keeps the segments it has read mapped until it sees
+          that their objects are gone and no view of them is alive.
+        - `close` needs to be invoked once to release the table and every object still stored.
+
+    Example::
+
+        def run(store, handle):
+            table = store.get_object(handle)  # a NumPy array backed by shared memory
+            print(table.sum())
+            store.release_object(handle)
+
+        if __name__ == '__main__':
+            store = ShmObjectStore()
+            handle = store.put_object(numpy.ones((1000, 1000)))
+            store.incref(handle, 2)
+            ps = [Process(target=run, args=(store, handle)) for _ in range(2)]
+            ...
+            store.release_object(handle)
+            store.close()
+
+    """
+
+    DEFAULT_MAX_OBJECTS: int = 1024
+    """int: The default number of slots in the reference count table."""
+
+    SLOT_STRUCT: struct.Struct = struct.Struct('qI32s')
+    """The struct of a slot in the table: the reference count (0 when the slot is free), the
+    generation, which changes each time the slot is reused, and the name of the object's segment."""
+
+    FRAME_COUNT_STRUCT: struct.Struct = struct.Struct('Q')
+    """The struct for the number of parts at the start of an object segment: the protocol 5 pickle
+    stream, then each out-of-band buffer."""
+
+    FRAME_PART_STRUCT: struct.Struct = struct.Struct('QQ')
+    """The struct for the offset and length of each part of an object segment."""
+
+    PART_ALIGNMENT: int = 64
+    """int: Each part of an object segment starts at a multiple of this many bytes, so arrays
+    that are rebuilt in place are aligned."""
+
+    def __init__(self, max_objects: int = DEFAULT_MAX_OBJECTS):
+        self.max_objects: int = max(1, max_objects)
+        self.lock = mp.get_context().Lock()
+        self.table: SharedMemory = SharedMemory(create=True, size=self.__class__.SLOT_STRUCT.size * self.max_objects)
+        self.table.buf[:] = bytes(self.table.size)
+        # The segments this process has mapped, by name, with the handle they were mapped for.
+        self.segments: typing.Dict[str, typing.Tuple[SharedMemory, ShmObjectHandle]] = {}
+
+    def __getstate__(self):
+        return (self.max_objects, self.lock, self.table.name)
+
+    def __setstate__(self, state):
+        self.max_objects, self.lock, self.table = state
+        self.table = SharedMemory(name=self.table)
+        self.segments = {}
+
+    def get_slot(self, slot: int)->typing.Tuple[int, int, bytes]:
+        """Get the reference count, generation and segment name of a slot."""
+        return self.__class__.SLOT_STRUCT.unpack_from(self.table.buf, slot * self.__class__.SLOT_STRUCT.size)
+
+    def set_slot(self, slot: int, refcount: int, generation: int, name: bytes):
+        """Set the reference count, generation and segment name of a slot."""
+        self.__class__.SLOT_STRUCT.pack_into(self.table.buf, slot * self.__class__.SLOT_STRUCT.size, refcount, generation, name)
+
+    def is_alive(self, handle: ShmObjectHandle)->bool:
+        """bool: True when the object of a handle still has references."""
+        with self.lock:
+            return self.check_slot(handle)
+
+    def check_slot(self, handle: ShmObjectHandle)->bool:
+        """bool: True when the slot of a handle holds its object.  The caller holds the lock."""
+        refcount: int
+        generation: int
+        refcount, generation, _ = self.get_slot(handle.slot)
+        return refcount > 0 and generation == handle.generation
+
+    def dumps(self, obj: typing.Any)->typing.List[memoryview]:
+        """typing.List[memoryview]: Pickle an object with protocol 5 into the stream and its out-of-band buffers."""
+        if type(obj) in (bytes, bytearray, memoryview):
+            view: memoryview = memoryview(obj)
+            obj = pickle.PickleBuffer(view if view.contiguous else view.tobytes())
+        buffers: typing.List[pickle.PickleBuffer] = []
+        body: bytes = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        parts: typing.List[memoryview] = [memoryview(body)]
+        buffer: pickle.PickleBuffer
+        for buffer in buffers:
+            parts.append(buffer.raw())
+        return parts
+
+    def put_object(self, obj: typing.Any)->ShmObjectHandle:
+        """
+        Write an object into shared memory.
+
+        Args:
+            obj (obj): The object to store.
+
+        Returns:
+            ShmObjectHandle: A handle that holds one reference to the stored object.
+
+        Raises:
+            ValueError: All `max_objects` slots are in use.
+        """
+        parts: typing.List[memoryview] = self.dumps(obj)
+        alignment: int = self.__class__.PART_ALIGNMENT
+        offset: int = self.__class__.FRAME_COUNT_STRUCT.size + self.__class__.FRAME_PART_STRUCT.size * len(parts)
+        offsets: typing.List[int] = []
+        part: memoryview
+        for part in parts:
+            offset += -offset % alignment
+            offsets.append(offset)
+            offset += part.nbytes
+
+        segment: SharedMemory = SharedMemory(create=True, size=offset)
+        self.__class__.FRAME_COUNT_STRUCT.pack_into(segment.buf, 0, len(parts))
+        idx: int
+        for idx, part in enumerate(parts):
+            self.__class__.FRAME_PART_STRUCT.pack_into(segment.buf, self.__class__.FRAME_COUNT_STRUCT.size + self.__class__.FRAME_PART_STRUCT.size * idx,
+                                                       offsets[idx], part.nbytes)
+            segment.buf[offsets[idx]:offsets[idx] + part.nbytes] = part
+        parts.clear()
+
+        with self.lock:
+            slot: int
+            for slot in range(self.max_objects):
+                refcount: int
+                generation: int
+                refcount, generation, _ = self.get_slot(slot)
+                if refcount == 0:
+                    generation = (generation + 1) & 0xffffffff
+                    self.set_slot(slot, 1, generation, segment.name.encode('ascii'))
+                    break
+            else:
+                segment.close()
+                segment.unlink()
+                raise ValueError("ShmObjectStore: all %d slots are in use." % self.max_objects)
+        handle: ShmObjectHandle = ShmObjectHandle(segment.name, slot, generation)
+        self.segments[segment.name] = (segment, handle)
+        return handle
+
+    def incref(self, handle: ShmObjectHandle, count: int=1):
+        """
+        Add references to a stored object.
+
+        Args:
+            handle (ShmObjectHandle): A handle of the object, which must still have references.
+            count (int, optional): The number of references to add.  (Default is 1.)
+
+        Raises:
+            ValueError: The object has been freed.
+        """
+        with self.lock:
+            refcount: int
+            generation: int
+            name: bytes
+            refcount, generation, name = self.get_slot(handle.slot)
+            if refcount <= 0 or generation != handle.generation:
+                raise ValueError("ShmObjectStore.incref: %r has been freed." % (handle,))
+            self.set_slot(handle.slot, refcount + count, generation, name)
+
+    def release_object(self, handle: ShmObjectHandle):
+        """
+        Drop a reference to a stored object, and free the object if it was the last one.
+
+        Args:
+            handle (ShmObjectHandle): A handle of the object.
+
+        Raises:
+            ValueError: The object has already been freed.
+        """
+        with self.lock:
+            refcount: int
+            generation: int
+            name: bytes
+            refcount, generation, name = self.get_slot(handle.slot)
+            if refcount <= 0 or generation != handle.generation:
+                raise ValueError("ShmObjectStore.release_object: %r has already been freed." % (handle,))
+            refcount -= 1
+            self.set_slot(handle.slot, refcount, generation, name if refcount > 0 else b'')
+
+        if refcount == 0:
+            if handle.name not in self.segments:
+                self.segments[handle.name] = (SharedMemory(name=handle.name), handle)
+            self.segments[handle.name][0].unlink()
+        self.unmap_freed()
+
+    def attach(self, handle: ShmObjectHandle)->SharedMemory:
+        """SharedMemory: Map the segment of an object in this process, once."""
+        if handle.name not in self.segments:
+            if not self.is_alive(handle):
+                raise ValueError("ShmObjectStore.get_object: %r has been freed." % (handle,))
+            self.segments[handle.name] = (SharedMemory(name=handle.name), handle)
+        return self.segments[handle.name][0]
+
+    def get_object(self, handle: ShmObjectHandle)->typing.Any:
+        """
+        Rebuild a stored object without copying its out-of-band buffers.
+
+        The caller must hold a reference to the object (e.g. the one it was sent with the handle)
+        for as long as it uses the object.
+
+        Args:
+            handle (ShmObjectHandle): A handle of the object.
+
+        Returns:
+            object: The object.  Its out-of-band buffers are read-only views of shared memory.
+
+        Raises:
+            ValueError: The object has been freed.
+        """
+        buf: memoryview = self.attach(handle).buf
+        part_count: int = self.__class__.FRAME_COUNT_STRUCT.unpack_from(buf, 0)[0]
+        views: typing.List[memoryview] = []
+        idx: int
+        for idx in range(part_count):
+            offset: int
+            length: int
+            offset, length = self.__class__.FRAME_PART_STRUCT.unpack_from(buf, self.__class__.FRAME_COUNT_STRUCT.size + self.__class__.FRAME_PART_STRUCT.size * idx)
+            views.append(buf[offset:offset + length].toreadonly()) # type: ignore[attr-defined]
+        body: memoryview = views.pop(0)
+        obj: typing.Any = pickle.loads(body, buffers=views)
+        body.release()
+        return obj
+
+    def unmap_freed(self):
+        """Unmap the segments this process has mapped whose objects have been freed and are no longer in use."""
+        with self.lock:
+            freed: typing.List[str] = [name for name, (_, handle) in self.segments.items() if not self.check_slot(handle)]
+        name: str
+        for name in freed:
+            try:
+                self.segments[name][0].close()
+            except BufferError:
+                continue # A view of the object is still alive; try again later.
+            del self.segments[name]
+
+    def object_count(self)->int:
+        """int: Return the number of stored objects."""
+        with self.lock:
+            return sum(1 for slot in range(self.max_objects) if self.get_slot(slot)[0] > 0)
+
+    def close(self):
+        """
+        Free every object still stored and release the table.
+        """
+        with self.lock:
+            slot: int
+            for slot in range(self.max_objects):
+                refcount: int
+                generation: int
+                name: bytes
+                refcount, generation, name = self.get_slot(slot)
+                if refcount > 0:
+                    self.set_slot(slot, 0, generation, b'')
+                    name_: str = name.rstrip(b'\0').decode('ascii')
+                    if name_ in self.segments:
+                        self.segments[name_][0].unlink()
+                    else:
+                        leftover: SharedMemory = SharedMemory(name=name_)
+                        leftover.unlink()
+                        leftover.close()
+        segment: SharedMemory
+        for segment, _ in self.segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                pass # A view of the object is still alive; the mapping goes away with it.
+        self.segments = {}
+        self.table.close()
+        self.table.unlink()
+
+
+class SpscShmQueue(mpq.Queue):
+    """SpscShmQueue is a single-producer/single-consumer shared memory queue built on a contiguous byte ring.
+
+    Only one process may put and only one (possibly different) process may get.  Under that restriction
+    no locks are needed: the producer owns the `head` index and the consumer owns the `tail` index, both
+    of which are monotonically increasing byte counts published in the shared memory segment.  A message
+    is stored as an 8-byte length followed by the serialized bytes, and wraps around the end of the ring.
+
+    Blocking only happens when the ring is full (producer) or empty (consumer).  The waiting side raises a
+    flag in shared memory and sleeps on a semaphore; after publishing its index, the other side releases
+    the semaphore only when it sees the flag.  The flag of each side is set, checked and cleared under a
+    lock, so the wakeup on the empty to non-empty and full to non-full transitions cannot be lost and the
+    waiting side sleeps until it is woken up.  An uncontended lock does not enter the kernel, so the
+    common case still costs no system calls.
+
+    Args:
+        capacity (int, optional): Size of the ring in bytes.  By default, it is `SpscShmQueue.DEFAULT_CAPACITY`
+                                (4*1024*1024).  A serialized message may not exceed `capacity` minus 8 bytes.
+        serializer (obj, optional): Serializer to serialize and deserialize data. \\
+                                If it is None (default), pickle will be used. \\
+                                The serializer should implement `loads(bytes data) -> object` \\
+                                and `dumps(object obj) -> bytes`.
+
+    Note:
+        - `close` needs to be invoked once to release memory and avoid a memory leak.  If the
+          creating process drops the queue without closing it, the ring is released when the
+          queue is garbage collected.
+        - Using the queue with more than one producer or more than one consumer corrupts it.
+          Use `ShmQueue` for those cases.
+
+    Example::
+
+        def run(q):
+            e = q.get()
+            print(e)
+
+        if __name__ == '__main__':
+            q = SpscShmQueue(capacity=1024 * 1024)
+            p = Process(target=run, args=(q,))
+            p.start()
+            q.put(100)
+            p.join()
+            q.close()
+
+    """
+
+    DEFAULT_CAPACITY: int = 4 * 1024 * 1024
+    """int: The default size of the ring in bytes."""
+
+    INDEX_STRUCT: struct.Struct = struct.Struct('Q')
+    """The struct for the head and tail indices and the message length prefix."""
+
+    FLAG_STRUCT: struct.Struct = struct.Struct('I')
+    """The struct for the waiting flags."""
+
+    HEAD_OFFSET: int = 0
+    """int: The offset of the head index (total bytes written, owned by the producer)."""
+
+    PUT_COUNT_OFFSET: int = 8
+    """int: The offset of the number of messages written, owned by the producer."""
+
+    TAIL_OFFSET: int = 64
+    """int: The offset of the tail index (total bytes read, owned by the consumer)."""
+
+    GET_COUNT_OFFSET: int = 72
+    """int: The offset of the number of messages read, owned by the consumer."""
+
+    READER_WAITING_OFFSET: int = 128
+    """int: The offset of the flag set by a consumer that sleeps on an empty ring."""
+
+    WRITER_WAITING_OFFSET: int = 192
+    """int: The offset of the flag set by a producer that sleeps on a full ring."""
+
+    DATA_OFFSET: int = 256
+    """int: The offset of the ring data.  The control words above sit on separate
+    cache lines so the producer and the consumer do not write to the same line."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, serializer=None):
+        ctx = mp.get_context()
+
+        super().__init__(0, ctx=ctx)
+
+        self.capacity: int = capacity if capacity > 0 else self.__class__.DEFAULT_CAPACITY
+        self.serializer = serializer or pickle
+
+        self.msg_semaphore = ctx.Semaphore(0)
+        self.space_semaphore = ctx.Semaphore(0)
+        self.reader_lock = ctx.Lock()
+        self.writer_lock = ctx.Lock()
+
+        self.owner_pid: int = os.getpid()
+        self.closed: bool = False
+        self.ring: SharedMemory = SharedMemory(create=True, size=self.__class__.DATA_OFFSET + self.capacity)
+        self.set_index(self.__class__.HEAD_OFFSET, 0)
+        self.set_index(self.__class__.PUT_COUNT_OFFSET, 0)
+        self.set_index(self.__class__.TAIL_OFFSET, 0)
+        self.set_index(self.__class__.GET_COUNT_OFFSET, 0)
+        self.set_flag(self.__class__.READER_WAITING_OFFSET, 0)
+        self.set_flag(self.__class__.WRITER_WAITING_OFFSET, 0)
+
+    def __getstate__(self):
+        """This routine retrieves queue information when forking a new process."""
+        return (self.capacity,
+                dill.dumps(self.serializer),
+                self.msg_semaphore,
+                self.space_semaphore,
+                self.reader_lock,
+                self.writer_lock,
+                self.ring.name)
+
+    def __setstate__(self, state):
+        """This routine saves queue information when forking a new process."""
+        (self.capacity,
+         self.serializer,
+         self.msg_semaphore,
+         self.space_semaphore,
+         self.reader_lock,
+         self.writer_lock,
+         self.ring) = state
+
+        self.serializer = dill.loads(self.serializer)
+        # Only the creator releases the ring when the queue is garbage collected.
+        self.owner_pid = 0
+        self.closed = False
+        self.ring = SharedMemory(name=self.ring)
+
+    def get_index(self, offset: int)->int:
+        """int: Read the head or tail index."""
+        return self.__class__.INDEX_STRUCT.unpack_from(self.ring.buf, offset)[0]
+
+    def set_index(self, offset: int, value: int):
+        self.__class__.INDEX_STRUCT.pack_into(self.ring.buf, offset, value)
+
+    def get_flag(self, offset: int)->int:
+        """int: Read a waiting flag."""
+        return self.__class__.FLAG_STRUCT.unpack_from(self.ring.buf, offset)[0]
+
+    def set_flag(self, offset: int, value: int):
+        self.__class__.FLAG_STRUCT.pack_into(self.ring.buf, offset, value)
+
+    def write_ring(self, pos: int, data: typing.Union[bytes, memoryview]):
+        """Copy data into the ring at a byte position, wrapping around the end.
+
+        Args:
+            pos (int): The unwrapped byte position (a head index value).
+            data (bytes): The data to copy."""
+        start: int = pos % self.capacity
+        first: int = min(len(data), self.capacity - start)
+        base: int = self.__class__.DATA_OFFSET
+        self.ring.buf[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.ring.buf[base:base + len(data) - first] = data[first:]
+
+    def read_ring(self, pos: int, size: int)->bytes:
+        """bytes: Copy data out of the ring at a byte position, wrapping around the end.
+
+        Args:
+            pos (int): The unwrapped byte position (a tail index value).
+            size (int): The number of bytes to copy."""
+        start: int = pos % self.capacity
+        first: int = min(size, self.capacity - start)
+        base: int = self.__class__.DATA_OFFSET
+        data: bytes = bytes(self.ring.buf[base + start:base + start + first])
+        if first < size:
+            data += bytes(self.ring.buf[base:base + size - first])
+        return data
+
+    def wait(self, semaphore, lock, flag_offset: int, ready: typing.Callable[[], bool],
+             block: bool, timeout: typing.Optional[float])->bool:
+        """bool: Wait until `ready()` is True, sleeping on `semaphore` between checks.
+
+        Args:
+            semaphore: The semaphore the other side releases when it sees the flag.
+            lock: The lock that guards this side's waiting flag.
+            flag_offset (int): The offset of this side's waiting flag.
+            ready (typing.Callable[[], bool]): The condition to wait for.
+            block (bool): When False, check the condition once.
+            timeout (typing.Optional[float]): When block is True and timeout is
+               not None, wait for at most timeout seconds.
 
         Returns:
-            src_pid (int): The process iodentifier of the process that originated the message.
-            msg_id (bytes): The messag identifier.
-            block_id (int): The identifier for the first chunk in the message.
-            total_chunks (int): The total number of chunks in the message.
-            next_chunk_block_id (int): The identifier for the next chunk in the message.
-
-        Raises:
-            queue.Empty: no messages are available and either nonblocking mode or a timeout occured.
-            ValueError: An internal error occured in accessing the message's metadata.
-        """
-        i = 0
-        time_start = time.time()
+            bool: True when the condition holds, False on timeout or when not blocking."""
+        if ready():
+            return True
+        if not block:
+            return False
+        deadline: typing.Optional[float] = None if timeout is None else time.time() + timeout
         while True:
-            remaining_timeout: typing.Optional[float] = timeout
-            if remaining_timeout is not None:
-                remaining_timeout -= (time.time() - time_start)
-                if remaining_timeout <= 0:
-                    raise Empty
-            block_id: typing.Optional[int] = self.get_first_msg(block=block, timeout=remaining_timeout)
-            if block_id is not None:
-                break
-
-            if not block:
-                raise Empty
-            
-        with self.block_locks[block_id]:
-            data_block = self.data_blocks[block_id]
-            src_pid: typing.Union[bytes, int] = self.get_meta(data_block, 'src_pid')
-            msg_id: typing.Union[bytes, int] = self.get_meta(data_block, 'msg_id')
-            total_chunks: typing.Union[bytes, int] = self.get_meta(data_block, 'total_chunks')
-            next_chunk_block_id: typing.Union[bytes, int] = self.get_meta(data_block, 'next_chunk_block_id')
-            if isinstance(src_pid, int) and isinstance (msg_id, bytes) and isinstance(total_chunks, int) and isinstance(next_chunk_block_id, int):
-                return src_pid, msg_id, block_id, total_chunks, next_chunk_block_id
-            else:
-                raise ValueError("next_readable_msg: internal error extracting data block metadata.")
+            # The other side checks the flag under the same lock after it has published
+            # its index, so either it sees the flag or this check sees the new index.
+            with lock:
+                if ready():
+                    self.set_flag(flag_offset, 0)
+                    return True
+                self.set_flag(flag_offset, 1)
+            remaining: typing.Optional[float] = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+            # A permit left over from an earlier timed out wait only causes one more check.
+            if remaining is None or remaining > 0:
+                semaphore.acquire(timeout=remaining)
+                continue
+            with lock:
+                self.set_flag(flag_offset, 0)
+                return ready()
+
+    def wake(self, semaphore, lock, flag_offset: int):
+        """Wake up the other side if it waits on `semaphore`.
 
-    # def debug_data_block(self):
-    #     for b in self.data_blocks:
-    #         print(bytes(b.buf[0:24]))
+        Args:
+            semaphore: The semaphore the other side sleeps on.
+            lock: The lock that guards the other side's waiting flag.
+            flag_offset (int): The offset of the other side's waiting flag."""
+        with lock:
+            if self.get_flag(flag_offset):
+                self.set_flag(flag_offset, 0)
+                semaphore.release()
 
     def put(self, msg: typing.Any, block: bool=True, timeout: typing.Optional[float]=None):
-
         """
-        Put an object into a shared memory queue.
+        Put an object into the ring.
 
         Args:
             msg (obj): The object which is to be put into queue.
@@ -632,140 +4753,34 @@ class ShmQueue(mpq.Queue):
             timeout (int, optional): A positive integer for the timeout duration in seconds, which is only effective when `block` is set to True.
 
         Raises:
-            queue.Full: Raised if the call times out or the queue is full when `block` is False.
-            ValueError: An internal error occured in accessing the message's metadata.
-            ValueError: A request was made to send a message that, when serialized, exceeds the capacity of the queue.
-            PicklingError: This exception is raised when the serializer is pickle and
-                an error occured in serializing the message.
-            UnpicklingError: This exception is raised when the serializer is pickle and
-                an error occured in deserializing the message for an integrity check.
-
-        Note:
-            - Errors other then PicklingError might be raised if a serialized other then
-              pickle is specified.
+            queue.Full: Raised if the call times out or the ring is full when `block` is False.
+            ValueError: The serialized message can never fit into the ring.
         """
-        if timeout is not None:
-            if not block:
-                raise ValueError("A timeout is allowed only when not blocking.")
-            if timeout < 0:
-                raise Full
-
-        msg_id: bytes = self.generate_msg_id()
-        src_pid: int = os.getpid()
         msg_body: bytes = self.serializer.dumps(msg) # type: ignore[union-attr]
-        if self.integrity_check:
-            total_msg_size: int = len(msg_body)
-            msg2: typing.Any = self.serializer.loads(msg_body) # type: ignore[union-attr]
-            if self.verbose:
-                print("put: qid=%d src_pid=%d msg_id=%r: serialization integrity check is OK." % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
-            
-        total_chunks: int = math.ceil(len(msg_body) / self.chunk_size)
-        if self.verbose:
-            print("put: qid=%d src_pid=%d msg_id=%r: total_chunks=%d len(msg_body)=%d chunk_size=%d" % (self.qid, src_pid, msg_id, total_chunks, len(msg_body), self.chunk_size), file=sys.stderr, flush=True) # ***
-        if self.watermark_check or self.verbose:
-            if total_chunks > self.chunk_watermark:
-                print("put: qid=%d src_pid=%d msg_id=%r: total_chunks=%d maxsize=%d new watermark" % (self.qid, src_pid, msg_id, total_chunks, self.maxsize), file=sys.stderr, flush=True) # ***
-                self.chunk_watermark = total_chunks
-
-        if self.deadlock_immanent_check and total_chunks > self.maxsize:
-            raise ValueError("DEADLOCK IMMANENT: qid=%d src_pid=%d: total_chunks=%d > maxsize=%d" % (self.qid, src_pid, total_chunks, self.maxsize))
-        
-        time_start: float = time.time()
-
-        # We acquire the producer lock to avoid deadlock if multiple
-        # producers need multiple chunks each.
-        lock_acquired: bool = self.producer_lock.acquire(timeout=timeout)
-        if not lock_acquired:
-            # We must have timed out.
-            if self.verbose:
-                print("put: qid=%d src_pid=%d msg_id=%r: queue FULL" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
-            raise Full
-
-        block_id: int
-        block_id_list: typing.List[int] = [ ]
-        try:
-            # In case we will process more than one chunk and this is a
-            # nonblocking or timed out request, start by reserving all the
-            # blocks that we will need.
-            i: int
-            for i in range(total_chunks):
-                try:
-                    remaining_timeout: typing.Optional[float] = timeout
-                    if remaining_timeout is not None:
-                        remaining_timeout -= (time.time() - time_start)
-                        if remaining_timeout <= 0:
-                            if self.verbose:
-                                print("put: qid=%d src_pid=%d msg_id=%r: queue FULL" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
-                            raise Full
-
-                    block_id = self.next_writable_block_id(block, remaining_timeout, msg_id, src_pid)
-                    block_id_list.append(block_id)
-
-                except Full:
-                    # We failed to find a free block and/or a timeout occured.
-                    # Release the reserved blocks.
-                    if self.verbose:
-                        print("put: qid=%d src_pid=%d msg_id=%r: releasing %d blocks" % (self.qid, src_pid, msg_id, len(block_id_list)), file=sys.stderr, flush=True) # ***
-                    for block_id in block_id_list:
-                        self.add_free_block(block_id)
-                    raise
-
-        finally:
-            # Now that we have acquired the full set of chunks, we can release
-            # the producer lock.  We don't want to hold it while we transfer
-            # data into the blocks.
-            if self.verbose:
-                print("put: qid=%d src_pid=%d msg_id=%r: releasing producer lock" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # *** 
-            self.producer_lock.release()
+        index_struct: struct.Struct = self.__class__.INDEX_STRUCT
+        need: int = index_struct.size + len(msg_body)
+        if need > self.capacity:
+            raise ValueError("SpscShmQueue.put: message of %d bytes does not fit into capacity=%d" % (len(msg_body), self.capacity))
 
-            # Consume this message ID.
-            self.consume_msg_id()
-
-        if self.verbose:
-            print("put: qid=%d src_pid=%d msg_id=%r: acquired %d blocks" % (self.qid, src_pid, msg_id, total_chunks), file=sys.stderr, flush=True) # *** 
+        head: int = self.get_index(self.__class__.HEAD_OFFSET)
 
-        # Now that we have a full set of blocks, build the
-        # chunks:
-        block_idx: int
-        for block_idx, block_id in enumerate(block_id_list):
-            chunk_id = block_idx + 1
-            if self.verbose:
-                print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d of total_chunks=%d" % (self.qid, src_pid, msg_id, chunk_id, total_chunks), file=sys.stderr, flush=True) # *** 
-               
-            data_block: SharedMemory = self.data_blocks[block_id]
-            chunk_data: bytes = msg_body[block_idx * self.chunk_size: (block_idx + 1) * self.chunk_size]
-            msg_size: int = len(chunk_data)
-            if self.verbose:
-                print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d msg_size=%d." % (self.qid, src_pid, msg_id, chunk_id, block_id, msg_size), file=sys.stderr, flush=True) # ***
-            if self.integrity_check:
-                checksum: int = zlib.adler32(chunk_data)
-                if self.verbose:
-                    print("put: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: checksum=%x total_msg_size=%d" % (self.qid, src_pid, msg_id, chunk_id, checksum, total_msg_size), file=sys.stderr, flush=True) # ***
+        def has_room()->bool:
+            return self.capacity - (head - self.get_index(self.__class__.TAIL_OFFSET)) >= need
 
-            with self.block_locks[block_id]:
-                self.set_meta(data_block, msg_id, 'msg_id')
-                self.set_meta(data_block, msg_size, 'msg_size')
-                self.set_meta(data_block, chunk_id, 'chunk_id')
-                self.set_meta(data_block, total_chunks, 'total_chunks')
-                if self.integrity_check:
-                    self.set_meta(data_block, total_msg_size, 'total_msg_size')
-                    self.set_meta(data_block, checksum, 'checksum')
-                if chunk_id == total_chunks:
-                    # No more chunks, store a reserved value to simplify debugging.
-                    self.set_meta(data_block, self.__class__.RESERVED_BLOCK_ID, 'next_chunk_block_id')
-                else:
-                    # Store the block ID of the next chunk.
-                    self.set_meta(data_block, block_id_list[block_idx + 1], 'next_chunk_block_id')
-                self.set_data(data_block, chunk_data, msg_size)
+        if not self.wait(self.space_semaphore, self.writer_lock, self.__class__.WRITER_WAITING_OFFSET,
+                         has_room, block, timeout):
+            raise Full
 
-        # Now that the entire message has built, queue it:
-        self.add_msg(block_id_list[0])
-        if self.verbose:
-            print("put: qid=%d src_pid=%d msg_id=%r: message sent" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # *** 
+        self.write_ring(head, index_struct.pack(len(msg_body)))
+        self.write_ring(head + index_struct.size, msg_body)
+        self.set_index(self.__class__.PUT_COUNT_OFFSET, self.get_index(self.__class__.PUT_COUNT_OFFSET) + 1)
+        # Publishing the head index hands the message over to the consumer.
+        self.set_index(self.__class__.HEAD_OFFSET, head + need)
+        self.wake(self.msg_semaphore, self.reader_lock, self.__class__.READER_WAITING_OFFSET)
 
     def get(self, block: bool=True, timeout: typing.Optional[float]=None)->typing.Any:
         """
-        Get the next available message from the queue.
+        Get the next available message from the ring.
 
         Args:
             block (bool, optional): If it is set to True (default), it will only return when an item is available.
@@ -776,135 +4791,24 @@ class ShmQueue(mpq.Queue):
 
         Raises:
             queue.Empty: This exception will be raised if it times out or queue is empty when `block` is False.
-            ValueError: An internal error occured in accessing the message's metadata.
-            UnpicklingError: This exception is raised when the serializer is pickle and
-                an error occured in deserializing the message.
-
-        Note:
-            - Errors other then UnpicklingError might be raised if a serialized other then
-              pickle is specified.
         """
-        time_start: float = time.time()
-
-        # We will build a list of message chunks.  We can't
-        # release them until after we deserialize the data.
-        block_id: int
-        chunk_id: int
-        msg_block_ids: typing.List[int] = [ ]
-        data_block: SharedMemory
-        
-        try:
-            remaining_timeout: typing.Optional[float] = timeout
-            if remaining_timeout is not None:
-                remaining_timeout -= (time.time() - time_start)
-                if remaining_timeout <= 0:
-                    if self.verbose:
-                        print("put: qid=%d src_pid=%d msg_id=%r: queue EMPTY" % (self.qid, src_pid, msg_id), file=sys.stderr, flush=True) # ***
-                    raise Empty
-
-            src_pid: int
-            msg_id: bytes
-            total_chunks: int
-            next_chunk_block_id: int
-            src_pid, msg_id, block_id, total_chunks, next_chunk_block_id = self.next_readable_msg(block, remaining_timeout) # This call might raise Empty.
-            if self.verbose:
-                print("get: qid=%d src_pid=%d msg_id=%r: total_chunks=%d next_chunk_block_id=%d." % (self.qid, src_pid, msg_id, total_chunks, next_chunk_block_id), file=sys.stderr, flush=True) # ***
-            msg_block_ids.append(block_id)
-
-            # Acquire the chunks for the rest of the message:
-            i: int
-            for i in range(1, total_chunks):
-                chunk_id = i + 1
-                if self.verbose:
-                    print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d." % (self.qid, src_pid, msg_id, chunk_id, next_chunk_block_id), file=sys.stderr, flush=True) # ***
-                msg_block_ids.append(next_chunk_block_id)
-                data_block = self.data_blocks[next_chunk_block_id]
-                with self.block_locks[next_chunk_block_id]:
-                    maybe_next_chunk_block_id: typing.Union[bytes, int] = self.get_meta(data_block, 'next_chunk_block_id')
-                    if isinstance(maybe_next_chunk_block_id, int):
-                        next_chunk_block_id = maybe_next_chunk_block_id
-                    else:
-                        raise ValueError("get: internal error getting next_chunk_block_id")
-
-        except Exception:
-            # Release the data blocks (losing the message) if we get an
-            # unexpected exception:
-            if self.verbose:
-                print("put: qid=%d: releasing data blocks due to Exception" % self.qid, file=sys.stderr, flush=True) # *** 
-            for block_id in msg_block_ids:
-                self.add_free_block(block_id)
-            msg_block_ids.clear()
-            raise
-
-        buf_msg_body: typing.List[bytes] = []
-        try:
-            block_idx: int
-            for block_idx, block_id in enumerate(msg_block_ids):
-                chunk_id = block_idx + 1
-                data_block = self.data_blocks[block_id]
-                with self.block_locks[block_id]:
-                    maybe_msg_size: typing.Union[bytes, int] = self.get_meta(data_block, 'msg_size')
-                    if isinstance(maybe_msg_size, int):
-                        msg_size: int = maybe_msg_size
-                    else:
-                        raise ValueError("get: internal error getting msg_size")
-                    if self.integrity_check:
-                        if block_idx == 0:
-                            maybe_total_msg_size: typing.Union[bytes, int] = self.get_meta(data_block, 'total_msg_size')
-                            if isinstance(maybe_total_msg_size, int):
-                                total_msg_size: int = maybe_total_msg_size
-                            else:
-                                raise ValueError("set: internal errpor getting total_msg_size")
-                        maybe_checksum: typing.Union[bytes, int] = self.get_meta(data_block, 'checksum')
-                        if isinstance(maybe_checksum, int):
-                            checksum: int = maybe_checksum
-                        else:
-                            raise ValueError("get: internal error getting checksum")
-                    chunk_data: bytes = self.get_data(data_block, msg_size) # This may make a reference, not a deep copy.
-                if self.verbose:
-                    print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d msg_size=%d total_chunks=%d." % (self.qid, src_pid, msg_id, chunk_id, block_id, msg_size, total_chunks), file=sys.stderr, flush=True) # ***
-                if self.integrity_check:
-                    checksum2: int = zlib.adler32(chunk_data)
-                    if checksum == checksum2:
-                        if self.verbose:
-                            print("get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: checksum=%x is OK" % (self.qid, src_pid, msg_id, chunk_id, checksum), file=sys.stderr, flush=True) # ***
-                    else:
-                        raise ValueError("ShmQueue.get: qid=%d src_pid=%d msg_id=%r: chunk_id=%d: block_id=%d checksum=%x != checksum2=%x -- FAIL!" % (self.qid, src_pid, msg_id, chunk_id, block_id, checksum, checksum2)) # TODO: use a better exception
+        tail: int = self.get_index(self.__class__.TAIL_OFFSET)
 
-                buf_msg_body.append(chunk_data) # This may copy the reference.
-
-            msg_body: bytes = b''.join(buf_msg_body) # Even this might copy the references.
-            if self.integrity_check:
-                if total_msg_size == len(msg_body):
-                    if self.verbose:
-                        print("get: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d is OK" % (self.qid, src_pid, msg_id, total_msg_size), file=sys.stderr, flush=True) # ***
-                else:
-                    raise ValueError("get: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d != len(msg_body)=%d -- FAIL!" % (self.qid, src_pid, msg_id, total_msg_size, len(msg_body))) # TODO: use a beter exception.
-
-            try:
-                # Finally, we are guaranteed to copy the data.
-                msg: typing.Any = self.serializer.loads(msg_body)  # type: ignore[union-attr]
-
-                # We could release the blocks here, but then we'd have to
-                # release them in the except clause, too.
+        def has_msg()->bool:
+            return self.get_index(self.__class__.HEAD_OFFSET) != tail
 
-                return msg
+        if not self.wait(self.msg_semaphore, self.reader_lock, self.__class__.READER_WAITING_OFFSET,
+                         has_msg, block, timeout):
+            raise Empty
 
-            except pickle.UnpicklingError as e:
-                print("get: Fail: qid=%d src_pid=%d msg_id=%r: msg_size=%d chunk_id=%d total_chunks=%d." % (self.qid, src_pid, msg_id, msg_size, chunk_id, total_chunks), file=sys.stderr, flush=True) # ***
-                if self.integrity_check:
-                    print("get: Fail: qid=%d src_pid=%d msg_id=%r: total_msg_size=%d checksum=%x" % (self.qid, src_pid, msg_id, total_msg_size, checksum), file=sys.stderr, flush=True) # ***
-                raise
-    
-        finally:
-            # It is now safe to release the data blocks.  This is a good place
-            # to release them, because it covers error paths as well as the main return.
-            if self.verbose:
-                print("get: qid=%d src_pid=%d msg_id=%r: releasing %d blocks." % (self.qid, src_pid, msg_id, len(msg_block_ids)), file=sys.stderr, flush=True) # ***
-            for block_id in msg_block_ids:
-                self.add_free_block(block_id)
-            msg_block_ids.clear()
-            buf_msg_body.clear()
+        index_struct: struct.Struct = self.__class__.INDEX_STRUCT
+        msg_size: int = index_struct.unpack(self.read_ring(tail, index_struct.size))[0]
+        msg_body: bytes = self.read_ring(tail + index_struct.size, msg_size)
+        self.set_index(self.__class__.GET_COUNT_OFFSET, self.get_index(self.__class__.GET_COUNT_OFFSET) + 1)
+        # Publishing the tail index hands the space back to the producer.
+        self.set_index(self.__class__.TAIL_OFFSET, tail + index_struct.size + msg_size)
+        self.wake(self.space_semaphore, self.writer_lock, self.__class__.WRITER_WAITING_OFFSET)
+        return self.serializer.loads(msg_body) # type: ignore[union-attr]
 
     def get_nowait(self)->typing.Any:
         """
@@ -919,28 +4823,324 @@ class ShmQueue(mpq.Queue):
         return self.put(msg, False)
 
     def qsize(self)->int:
-        """int: Return the number of ready messages."""
-        return self.get_msg_count()
+        """int: Return the approximate number of ready messages."""
+        return max(0, self.get_index(self.__class__.PUT_COUNT_OFFSET) - self.get_index(self.__class__.GET_COUNT_OFFSET))
+
+    def used_bytes(self)->int:
+        """int: Return the number of ring bytes (including length prefixes) in use."""
+        return self.get_index(self.__class__.HEAD_OFFSET) - self.get_index(self.__class__.TAIL_OFFSET)
 
     def empty(self)->bool:
         """bool: True when no messages are ready."""
-        return self.get_msg_count() == 0
+        return self.used_bytes() == 0
 
     def full(self)->bool:
-        """bool: True when no free blocks are available."""
-        return self.get_free_block_count() == 0
+        """bool: True when not even an empty message fits into the ring."""
+        return self.capacity - self.used_bytes() < self.__class__.INDEX_STRUCT.size
 
     def close(self):
         """
-        Indicate no more new data will be added and release the shared memory areas.
+        Indicate no more new data will be added and release the shared memory area.
         """
-        block: SharedMemory
-        for block in self.data_blocks:
-            block.close()
-            block.unlink()
-
-        self.list_heads.close()
-        self.list_heads.unlink()
+        if self.closed:
+            return
+        self.closed = True
+        self.ring.close()
+        self.ring.unlink()
 
     def __del__(self):
-        pass
+        # The creator releases the ring if it was never closed; the other
+        # processes only drop their mapping.
+        if getattr(self, 'ring', None) is None or self.closed:
+            return
+        self.closed = True
+        self.ring.close()
+        if self.owner_pid == os.getpid():
+            self.ring.unlink()
+
+
+class SpillSegment(object):
+    """SpillSegment is a memory-mapped file of length-prefixed records that a SpillQueue appends to
+    and reads back in order.
+
+    Args:
+        path (str): The path of the file, which is created.
+        size (int): The size of the file in bytes.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path: str = path
+        self.file: typing.BinaryIO = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map: mmap.mmap = mmap.mmap(self.file.fileno(), size)
+        self.read_offset: int = 0
+        self.write_offset: int = 0
+
+    def free_bytes(self)->int:
+        """int: The number of bytes that can still be appended."""
+        return len(self.map) - self.write_offset
+
+    def write(self, data: bytes):
+        """Append a record.  The caller has checked that it fits."""
+        length_struct: struct.Struct = SpillQueue.RECORD_LENGTH_STRUCT
+        length_struct.pack_into(self.map, self.write_offset, len(data))
+        start: int = self.write_offset + length_struct.size
+        self.map[start:start + len(data)] = data
+        self.write_offset = start + len(data)
+
+    def read(self)->typing.Optional[bytes]:
+        """typing.Optional[bytes]: Read the next record, or None when all of them have been read."""
+        if self.read_offset == self.write_offset:
+            return None
+        length_struct: struct.Struct = SpillQueue.RECORD_LENGTH_STRUCT
+        length: int = length_struct.unpack_from(self.map, self.read_offset)[0]
+        start: int = self.read_offset + length_struct.size
+        data: bytes = self.map[start:start + length]
+        self.read_offset = start + length
+        return data
+
+    def drained(self)->bool:
+        """bool: True when every record that was written has been read."""
+        return self.read_offset == self.write_offset
+
+    def close(self):
+        """Unmap and delete the file."""
+        self.map.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class SpillQueue(object):
+    """SpillQueue puts messages into a queue (a ShmQueue or a multiprocessing queue) without ever
+    blocking the producer: the messages that do not fit are kept, and handed to the queue in order
+    as its consumers make room.
+
+    While nothing is kept, `put` puts a message straight into the queue if it has room.  Otherwise
+    the message is pickled and kept, up to `memory_bytes` in memory and then in memory-mapped segment
+    files on local disk, and a feeder thread of the producer process moves the kept messages into the
+    queue, in the order they were put, with blocking puts.  Each segment file is deleted as soon as
+    the feeder has read all of it, so the memory tier is used again once the disk backlog is gone.
+    The memory use of the producer is therefore bounded by `memory_bytes` (plus the page cache of
+    the segment files, which the system can write out).
+
+    With `priorities`, the queue is a PriorityShmQueue and the messages are kept per priority: the
+    feeder moves the kept messages of the highest priority first, and a message goes straight into
+    the queue when no message of its priority or of a higher one is kept, so that a backlog of low
+    priority messages does not hold up the urgent ones.
+
+    Consumers get from the queue itself, in any process.  The SpillQueue belongs to the process that
+    created it, and should be the only way that this process puts into the queue.
+
+    Args:
+        queue: The queue.  It is not closed by `close`.
+        memory_bytes (int, optional): The number of pickled bytes that are kept in memory before messages
+                          are spilled to disk.  0 spills every kept message.
+                          By default, it is `SpillQueue.DEFAULT_MEMORY_BYTES`.
+        segment_size (int, optional): The size of each segment file.  A message that is larger gets a
+                          segment of its own.  By default, it is `SpillQueue.DEFAULT_SEGMENT_SIZE`.
+        spill_dir (str, optional): The directory in which a temporary directory for the segment files
+                          is made.  If it is None (default), the system's temporary directory is used.
+        priorities (int, optional): The number of priorities of the queue, which takes the `priority`
+                          keyword argument of `put`.  By default, it is 1: the messages are kept in a
+                          single tier, and the keyword arguments of `put` are only passed on.
+
+    Note:
+        - `close` waits until every kept message has been put into the queue, so the consumers must
+          keep getting until then.
+
+    Example::
+
+        mapper_queue = ShmQueue(maxsize=64)
+        spill_queue = SpillQueue(mapper_queue)
+        for line in huge_file:
+            spill_queue.put(line)  # Never blocks.
+        spill_queue.close()
+
+    """
+
+    DEFAULT_MEMORY_BYTES: int = 16 * 1024 * 1024
+    """int: The default number of pickled bytes kept in memory before messages are spilled to disk."""
+
+    DEFAULT_SEGMENT_SIZE: int = 64 * 1024 * 1024
+    """int: The default size of a segment file in bytes."""
+
+    RECORD_LENGTH_STRUCT: struct.Struct = struct.Struct('Q')
+    """The length prefix of a record in a segment file."""
+
+    def __init__(self, queue: typing.Any, memory_bytes: int = DEFAULT_MEMORY_BYTES,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE, spill_dir: typing.Optional[str] = None,
+                 priorities: int = 1):
+        if priorities < 1:
+            raise ValueError("SpillQueue needs at least one priority.")
+        self.queue: typing.Any = queue
+        self.memory_bytes: int = memory_bytes
+        self.segment_size: int = segment_size if segment_size > 0 else self.__class__.DEFAULT_SEGMENT_SIZE
+        self.spill_dir: typing.Optional[str] = spill_dir
+        self.priorities: int = priorities
+
+        # The kept messages of each priority: first those in memory, then those on disk.  `pending`
+        # also counts the message that the feeder is putting, whose priority is `feeding`.
+        self.cond: threading.Condition = threading.Condition()
+        self.memory: typing.List[typing.Deque[bytes]] = [collections.deque() for _ in range(priorities)]
+        self.memory_used: int = 0
+        self.segments: typing.List[typing.Deque[SpillSegment]] = [collections.deque() for _ in range(priorities)]
+        self.kept: typing.List[int] = [0] * priorities
+        self.segment_dir: typing.Optional[str] = None
+        self.segment_counter: int = 0
+        self.pending: int = 0
+        self.feeding: typing.Optional[int] = None
+        self.closed: bool = False
+        self.error: typing.Optional[BaseException] = None
+        self.feeder: typing.Optional[threading.Thread] = None
+
+    def put(self, msg: typing.Any, block: bool=True, timeout: typing.Optional[float]=None, **kwargs):
+        """
+        Put an object into the queue, or keep it if the queue is full.  Never blocks.
+
+        Args:
+            msg (obj): The object which is to be put into queue.
+            block (bool, optional): Ignored, for compatibility with the queue interface.
+            timeout (float, optional): Ignored, for compatibility with the queue interface.
+            kwargs: Passed to the queue's `put` (e.g. the `priority` of a PriorityShmQueue).
+
+        Raises:
+            ValueError: The SpillQueue is closed, or the priority is out of range.
+            Exception: The feeder thread failed to put a kept message; the exception is raised again.
+        """
+        priority: int = kwargs.get('priority', 0) if self.priorities > 1 else 0
+        if not 0 <= priority < self.priorities:
+            raise ValueError("SpillQueue: priority %d is not between 0 and %d" % (priority, self.priorities - 1))
+        with self.cond:
+            if self.closed:
+                raise ValueError("SpillQueue: put to a closed queue.")
+            if self.error is not None:
+                raise self.error
+            if sum(self.kept[priority:]) == 0 and (self.feeding is None or self.feeding < priority):
+                try:
+                    self.queue.put_nowait(msg, **kwargs)
+                    return
+                except Full:
+                    pass
+            data: bytes = pickle.dumps((msg, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+            if len(self.segments[priority]) == 0 and self.memory_used + len(data) <= self.memory_bytes:
+                self.memory[priority].append(data)
+                self.memory_used += len(data)
+            else:
+                self.spill(data, priority)
+            self.kept[priority] += 1
+            self.pending += 1
+            if self.feeder is None:
+                self.feeder = threading.Thread(target=self.feed, name='SpillQueue feeder', daemon=True)
+                self.feeder.start()
+            self.cond.notify()
+
+    def put_nowait(self, msg: typing.Any, **kwargs):
+        """
+        Equivalent to `put(msg)`.
+        """
+        self.put(msg, **kwargs)
+
+    def put_many(self, msgs: typing.Iterable[typing.Any], block: bool=True, timeout: typing.Optional[float]=None, **kwargs):
+        """
+        Put each object of `msgs` in turn.  See `put`.
+        """
+        msg: typing.Any
+        for msg in msgs:
+            self.put(msg, **kwargs)
+
+    def spill(self, data: bytes, priority: int=0):
+        """Append a pickled message to the last segment file of its priority, starting a new one if it
+        does not fit.  The caller must hold `cond`."""
+        segments: typing.Deque[SpillSegment] = self.segments[priority]
+        size: int = self.__class__.RECORD_LENGTH_STRUCT.size + len(data)
+        if len(segments) == 0 or segments[-1].free_bytes() < size:
+            if self.segment_dir is None:
+                self.segment_dir = tempfile.mkdtemp(prefix='pyrallel-spill-', dir=self.spill_dir)
+            segments.append(SpillSegment(os.path.join(self.segment_dir, 'segment-%d' % self.segment_counter),
+                                         max(self.segment_size, size)))
+            self.segment_counter += 1
+        segments[-1].write(data)
+
+    def pop_kept(self)->typing.Tuple[int, bytes]:
+        """typing.Tuple[int, bytes]: Take the oldest kept message of the highest priority that has one,
+        and return its priority too.  The caller must hold `cond`, and `pending` must count it."""
+        priority: int = max(p for p in range(self.priorities) if self.kept[p] > 0)
+        self.kept[priority] -= 1
+        memory: typing.Deque[bytes] = self.memory[priority]
+        if len(memory) > 0:
+            data: bytes = memory.popleft()
+            self.memory_used -= len(data)
+            return priority, data
+        segments: typing.Deque[SpillSegment] = self.segments[priority]
+        data = typing.cast(bytes, segments[0].read())
+        # A drained segment is deleted, even the one being appended to: `put` keeps new messages
+        # in memory again as long as no segment is left.
+        if segments[0].drained():
+            segments.popleft().close()
+        return priority, data
+
+    def feed(self):
+        """The feeder thread: put the kept messages into the queue, highest priority first, and oldest
+        first within a priority."""
+        while True:
+            with self.cond:
+                while self.pending == 0 and not self.closed:
+                    self.cond.wait()
+                if self.pending == 0 or self.error is not None:
+                    return
+                data: bytes
+                self.feeding, data = self.pop_kept()
+            msg: typing.Any
+            kwargs: typing.Dict[str, typing.Any]
+            msg, kwargs = pickle.loads(data)
+            del data
+            try:
+                self.queue.put(msg, **kwargs)
+            except BaseException as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.feeding = None
+                self.pending -= 1
+                if self.pending == 0:
+                    self.cond.notify_all()
+
+    def backlog(self)->int:
+        """int: The number of messages that have been kept and not yet put into the queue."""
+        with self.cond:
+            return self.pending
+
+    def spilled_bytes(self)->int:
+        """int: The number of bytes of the kept messages that are on disk, including length prefixes."""
+        with self.cond:
+            return sum(segment.write_offset - segment.read_offset for segments in self.segments for segment in segments)
+
+    def close(self):
+        """
+        Indicate no more new data will be added: wait until the feeder thread has put every kept
+        message into the queue, then delete the segment files.
+
+        Raises:
+            Exception: The feeder thread failed to put a kept message; the exception is raised again.
+        """
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        if self.feeder is not None:
+            self.feeder.join()
+        segments: typing.Deque[SpillSegment]
+        for segments in self.segments:
+            while len(segments) > 0:
+                segments.popleft().close()
+        memory: typing.Deque[bytes]
+        for memory in self.memory:
+            memory.clear()
+        if self.segment_dir is not None:
+            shutil.rmtree(self.segment_dir, ignore_errors=True)
+            self.segment_dir = None
+        if self.error is not None:
+            raise self.error
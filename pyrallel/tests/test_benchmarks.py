@@ -0,0 +1,27 @@
+import json
+import sys
+
+from pyrallel.benchmarks import header_codec
+
+
+def test_header_codec(capsys):
+    header_codec.main(['--messages', '100'])
+    assert 'us/message' in capsys.readouterr().out
+
+
+def test_queues(tmp_path):
+    if sys.version_info < (3, 8):
+        return
+
+    from pyrallel.benchmarks import queues
+
+    output = tmp_path / 'queues.json'
+    queues.main(['--sizes', '16,2K', '--chunk-sizes', '1K', '--depths', '2', '--messages', '20',
+                 '--output', str(output)])
+    results = json.loads(output.read_text())['results']
+    assert len(results) == 6
+    skipped = [r for r in results if 'skipped' in r]
+    assert [(r['queue'], r['msg_size']) for r in skipped] == [('shm', 2048)]
+    for r in results:
+        if 'skipped' not in r:
+            assert r['msgs_per_sec'] > 0 and r['latency_p50'] <= r['latency_p99']
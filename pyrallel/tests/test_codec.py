@@ -0,0 +1,23 @@
+import pytest
+
+from pyrallel import codec
+
+
+def test_codec():
+    data = b'abc' * 10000
+    for name in ('zlib', 'bz2', 'lzma'):
+        c = codec.get_codec(name)
+        codec_id, compressed = codec.compress(c, data, threshold=1024)
+        assert codec_id == c.codec_id
+        assert len(compressed) < len(data)
+        assert codec.decompress(codec_id, compressed) == data
+
+    # Short or incompressible messages are sent as they are.
+    assert codec.compress(codec.get_codec('zlib'), b'abc', threshold=1024) == (0, b'abc')
+    assert codec.compress(None, data) == (0, data)
+    assert codec.decompress(0, b'abc') == b'abc'
+
+    with pytest.raises(ValueError):
+        codec.get_codec('snappy')
+    with pytest.raises(ValueError):
+        codec.register_codec(codec.Codec(1, 'zlib2', bytes, bytes))
@@ -80,3 +80,19 @@ def test_map_reduce_object():
             mr.add_task('b', i)
     mr.task_done()
     assert mr.join() == {'a': 2450, 'b': 2500}
+
+
+def test_map_reduce_compression():
+
+    def mapper(x):
+        return 'x' * x
+
+    def reducer(r1, r2):
+        return r1 + r2
+
+    mr = MapReduce(NUM_OF_PROCESSOR, mapper, reducer, compression='zlib', compression_threshold=1024)
+    mr.start()
+    for i in range(1, 101):
+        mr.add_task(i * 100)
+    mr.task_done()
+    assert mr.join() == 'x' * 505000
@@ -1,3 +1,4 @@
+import sys
 import time
 import multiprocessing as mp
 
@@ -128,3 +129,192 @@ def test_with_multiple_output():
 
     for i in [0, 1, 4, 9, 16, 25, 36, 49]:
         assert i in result
+
+
+def test_with_shm():
+    if sys.version_info < (3, 8):
+        return
+
+    result = []
+
+    def dummy_computation_with_input(x):
+        return x * x
+
+    def collector(r):
+        result.append(r)
+
+    # The last single mapper queue is large enough for free-block magazines.
+    for single_mapper_queue, max_size_per_mapper_queue in [(False, 4), (True, 4), (True, 32)]:
+        result.clear()
+        pp = ParallelProcessor(NUM_OF_PROCESSOR, dummy_computation_with_input, collector=collector,
+                               max_size_per_mapper_queue=max_size_per_mapper_queue, max_size_per_collector_queue=4, batch_size=3,
+                               use_shm=True, single_mapper_queue=single_mapper_queue)
+        pp.start()
+
+        for i in range(100):
+            pp.add_task(i)
+
+        pp.task_done()
+        pp.join()
+
+        assert sorted(result) == [i * i for i in range(100)]
+
+
+def test_with_priorities():
+    if sys.version_info < (3, 8):
+        return
+
+    result = []
+
+    def collector(r):
+        result.append(r)
+
+    # The tasks are queued before the process starts, so it sees them all and takes the urgent ones first.
+    pp = ParallelProcessor(1, lambda x: x, collector=collector, max_size_per_mapper_queue=32,
+                           use_shm=True, single_mapper_queue=True, priorities=2)
+    for i in range(10):
+        pp.add_task(i)
+    for i in range(100, 105):
+        pp.add_task(i, _priority=1)
+    pp.start()
+    pp.task_done()
+    pp.join()
+
+    assert result == list(range(100, 105)) + list(range(10))
+
+
+class BroadcastMapper(Mapper):
+    def enter(self):
+        self.factor = 0
+
+    def receive_broadcast(self, obj):
+        self.factor = obj['factor']
+
+    def process(self, x):
+        return x * self.factor
+
+
+def test_broadcast():
+    if sys.version_info < (3, 8):
+        return
+
+    result = []
+
+    def collector(r):
+        result.append(r)
+
+    for single_mapper_queue in [False, True]:
+        result.clear()
+        pp = ParallelProcessor(NUM_OF_PROCESSOR, BroadcastMapper, collector=collector, use_shm=True,
+                               single_mapper_queue=single_mapper_queue, max_size_broadcast_queue=4)
+        pp.start()
+        pp.broadcast({'factor': 2})
+        for i in range(50):
+            pp.add_task(i)
+        pp.task_done()
+        pp.join()
+
+        assert sorted(result) == [i * 2 for i in range(50)]
+
+
+def test_put_object():
+    if sys.version_info < (3, 8):
+        return
+
+    result = []
+
+    def lookup(table, i, offset=0):
+        return bytes(table[i:i + 1])[0] + offset
+
+    def collector(r):
+        result.append(r)
+
+    pp = ParallelProcessor(NUM_OF_PROCESSOR, lookup, collector=collector, max_objects=2)
+    pp.start()
+    table = pp.put_object(bytes(range(100)))
+    offset = pp.put_object(1000)
+    for i in range(100):
+        pp.add_task(table, i, offset=offset)
+    pp.release_object(table)
+    pp.release_object(offset)
+    pp.task_done()
+    pp.join()
+
+    assert sorted(result) == [i + 1000 for i in range(100)]
+
+
+def test_spill():
+    result = []
+
+    def slow_square(x):
+        time.sleep(0.001)
+        return x * x
+
+    def collector(r):
+        result.append(r)
+
+    # The tasks are added much faster than they are processed; the first few go to disk.
+    for use_shm in ([False, True] if sys.version_info >= (3, 8) else [False]):
+        result.clear()
+        pp = ParallelProcessor(NUM_OF_PROCESSOR, slow_square, collector=collector, max_size_per_mapper_queue=2,
+                               use_shm=use_shm, single_mapper_queue=True, spill=True, spill_memory_bytes=1024)
+        pp.start()
+        for i in range(300):
+            pp.add_task(i)
+        assert pp.task_queues[0].backlog() > 0
+        pp.task_done()
+        pp.join()
+
+        assert sorted(result) == [i * i for i in range(300)]
+
+    # With a queue per process, the kept tasks go to the processes that have room, not to the slow one.
+    for use_shm in ([False, True] if sys.version_info >= (3, 8) else [False]):
+        result.clear()
+
+        def slow_first(x, _idx):
+            time.sleep(0.2 if _idx == 0 else 0.001)
+            return x, _idx
+
+        def collect_pair(x, idx):
+            result.append((x, idx))
+
+        pp = ParallelProcessor(2, slow_first, collector=collect_pair, max_size_per_mapper_queue=2, use_shm=use_shm,
+                               enable_process_id=True, spill=True, spill_memory_bytes=1024)
+        pp.start()
+        for i in range(200):
+            pp.add_task(i)
+        pp.task_done()
+        pp.join()
+
+        assert sorted(x for x, _ in result) == list(range(200))
+        assert sum(1 for _, idx in result if idx == 0) < 50
+
+
+def test_collect_waits():
+    result = []
+
+    def slow_square(x):
+        time.sleep(0.1)
+        return x * x
+
+    def collector(r):
+        result.append(r)
+
+    # The collector thread sleeps while the processes work instead of polling the queues
+    # (and a single mapper queue makes add_task sleep too).
+    for use_shm in ([False, True] if sys.version_info >= (3, 8) else [False]):
+        result.clear()
+        pp = ParallelProcessor(2, slow_square, collector=collector, use_shm=use_shm, single_mapper_queue=True)
+        if use_shm:
+            assert pp.collector_queues[0].free_notify is None
+        cpu_start, wall_start = time.process_time(), time.time()
+        pp.start()
+        for i in range(20):
+            pp.add_task(i)
+        pp.task_done()
+        pp.join()
+        cpu, wall = time.process_time() - cpu_start, time.time() - wall_start
+
+        assert sorted(result) == [i * i for i in range(20)]
+        assert wall >= 1.0
+        assert cpu < 0.5 * wall
@@ -1,7 +1,13 @@
 import multiprocessing as mp
 import queue
+import pickle
 import pyrallel
+import subprocess
+import sys
 import os
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
 
 
 # 30 bytes each
@@ -74,3 +80,1148 @@ def test_shmqueue():
                     break
 
             assert total_put == 0
+
+
+def test_shmqueue_arena():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    for use_arena in [True, False]:
+        sq = ShmQueueCls(chunk_size=10, maxsize=8, serializer=DummySerializer(), use_arena=use_arena)
+        assert len(sq.segments) == (1 if use_arena else 8)
+        sq.put(CONTENT)  # 3 chunks
+        sq.put(CONTENT[:5])
+        assert sq.get() == CONTENT
+        assert sq.get() == CONTENT[:5]
+        assert sq.get_free_block_count() == 8
+        sq.close()
+
+
+def test_shmqueue_out_of_band():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    import pickle
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=64, maxsize=100, out_of_band=True, integrity_check=True)
+    # bytearrays are pickled out-of-band with protocol 5
+    payload = {'buf': pickle.PickleBuffer(bytearray(CONTENT * 50)), 'tag': 'x'}
+    sq.put(payload)
+    sq.put(CONTENT)
+    r = sq.get()
+    assert bytes(r['buf']) == CONTENT * 50 and r['tag'] == 'x'
+    assert sq.get() == CONTENT
+    assert sq.get_free_block_count() == 100
+    sq.close()
+
+
+def spsc_sender(sq):
+    for i in range(1000):
+        sq.put((i, CONTENT))
+
+
+def test_spsc_shmqueue():
+    if not hasattr(pyrallel, 'SpscShmQueue'):
+        return
+
+    SpscShmQueueCls = getattr(pyrallel, 'SpscShmQueue')
+    for mode in ['fork', 'spawn']:
+        mp.set_start_method(mode, force=True)
+        # small ring: messages wrap around the end and the producer has to wait for room
+        sq = SpscShmQueueCls(capacity=500)
+        # the ring travels by name, not as a pickled SharedMemory
+        assert sq.__getstate__()[-1] == sq.ring.name
+        p = mp.Process(target=spsc_sender, args=(sq,))
+        p.start()
+        for i in range(1000):
+            assert sq.get(timeout=10) == (i, CONTENT)
+        p.join()
+        assert sq.empty()
+        try:
+            sq.get_nowait()
+            assert False
+        except queue.Empty:
+            pass
+        sq.close()
+    mp.set_start_method('fork', force=True)
+
+
+def spsc_echo(requests, replies):
+    # blocks without a timeout: every message needs a wakeup from the other side
+    while True:
+        msg = requests.get()
+        if msg is None:
+            return
+        replies.put(msg)
+
+
+def test_spsc_shmqueue_wakeup():
+    if not hasattr(pyrallel, 'SpscShmQueue'):
+        return
+
+    SpscShmQueueCls = getattr(pyrallel, 'SpscShmQueue')
+    requests, replies = SpscShmQueueCls(capacity=1024), SpscShmQueueCls(capacity=1024)
+    p = mp.Process(target=spsc_echo, args=(requests, replies))
+    p.start()
+    for i in range(500):
+        requests.put(i)
+        assert replies.get(timeout=10) == i
+    requests.put(None)
+    p.join()
+    requests.close()
+    replies.close()
+
+    # the creator releases an unclosed ring when the queue is collected, a copy does not
+    sq = SpscShmQueueCls(capacity=1024)
+    name = sq.ring.name
+    attached = SpscShmQueueCls.__new__(SpscShmQueueCls)
+    attached.__setstate__(sq.__getstate__())
+    del attached
+    SharedMemory(name=name).close()
+    del sq
+    try:
+        SharedMemory(name=name)
+        assert False
+    except FileNotFoundError:
+        pass
+
+
+def test_shmqueue_size_classes():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    # the footprint of two 4 KB chunks, split between two size classes
+    sq = ShmQueueCls(maxsize=2, size_classes=[4096, 64], serializer=DummySerializer())
+    assert sq.class_chunk_sizes == [64, 4096]
+    small_blocks = sq.class_block_counts[0]
+    assert small_blocks > 2 and sq.class_block_counts[1] == 1
+
+    # many small messages are in flight at the same time
+    for _ in range(small_blocks):
+        sq.put(CONTENT, block=False)
+    # large messages use the large class
+    sq.put(CONTENT * 100, block=False)
+    try:
+        sq.put(CONTENT, block=False)
+        assert False
+    except queue.Full:
+        pass
+
+    assert sq.qsize() == small_blocks + 1
+    for _ in range(small_blocks):
+        assert sq.get() == CONTENT
+    assert sq.get() == CONTENT * 100
+    assert sq.get_free_block_count() == sq.maxsize
+    sq.close()
+
+
+def test_shmqueue_put_many_get_many():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=10, maxsize=8, serializer=DummySerializer())
+    # 3 chunks each: more messages than fit in the queue at once are split into runs,
+    # which only works here because the last run fits
+    sq.put_many([CONTENT, CONTENT[:10]])
+    assert sq.qsize() == 2
+    try:
+        sq.put_many([CONTENT, CONTENT], block=False)
+        assert False
+    except queue.Full:
+        pass
+    assert sq.get_free_block_count() == 4
+    sq.put_many([CONTENT[:1]] * 4, block=False)
+    assert sq.get_many(3) == [CONTENT, CONTENT[:10], CONTENT[:1]]
+    assert sq.get_many(10) == [CONTENT[:1]] * 3
+    try:
+        sq.get_many(10, block=False)
+        assert False
+    except queue.Empty:
+        pass
+    assert sq.get_free_block_count() == 8
+    sq.close()
+
+
+def test_shmqueue_get_view():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    import struct
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=16, maxsize=4, serializer=DummySerializer(), integrity_check=True)
+    sq.put(struct.pack('II', 1, 2))
+    sq.put(CONTENT)  # 2 chunks
+    with sq.get_view() as views:
+        assert len(views) == 1
+        assert struct.unpack_from('II', views[0]) == (1, 2)
+        assert sq.get_free_block_count() == 1
+    with sq.get_view() as views:
+        assert b''.join(views) == CONTENT
+    assert sq.get_free_block_count() == 4
+
+    sq.put(CONTENT)
+    try:
+        with sq.get_view() as views:
+            kept = struct.iter_unpack('B', views[0])  # holds an export of the view
+        assert False
+    except BufferError:
+        pass
+    del kept
+    assert sq.get_free_block_count() == 4
+    sq.close()
+
+
+def elastic_receiver(q, n):
+    for i in range(n):
+        assert q.get(timeout=10) == CONTENT
+
+
+def test_shmqueue_elastic():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=32, serializer=DummySerializer(), max_bytes=32 * 10, min_blocks=2, grow_blocks=4,
+                     idle_timeout=0)
+    # The consumer is started before the pool grows and picks up the new extents transparently.
+    p = mp.Process(target=elastic_receiver, args=(sq, 10))
+    p.start()
+    for _ in range(10):
+        sq.put(CONTENT, timeout=10)
+    p.join()
+    assert p.exitcode == 0
+
+    # A burst beyond the initial pool grows it to the 10 block cap instead of blocking.
+    for _ in range(10):
+        sq.put(CONTENT, block=False)
+    assert len(sq.extent_segments) == 2
+    try:
+        sq.put(CONTENT, block=False)
+        assert False
+    except queue.Full:
+        pass
+    assert sq.full()
+
+    # Once everything is free and the quiet period has passed, the extents are released.
+    for _ in range(10):
+        assert sq.get() == CONTENT
+    sq.shrink_pool()
+    assert sq.get_free_block_count() == 2
+    assert len(sq.extent_segments) == 0
+    sq.put(CONTENT)
+    assert sq.get() == CONTENT
+    sq.close()
+
+
+def idle_receiver(q, r):
+    r.put(q.get(timeout=10))
+
+
+def test_shmqueue_elastic_idle():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    # A process that waits on an idle queue releases its extents once the quiet period has passed.
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    for use_semaphores in [True, False]:
+        sq = ShmQueueCls(chunk_size=32, serializer=DummySerializer(), max_bytes=32 * 10, min_blocks=2, grow_blocks=4,
+                         idle_timeout=0.2, use_semaphores=use_semaphores)
+        for _ in range(6):
+            sq.put(CONTENT, block=False)
+        assert sq.get_pool_header()[0] == 1
+        for _ in range(6):
+            assert sq.get() == CONTENT
+        r = mp.Queue()
+        p = mp.Process(target=idle_receiver, args=(sq, r))
+        p.start()
+        deadline = time.time() + 5
+        while sq.get_pool_header()[0] > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sq.get_pool_header()[0] == 0
+        sq.put(CONTENT)
+        assert r.get(timeout=10) == CONTENT
+        p.join()
+        assert sq.get_free_block_count() == 2
+        sq.close()
+
+
+def compression_receiver(q, expected):
+    for msg in expected:
+        assert q.get(timeout=10) == msg
+
+
+def test_shmqueue_compression():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=1024, maxsize=4, compression='zlib', compression_threshold=256)
+    large = {'text': 'abc' * 10000}
+    small = ['abc']
+    # The large message fits in the 4 blocks only because it is compressed.
+    sq.put(large)
+    sq.put(small)
+    assert sq.get() == large
+    assert sq.get() == small
+
+    sq.put(large)
+    with sq.get_view() as views:
+        assert pickle.loads(views[0]) == large
+
+    # The receiving process needs no compression setting.
+    p = mp.Process(target=compression_receiver, args=(sq, [large, small]))
+    p.start()
+    sq.put(large)
+    sq.put(small)
+    p.join()
+    assert p.exitcode == 0
+    sq.close()
+
+
+def stats_receiver(q, n):
+    for i in range(n):
+        q.get(timeout=10)
+
+
+def stats_holder(q, started, done):
+    q.put(1)
+    q.get()
+    started.set()
+    done.wait(10)
+
+
+def stats_claimer(q, r):
+    try:
+        q.put(1)
+        r.put('put')
+    except ValueError:
+        r.put('ValueError')
+
+
+def test_shmqueue_stats():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    # Only a queue that asks for them has counters.
+    sq = ShmQueueCls(chunk_size=16, maxsize=4)
+    assert sq.stats_segment is None
+    sq.put(1)
+    assert sq.get() == 1
+    try:
+        sq.stats()
+        assert False
+    except ValueError:
+        pass
+    sq.close()
+
+    sq = ShmQueueCls(chunk_size=16, maxsize=4, serializer=DummySerializer(), stats=True)
+    sq.put(CONTENT[:10])
+    sq.put(CONTENT)  # 2 chunks
+    try:
+        sq.put(CONTENT[:10] * 3, block=False)  # 2 chunks, but only 1 block is free
+        assert False
+    except queue.Full:
+        pass
+    # The counters of the receiving process are visible here.
+    p = mp.Process(target=stats_receiver, args=(sq, 2))
+    p.start()
+    p.join()
+    assert p.exitcode == 0
+    try:
+        sq.get(block=False)
+        assert False
+    except queue.Empty:
+        pass
+
+    stats = sq.stats()
+    assert stats['puts'] == 2 and stats['gets'] == 2
+    assert stats['bytes_in'] == 40 and stats['bytes_out'] == 40
+    assert stats['full'] == 1 and stats['empty'] == 1
+    assert stats['max_queued'] == 2 and stats['max_msg_chunks'] == 2
+    assert stats['chunks_histogram'] == {1: 1, 2: 1}
+    assert stats['queued'] == 0 and stats['free_blocks'] == 4
+    assert stats['free_wait_time'] >= 0 and stats['msg_wait_time'] >= 0
+    sq.close()
+
+    # The slots of exited processes are taken over, with their counts.
+    sq = ShmQueueCls(chunk_size=16, maxsize=4, stats=True, stats_slots=2)
+    for _ in range(3):
+        sq.put(1)
+        p = mp.Process(target=stats_receiver, args=(sq, 1))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+    stats = sq.stats()
+    assert stats['puts'] == 3 and stats['gets'] == 3
+
+    # A process that finds every slot owned by a live process fails before it takes a block.
+    started, done, r = mp.Event(), mp.Event(), mp.Queue()
+    holder = mp.Process(target=stats_holder, args=(sq, started, done))
+    holder.start()
+    assert started.wait(10)
+    p = mp.Process(target=stats_claimer, args=(sq, r))
+    p.start()
+    assert r.get(timeout=10) == 'ValueError'
+    p.join()
+    done.set()
+    holder.join()
+    assert sq.get_free_block_count() == 4
+    sq.close()
+
+    # Threads of one process share its slot without losing counts.
+    sq = ShmQueueCls(chunk_size=16, maxsize=64, stats=True)
+
+    def put_get():
+        for i in range(2000):
+            sq.put(i)
+            sq.get()
+
+    threads = [threading.Thread(target=put_get) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = sq.stats()
+    assert stats['puts'] == 8000 and stats['gets'] == 8000
+    sq.close()
+
+
+def channel_receiver(q, r):
+    r.put((q.channel_id, q.get(timeout=10), q.get(timeout=10)))
+
+
+def test_shm_channel_group():
+    if not hasattr(pyrallel, 'ShmChannelGroup'):
+        return
+
+    ShmChannelGroupCls = getattr(pyrallel, 'ShmChannelGroup')
+    for mode in ['fork', 'spawn']:
+        mp.set_start_method(mode, force=True)
+        group = ShmChannelGroupCls(3, chunk_size=64, maxsize=6)
+        channels = [group.channel(i) for i in range(3)]
+        for i, q in enumerate(channels):
+            q.put(i)
+            q.put(i * 10)
+        # The blocks are pooled: one channel can not put more once the group is full.
+        assert [q.qsize() for q in channels] == [2, 2, 2]
+        assert channels[0].full()
+
+        r = mp.Queue()
+        ps = [mp.Process(target=channel_receiver, args=(q, r)) for q in channels]
+        for p in ps:
+            p.start()
+        assert sorted(r.get(timeout=10) for _ in ps) == [(0, 0, 0), (1, 1, 10), (2, 2, 20)]
+        for p in ps:
+            p.join()
+
+        # The channels keep working when the group object is gone, and closing is idempotent.
+        del group
+        channels[1].put_many(['a', 'b'])
+        assert channels[1].get_many(5) == ['a', 'b']
+        for q in channels:
+            q.close()
+    mp.set_start_method('fork', force=True)
+
+
+def test_shm_channel_group_limit():
+    if not hasattr(pyrallel, 'ShmChannelGroup'):
+        return
+
+    # A channel is full at max_size_per_channel messages even though the pool has free blocks.
+    group = pyrallel.ShmChannelGroup(2, chunk_size=64, maxsize=8, max_size_per_channel=2)
+    channels = [group.channel(i) for i in range(2)]
+    channels[0].put(1)
+    channels[0].put(2)
+    for put in [lambda: channels[0].put_nowait(3), lambda: channels[0].put(3, timeout=0.1),
+                lambda: channels[0].put_many([3], block=False)]:
+        try:
+            put()
+            assert False
+        except queue.Full:
+            pass
+    channels[1].put_many([3, 4])
+    assert channels[0].get() == 1
+    channels[0].put(5)
+    assert channels[0].get_many(3) == [2, 5]
+    assert channels[1].get_many(3) == [3, 4]
+    # A batch larger than the limit goes in slices of the limit.
+    try:
+        channels[0].put_many([6, 7, 8], block=False)
+        assert False
+    except queue.Full:
+        pass
+    assert channels[0].get_many(3) == [6, 7]
+    consumer = threading.Thread(target=lambda: [channels[0].get(timeout=10) for _ in range(5)])
+    consumer.start()
+    channels[0].put_many(list(range(5)), timeout=10)
+    consumer.join()
+    assert channels[0].empty() and group.get_free_block_count() == 8
+
+    # With several producers, a channel never holds more than the limit.
+    def producer():
+        for i in range(200):
+            channels[1].put(i)
+            channels[1].put_many([i])
+
+    threads = [threading.Thread(target=producer) for _ in range(4)]
+    for t in threads:
+        t.start()
+    got = 0
+    while got < 1600:
+        assert channels[1].qsize() <= 2
+        got += len(channels[1].get_many(2, timeout=10))
+    for t in threads:
+        t.join()
+    group.close()
+
+
+def priority_receiver(q, r):
+    r.put([q.get(timeout=10) for _ in range(5)])
+
+
+def test_priority_shmqueue():
+    if not hasattr(pyrallel, 'PriorityShmQueue'):
+        return
+
+    PriorityShmQueueCls = getattr(pyrallel, 'PriorityShmQueue')
+    for mode in ['fork', 'spawn']:
+        mp.set_start_method(mode, force=True)
+        sq = PriorityShmQueueCls(3, chunk_size=64, maxsize=8)
+        sq.put('bulk 1')
+        sq.put('bulk 2')
+        sq.put_nowait('normal', priority=1)
+        sq.put_many(['urgent 1', 'urgent 2'], priority=2)
+        assert sq.get_priority_counts() == [2, 1, 2]
+        assert sq.qsize() == 5
+        try:
+            sq.put('bad', priority=3)
+            assert False
+        except ValueError:
+            pass
+
+        r = mp.Queue()
+        p = mp.Process(target=priority_receiver, args=(sq, r))
+        p.start()
+        assert r.get(timeout=10) == ['urgent 1', 'urgent 2', 'normal', 'bulk 1', 'bulk 2']
+        p.join()
+        assert sq.empty()
+
+        # get_many takes the highest priorities first as well.
+        sq.put_many([1, 2, 3])
+        sq.put(4, priority=1)
+        assert sq.get_many(3) == [4, 1, 2]
+        assert sq.get() == 3
+        assert sq.get_free_block_count() == 8
+
+        sq.close()
+
+        # Threads sharing the object put at their own priorities.
+        sq = PriorityShmQueueCls(3, chunk_size=64, maxsize=1000)
+
+        def put_priority(priority):
+            for i in range(150):
+                sq.put((priority, i), priority=priority)
+                sq.put_many([(priority, i)], priority=priority)
+
+        threads = [threading.Thread(target=put_priority, args=(priority,)) for priority in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sq.get_priority_counts() == [300, 300, 300]
+        received = sq.get_many(900)
+        assert [p for p, i in received] == [2] * 300 + [1] * 300 + [0] * 300
+        sq.close()
+    mp.set_start_method('fork', force=True)
+
+
+def broadcast_receiver(q, r):
+    r.put((q.channel_id, q.get(timeout=10), q.get(timeout=10)))
+
+
+def test_shm_broadcast_queue():
+    if not hasattr(pyrallel, 'ShmBroadcastQueue'):
+        return
+
+    ShmBroadcastQueueCls = getattr(pyrallel, 'ShmBroadcastQueue')
+    for mode in ['fork', 'spawn']:
+        mp.set_start_method(mode, force=True)
+        sq = ShmBroadcastQueueCls(3, chunk_size=16, maxsize=4, serializer=DummySerializer())
+        subscribers = [sq.subscriber(i) for i in range(3)]
+        sq.put(CONTENT)  # 2 chunks, shared by the 3 subscribers
+        assert sq.get_free_block_count() == 2
+        r = mp.Queue()
+        ps = [mp.Process(target=broadcast_receiver, args=(q, r)) for q in subscribers[1:]]
+        for p in ps:
+            p.start()
+        sq.put(CONTENT[:5])
+        assert sorted(r.get(timeout=10) for _ in ps) == [(1, CONTENT, CONTENT[:5]), (2, CONTENT, CONTENT[:5])]
+        for p in ps:
+            p.join()
+
+        # The blocks are held until the last subscriber has read the messages.
+        assert sq.get_free_block_count() == 1
+        try:
+            sq.put(CONTENT, block=False)
+            assert False
+        except queue.Full:
+            pass
+        assert subscribers[0].qsize() == 2 and subscribers[1].empty()
+        with subscribers[0].get_view() as views:
+            assert b''.join(views) == CONTENT
+        assert subscribers[0].get_many(5) == [CONTENT[:5]]
+        assert sq.get_free_block_count() == 4
+        sq.put_many([b'a', b'b', b'c'])
+        assert subscribers[1].get_many(2) == [b'a', b'b']
+        assert sq.get_free_block_count() == 1
+        assert [q.get_many(5) for q in subscribers] == [[b'a', b'b', b'c'], [b'c'], [b'a', b'b', b'c']]
+        assert sq.get_free_block_count() == 4
+        for q in subscribers:
+            q.close()
+    mp.set_start_method('fork', force=True)
+
+
+def test_shm_broadcast_queue_max_lag():
+    if not hasattr(pyrallel, 'ShmBroadcastQueue'):
+        return
+
+    ShmBroadcastQueueCls = getattr(pyrallel, 'ShmBroadcastQueue')
+    sq = ShmBroadcastQueueCls(2, chunk_size=16, maxsize=4, max_lag=2, serializer=DummySerializer())
+    reader, idle = sq.subscriber(0), sq.subscriber(1)
+    # The idle subscriber would hold every block and stall the publisher.
+    for i in range(10):
+        sq.put(b'%d' % i, timeout=10)
+        assert reader.get(timeout=10) == b'%d' % i
+    assert sq.get_free_block_count() == 4
+    assert idle.qsize() == 0
+    try:
+        idle.get(timeout=1)
+        assert False
+    except ValueError:
+        pass
+    sq.close()
+
+
+def async_sender(q, n):
+    for i in range(n):
+        q.put(i, timeout=10)
+
+
+def async_receiver(q, n, r):
+    r.put(sorted(q.get(timeout=10) for _ in range(n)))
+
+
+def notify_watcher(q, ready, r):
+    reader = q.notify_reader(q.NOTIFY_MSG)
+    q.watch(q.NOTIFY_MSG)
+    ready.set()
+    count = 0
+    while count < 3 and mp.connection.wait([reader], 10):
+        count += q.drain_notify(reader)
+    r.put(count)
+
+
+def test_async_shmqueue():
+    if not hasattr(pyrallel, 'AsyncShmQueue'):
+        return
+
+    import asyncio
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    AsyncShmQueueCls = getattr(pyrallel, 'AsyncShmQueue')
+    sq = ShmQueueCls(chunk_size=64, maxsize=4, notify=True)
+    q = AsyncShmQueueCls(sq)
+
+    async def consume(received):
+        while True:
+            msg = await q.get()
+            if msg is None:
+                return
+            received.append(msg)
+
+    async def run_consumers():
+        # Many coroutines wait on a queue fed by another process.
+        received = []
+        consumers = [asyncio.ensure_future(consume(received)) for _ in range(50)]
+        p = mp.Process(target=async_sender, args=(sq, 200))
+        p.start()
+        while len(received) < 200:
+            await asyncio.sleep(0.01)
+        for _ in consumers:
+            await q.put(None)
+        await asyncio.gather(*consumers)
+        p.join()
+        return sorted(received)
+
+    async def run_producers():
+        # Coroutines wait for free blocks while another process drains the queue.
+        r = mp.Queue()
+        p = mp.Process(target=async_receiver, args=(sq, 100, r))
+        p.start()
+        await asyncio.gather(*(q.put(i) for i in range(100)))
+        p.join()
+        return r.get(timeout=10)
+
+    async def run_timeout():
+        try:
+            await q.get(timeout=0.1)
+            assert False
+        except queue.Empty:
+            pass
+
+    assert asyncio.run(run_consumers()) == list(range(200))
+    assert asyncio.run(run_producers()) == list(range(100))
+    asyncio.run(run_timeout())
+    q.close()
+    sq.close()
+
+    # In 'msg' mode only the consumers are woken, and freeing blocks writes to no pipe.
+    sq = ShmQueueCls(chunk_size=64, maxsize=4, notify='msg')
+    assert sq.free_notify is None
+    reader = sq.notify_reader(ShmQueueCls.NOTIFY_MSG)
+    # Nothing is written while no process watches the queue.
+    for i in range(10):
+        sq.put(i)
+        assert sq.get() == i
+    assert ShmQueueCls.drain_notify(reader) == 0
+    sq.watch(ShmQueueCls.NOTIFY_MSG)
+    for i in range(100):
+        sq.put(i)
+        assert sq.get() == i
+    assert ShmQueueCls.drain_notify(reader) == 100
+    sq.watch(ShmQueueCls.NOTIFY_MSG, False)
+    sq.put(0)
+    assert sq.get() == 0
+    assert ShmQueueCls.drain_notify(reader) == 0
+
+    # Each watching process has a pipe of its own, so none of them takes the wakeups of another.
+    sq.watch(ShmQueueCls.NOTIFY_MSG)
+    ready, r = mp.Event(), mp.Queue()
+    p = mp.Process(target=notify_watcher, args=(sq, ready, r))
+    p.start()
+    assert ready.wait(10)
+    sq.put_many([1, 2, 3])
+    assert r.get(timeout=10) == 3
+    p.join()
+    assert ShmQueueCls.drain_notify(reader) == 3
+    sq.watch(ShmQueueCls.NOTIFY_MSG, False)
+    try:
+        AsyncShmQueueCls(sq)
+        assert False
+    except ValueError:
+        pass
+    try:
+        ShmQueueCls(notify='free')
+        assert False
+    except ValueError:
+        pass
+    sq.close()
+
+
+class BytesSubclass(bytes):
+    pass
+
+
+def test_shmqueue_fast_types():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=16, maxsize=16, integrity_check=True)
+    msgs = [CONTENT, bytearray(CONTENT), 'café \ud800', BytesSubclass(b'sub'), ('a', b'b')]
+    for msg in msgs:
+        sq.put(msg)
+    sq.put(memoryview(CONTENT)[::2])
+    for msg in msgs:
+        r = sq.get()
+        assert r == msg and type(r) is type(msg)
+    assert sq.get() == CONTENT[::2]
+
+    # Raw messages can be borrowed with nothing to deserialize.
+    sq.put(CONTENT)
+    with sq.get_view() as views:
+        assert b''.join(views) == CONTENT
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        arrays = [np.arange(12, dtype=np.float32).reshape(3, 4), np.array(5, dtype='>i2'),
+                  np.zeros((2, 0)), np.arange(6).reshape(2, 3).T]  # the last one is in Fortran order
+        for a in arrays:
+            sq.put(a)
+            r = sq.get()
+            assert r.dtype == a.dtype and r.shape == a.shape and (r == a).all()
+            r[...] = 0  # writable, like an unpickled array
+    assert sq.get_free_block_count() == 16
+    sq.close()
+
+
+def object_store_reader(store, handle, r):
+    r.put(bytes(store.get_object(handle)))
+    store.release_object(handle)
+
+
+def test_shm_object_store():
+    if not hasattr(pyrallel, 'ShmObjectStore'):
+        return
+
+    ShmObjectStoreCls = getattr(pyrallel, 'ShmObjectStore')
+    store = ShmObjectStoreCls(max_objects=2)
+    handle = store.put_object(CONTENT)
+    assert store.get_object(handle) == CONTENT
+    assert store.get_object(store.put_object({'a': [1, 2]})) == {'a': [1, 2]}
+    try:
+        store.put_object(CONTENT)
+        assert False
+    except ValueError:
+        pass
+
+    # Each process that is sent the handle holds a reference.
+    for mode in ['fork', 'spawn']:
+        mp.set_start_method(mode, force=True)
+        shared_store = ShmObjectStoreCls()
+        assert shared_store.__getstate__()[-1] == shared_store.table.name
+        shared_handle = shared_store.put_object(CONTENT)
+        shared_store.incref(shared_handle, 2)
+        r = mp.Queue()
+        ps = [mp.Process(target=object_store_reader, args=(shared_store, shared_handle, r)) for _ in range(2)]
+        for p in ps:
+            p.start()
+        assert [r.get(timeout=10) for _ in ps] == [CONTENT, CONTENT]
+        for p in ps:
+            p.join()
+        assert shared_store.is_alive(shared_handle)
+        shared_store.release_object(shared_handle)
+        assert shared_store.object_count() == 0
+        shared_store.close()
+    mp.set_start_method('fork', force=True)
+
+    view = store.get_object(handle)
+    store.release_object(handle)
+    assert not store.is_alive(handle) and store.object_count() == 1
+    try:
+        store.incref(handle)
+        assert False
+    except ValueError:
+        pass
+    del view  # the segment stays mapped while a view is alive
+    store.unmap_freed()
+    assert handle.name not in store.segments
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        a = np.arange(100, dtype=np.float64).reshape(10, 10)
+        array_handle = store.put_object({'array': a})
+        b = store.get_object(array_handle)['array']
+        assert (a == b).all() and not b.flags.writeable
+        assert b.ctypes.data % ShmObjectStoreCls.PART_ALIGNMENT == 0
+        del b
+    store.close()
+
+
+def array_receiver(q, r):
+    r.put(q.get_array(timeout=10).tolist())
+
+
+def test_shm_array_queue():
+    if not hasattr(pyrallel, 'ShmArrayQueue'):
+        return
+    try:
+        import numpy as np
+    except ImportError:
+        return
+
+    ShmArrayQueueCls = getattr(pyrallel, 'ShmArrayQueue')
+    sq = ShmArrayQueueCls(chunk_size=64, maxsize=16, integrity_check=True)
+    a = np.arange(12, dtype=np.int32).reshape(3, 4)
+    sq.put_array(a)
+    sq.put_array(np.asfortranarray(a))
+    sq.put_array(a[:, ::2])  # not contiguous: copied to C order
+    r = sq.get_array()
+    assert r.dtype == a.dtype and (r == a).all() and r.flags.c_contiguous
+    r = sq.get_array()
+    assert (r == a).all() and r.flags.f_contiguous
+    out = np.empty((3, 2), dtype=np.int32)
+    assert sq.get_array(out=out) is out and (out == a[:, ::2]).all()
+
+    # A single-chunk array can be used in place.
+    sq.put_array(np.arange(4.0))
+    with sq.get_array_view() as v:
+        assert v.tolist() == [0.0, 1.0, 2.0, 3.0] and not v.flags.writeable
+        assert sq.get_free_block_count() == 15
+    sq.put_array(np.arange(40.0))  # several chunks: a copy
+    with sq.get_array_view() as v:
+        assert v.tolist() == list(np.arange(40.0))
+    assert sq.get_free_block_count() == 16
+
+    try:
+        sq.put_array(np.array([{}]))
+        assert False
+    except TypeError:
+        pass
+
+    r = mp.Queue()
+    p = mp.Process(target=array_receiver, args=(sq, r))
+    p.start()
+    sq.put(a)
+    assert r.get(timeout=10) == a.tolist()
+    p.join()
+    sq.close()
+
+
+def delayed_sender(q, n, delay):
+    for i in range(n):
+        time.sleep(delay)
+        q.put(i, timeout=10)
+
+
+def test_shmqueue_wait_policy():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    # Spinning is opt-in.
+    sq = ShmQueueCls(chunk_size=64, maxsize=2)
+    assert sq.spin_time == 0.0 and sq.spin_budget() == 0.0
+    sq.close()
+    for use_semaphores in [True, False]:
+        sq = ShmQueueCls(chunk_size=64, maxsize=2, use_semaphores=use_semaphores, poll_max_sleep=1e-3, spin_time=50e-6)
+        time_start = time.time()
+        try:
+            sq.get(timeout=0.05)
+            assert False
+        except queue.Empty:
+            pass
+        assert 0.05 <= time.time() - time_start < 1
+
+        # Waits much longer than spin_time turn spinning off.
+        p = mp.Process(target=delayed_sender, args=(sq, 5, 0.02))
+        p.start()
+        assert [sq.get(timeout=10) for _ in range(5)] == list(range(5))
+        p.join()
+        assert sq.spin_budget() == 0.0
+
+        # Quick hand-offs turn it back on.
+        for i in range(50):
+            sq.put(i)
+            assert sq.get(timeout=10) == i
+            sq.observe_wait(0.0)
+        assert sq.spin_budget() == sq.spin_time
+        sq.close()
+
+
+def magazine_worker(q, r, n):
+    r.put(sum(q.get(timeout=10) for _ in range(n)))
+
+
+def test_shmqueue_magazines():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=64, maxsize=32, magazine_size=8)
+    sq.put(1)
+    assert sq.get() == 1
+    # The producer took half a magazine off the free list, and the consumer keeps the freed block.
+    assert sq.get_free_block_count() == 32
+    words = sq.get_magazine_view()
+    assert words[sq.magazine_offset(sq.magazine_slot, 0)] == 4
+    sq.put_many(list(range(6)))
+    assert sq.get_many(6) == list(range(6))
+    assert sq.get_free_block_count() == 32
+
+    # The consumers keep freed blocks in their magazines, more than the pool holds when they
+    # are idle; the starving producer reclaims them.
+    for use_semaphores in [True, False]:
+        sq2 = ShmQueueCls(chunk_size=64, maxsize=4, magazine_size=8, use_semaphores=use_semaphores)
+        r = mp.Queue()
+        ps = [mp.Process(target=magazine_worker, args=(sq2, r, 100)) for _ in range(3)]
+        for p in ps:
+            p.start()
+        for i in range(300):
+            sq2.put(i, timeout=10)
+        assert sum(r.get(timeout=10) for _ in ps) == sum(range(300))
+        for p in ps:
+            p.join()
+        assert sq2.get_free_block_count() == 4
+        sq2.close()
+    sq.close()
+
+
+def test_shmqueue_magazine_late_release():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    # Blocks that land in another process's magazine after a starving producer looked at it
+    # (that process had not seen the starving flag yet) are still found by the producer.
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    sq = ShmQueueCls(chunk_size=64, maxsize=4, magazine_size=8)
+    words = sq.get_magazine_view()
+    block_ids = sq.take_global_free_blocks(0, 4)
+    assert len(block_ids) == 4
+    with sq.free_list_lock:
+        words[0] = max(words[0], 2)
+    other = 1 if sq.magazine_slot != 1 else 0
+
+    def release_late():
+        time.sleep(0.3)
+        offset = sq.magazine_offset(other, 0)
+        with sq.magazine_locks[other]:
+            for i, block_id in enumerate(block_ids):
+                words[offset + 1 + i] = block_id
+            words[offset] = len(block_ids)
+
+    t = threading.Thread(target=release_late)
+    t.start()
+    sq.put(1, timeout=5)
+    t.join()
+    assert sq.get() == 1
+    assert sq.get_free_block_count() == 4
+    sq.close()
+
+
+def lazy_receiver(q, r):
+    # A spawned process maps no blocks until it touches them.
+    mapped = len(q.data_blocks)
+    opened = sum(1 for segment in q.segments if segment is not None)
+    msg = q.get(timeout=10)
+    r.put((mapped, opened, msg, len(q.data_blocks)))
+
+
+def test_shmqueue_lazy_attach():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    mp.set_start_method('spawn', force=True)
+    for use_arena in [True, False]:
+        sq = ShmQueueCls(chunk_size=64, maxsize=256, use_arena=use_arena)
+        r = mp.Queue()
+        p = mp.Process(target=lazy_receiver, args=(sq, r))
+        p.start()
+        sq.put('x' * 100)
+        mapped, opened, msg, mapped_after = r.get(timeout=10)
+        p.join()
+        assert (mapped, opened, msg) == (0, 0, 'x' * 100)
+        assert 0 < mapped_after < 256
+        sq.close()
+    mp.set_start_method('fork', force=True)
+
+
+
+NAMED_QUEUE_CLIENT = '''
+import sys
+from pyrallel.queue import ShmQueue
+requests = ShmQueue.attach(sys.argv[1])
+replies = ShmQueue.attach(sys.argv[2])
+for _ in range(3):
+    replies.put(requests.get(timeout=10) * 2, timeout=10)
+requests.close()
+replies.close()
+'''
+
+
+def test_shmqueue_named():
+    if not hasattr(pyrallel, 'ShmQueue'):
+        return
+
+    ShmQueueCls = getattr(pyrallel, 'ShmQueue')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(pyrallel.__file__))))
+    for use_arena in [True, False]:
+        names = ['pyrallel-test-%d-%d-%d' % (os.getpid(), use_arena, i) for i in range(2)]
+        requests = ShmQueueCls.create(names[0], chunk_size=64, maxsize=8, use_arena=use_arena)
+        replies = ShmQueueCls.create(names[1], chunk_size=64, maxsize=8, use_arena=use_arena)
+        # An independently started process attaches by name and answers each message doubled.
+        client = subprocess.Popen([sys.executable, '-c', NAMED_QUEUE_CLIENT] + names, env=env)
+        for i in range(3):
+            requests.put(i + 1)
+            assert replies.get(timeout=10) == 2 * (i + 1)
+        assert client.wait(timeout=10) == 0
+        # The client's exit left the queues intact.
+        requests.put('after')
+        assert requests.get(timeout=1) == 'after'
+        assert requests.get_free_block_count() == 8
+        requests.close()
+        replies.close()
+        try:
+            ShmQueueCls.attach(names[0])
+            assert False
+        except FileNotFoundError:
+            pass
+
+
+def spill_receiver(q, n, r):
+    r.put([q.get(timeout=10) for _ in range(n)])
+
+
+def test_spill_queue():
+    queues = [mp.Queue(maxsize=2)]
+    if hasattr(pyrallel, 'ShmQueue'):
+        queues.append(getattr(pyrallel, 'ShmQueue')(chunk_size=4096, maxsize=2))
+    for q in queues:
+        sq = pyrallel.SpillQueue(q, memory_bytes=200, segment_size=1024)
+        # Nothing gets from the queue yet: the first messages fit in it, some more in memory, the rest on disk.
+        msgs = [(i, 'x' * (i % 50)) for i in range(500)] + [b'y' * 5000]
+        for msg in msgs:
+            sq.put(msg)
+        assert sq.backlog() > 0
+        assert sq.spilled_bytes() > 0
+        segment_dir = sq.segment_dir
+        assert len(os.listdir(segment_dir)) > 1
+
+        r = mp.Queue()
+        p = mp.Process(target=spill_receiver, args=(q, len(msgs), r))
+        p.start()
+        assert r.get(timeout=30) == msgs
+        p.join()
+        # The feeder counts the last message as kept until its put returns.
+        deadline = time.time() + 10
+        while sq.backlog() > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert sq.backlog() == 0
+        # The segment files are gone once read, and the next backlog is kept in memory.
+        assert os.listdir(segment_dir) == []
+        for i in range(5):
+            sq.put(i)
+        assert sq.backlog() == 3
+        assert sq.spilled_bytes() == 0
+        assert os.listdir(segment_dir) == []
+        assert [q.get(timeout=10) for _ in range(5)] == list(range(5))
+        sq.close()
+        assert not os.path.exists(segment_dir)
+        try:
+            sq.put(1)
+            assert False
+        except ValueError:
+            pass
+        q.close()
+
+    if hasattr(pyrallel, 'PriorityShmQueue'):
+        # The kept messages of the highest priority are fed first, and urgent ones skip the backlog.
+        q = getattr(pyrallel, 'PriorityShmQueue')(2, chunk_size=4096, maxsize=2)
+        sq = pyrallel.SpillQueue(q, memory_bytes=200, segment_size=1024, priorities=2)
+        for i in range(100):
+            sq.put(('bulk', i))
+        for i in range(20):
+            sq.put(('urgent', i), priority=1)
+        try:
+            sq.put('bad', priority=2)
+            assert False
+        except ValueError:
+            pass
+        received = [q.get(timeout=10) for _ in range(120)]
+        assert received[0] == ('bulk', 0)
+        assert [msg for msg in received[2:] if msg[0] == 'urgent'] == [('urgent', i) for i in range(20)]
+        assert [msg for msg in received if msg[0] == 'bulk'] == [('bulk', i) for i in range(100)]
+        # Only the message the feeder was putting when the urgent ones came is ahead of them.
+        assert received.index(('urgent', 0)) <= 3
+        sq.close()
+        q.close()